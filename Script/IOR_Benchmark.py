@@ -0,0 +1,477 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Benchmark
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+The only way to tell whether a change made the IOR faster used to be running it against production BCGW, where
+the timings depend on the network, the database and whoever else is using them. The benchmark generates a
+province-like set of layers in BC Albers (EPSG:3005) of a chosen size, AOIs of different areas and vertex
+counts and a configuration spreadsheet with the same IOR_Data and Apps sheets as the MASTER spreadsheet, then
+runs the report against them with the shapely geometry engine on Linux:
+
+    - Tenures: a grid of tenure-like polygons, size features
+    - Roads: long polylines (random walks across the extent), size / 10 features
+    - Wells: dense points in clusters, size features
+    - Well Sites: multipoints of 10 points each, size / 10 features
+    - Districts and map sheets for the Districts_and_BCGS-NTS_Location sheet
+
+The stages of each case (processAOI, processData, each step of each layer and each sheet writer) are timed in a
+run trace (IOR_Run_Trace.py), and the totals are added to results.jsonl in the benchmark folder, so the runs
+of different versions of the IOR can be compared over time.
+
+    python IOR_Benchmark.py --generate --sizes 1000 100000
+    python IOR_Benchmark.py --run --sizes 1000 100000 --aois small large --label "containment fast path"
+    python IOR_Benchmark.py --compare
+'''
+
+import os
+import math
+import json
+import time
+import socket
+import platform
+import argparse
+import subprocess
+from collections import OrderedDict
+from IOR_Geometry_Engine import getEngine, addMessage
+from IOR_Layer_Catalog import loadCatalog
+from IOR_Run_Trace import RunTrace
+
+try:
+    import numpy
+    import fiona
+    import openpyxl
+    from fiona.crs import CRS
+    from shapely.geometry import Polygon, LineString, Point, MultiPoint, box, mapping
+except ImportError:
+    fiona = None
+
+## Local folder of the generated data and of the benchmark results
+if os.environ.get('LOCALAPPDATA'):
+    defaultBenchmarkFolder = os.path.join(os.environ['LOCALAPPDATA'], 'IOR', 'Benchmark')
+else:
+    defaultBenchmarkFolder = os.path.join(os.path.expanduser('~'), '.ior', 'benchmark')
+
+## Layer sizes (features in the tenure and well layers) the benchmark is usually run at
+benchmarkSizes = [1000, 10000, 100000, 1000000, 5000000]
+
+## The 200 km square of BC Albers the layers are generated in (minx, miny, maxx, maxy), around Prince George
+benchmarkExtent = (1100000.0, 900000.0, 1300000.0, 1100000.0)
+
+## AOIs of the benchmark: name -> (hectares, vertices)
+aoiCases = OrderedDict([
+    ('small', (100, 16)),
+    ('medium', (10000, 500)),
+    ('large', (1000000, 5000)),
+    ('detailed', (1000000, 200000)),
+])
+
+## Columns of the IOR_Data sheet of the configuration spreadsheet
+catalogColumns = (['GUID', 'Category', 'Featureclass_Name', 'Restricted', 'workspace_path', 'dataSource', 'shapeType', 'Definition_Query',
+                   'Query_Layer', 'Join_Table', 'dataSource_Join_Field', 'Join_Table_Field', 'Buffer_Distance', 'Sort_Field'] +
+                  ['Fields_to_Summarize'] + ['Fields_to_Summarize' + str(i) for i in range(2, 14)] +
+                  ['map_label_field', 'DataBC_Metadata_Record', 'layerID', 'pma_Layers', 'nencLayers', 'nwLayers', 'scLayers', 'seLayers',
+                   'swLayers', 'App', 'ParameterField'])
+
+## Layers of the generated configuration spreadsheet:
+## (GUID, Category, Featureclass_Name, dataSource, shapeType, Definition_Query, Buffer_Distance, Sort_Field, Fields_to_Summarize, App, ParameterField)
+catalogLayers = [
+    ('B1', 'Mineral/Coal', 'Tenure - Benchmark Grid', 'TENURES', 'polygon', None, None, 'TENURE_NUMBER_ID,ASCENDING',
+     ['TENURE_NUMBER_ID', 'OWNER_NAME', 'TENURE_TYPE', 'TENURE_STATUS'], 'MTO', 'TENURE_NUMBER_ID'),
+    ('B2', 'Mineral/Coal', 'Tenure - Good Standing', 'TENURES', 'polygon', "TENURE_STATUS = 'GOOD'", None, None,
+     ['TENURE_NUMBER_ID', 'OWNER_NAME'], None, None),
+    ('B3', 'Transport', 'Roads - Benchmark', 'ROADS', 'line', None, 500, None, ['ROAD_ID', 'ROAD_CLASS'], None, None),
+    ('B4', 'Water', 'Wells - Benchmark', 'WELLS', 'point', None, None, 'WELL_ID,DESCENDING', ['WELL_ID', 'WELL_USE'], None, None),
+    ('B5', 'Water', 'Well Sites - Benchmark', 'WELL_SITES', 'multipoint', None, None, None, ['SITE_ID'], None, None),
+    ('B6', 'District', 'Natural Resource District', 'DISTRICTS', 'polygon', None, None, None, ['DISTRICT_NAME'], None, None),
+    ('B7', 'Location', 'BCGS 1:20,000 Map Sheet', 'MAP_SHEETS', 'polygon', None, None, None, ['MAP_TILE'], None, None),
+]
+
+
+def dataFolder(folder, size):
+    return os.path.join(folder, "data_" + str(size))
+
+
+def catalogXLS(folder, size):
+    return os.path.join(dataFolder(folder, size), "InterestReport_Layer_List_Benchmark.xlsx")
+
+
+def aoiPath(folder):
+    return os.path.join(folder, "aoi.gpkg")
+
+
+def resultsPath(folder):
+    return os.path.join(folder, "results.jsonl")
+
+
+def writeLayer(path, geometryType, properties, records, chunkSize=10000):
+    '''
+    A function to write (properties, geometry) records to a GeoPackage with a spatial index, a chunk at a time so
+    the millions of features of the larger sizes are never all in memory
+    '''
+    if os.path.exists(path):
+        os.remove(path)
+
+    crs = CRS.from_epsg(3005).to_wkt()
+    with fiona.open(path, 'w', driver='GPKG', schema={'geometry': geometryType, 'properties': properties}, crs_wkt=crs, SPATIAL_INDEX='YES') as dst:
+        chunk = []
+        for props, geom in records:
+            chunk.append({'geometry': mapping(geom), 'properties': props})
+            if len(chunk) == chunkSize:
+                dst.writerecords(chunk)
+                chunk = []
+        if chunk:
+            dst.writerecords(chunk)
+
+
+def tenureGrid(count, extent, random):
+    '''
+    Square tenure cells filling the extent row by row, with the owners, types and statuses of a tenure layer
+    '''
+    minx, miny, maxx, maxy = extent
+    columns = int(math.ceil(math.sqrt(count)))
+    size = (maxx - minx) / columns
+    statuses = ['GOOD', 'GOOD', 'GOOD', 'PROTECTED', 'FORFEIT']
+    types = ['Mineral', 'Placer', 'Coal']
+
+    for i in range(count):
+        x, y = minx + (i % columns) * size, miny + (i // columns) * size
+        props = {'TENURE_NUMBER_ID': 1000000 + i,
+                 'OWNER_NAME': 'Owner ' + str(random.randint(1, 500)),
+                 'TENURE_TYPE': types[random.randint(0, len(types))],
+                 'TENURE_STATUS': statuses[random.randint(0, len(statuses))]}
+        yield props, box(x, y, x + size, y + size)
+
+
+def polylines(count, extent, random, vertices=100):
+    '''
+    Long random walks across the extent, like roads and rivers
+    '''
+    minx, miny, maxx, maxy = extent
+    step = (maxx - minx) / vertices
+    classes = ['highway', 'arterial', 'local', 'resource', 'trail']
+
+    for i in range(count):
+        headings = random.uniform(0, 2 * math.pi) + numpy.cumsum(random.normal(0, 0.2, vertices))
+        xs = numpy.clip(random.uniform(minx, maxx) + numpy.cumsum(step * numpy.cos(headings)), minx, maxx)
+        ys = numpy.clip(random.uniform(miny, maxy) + numpy.cumsum(step * numpy.sin(headings)), miny, maxy)
+        yield {'ROAD_ID': i, 'ROAD_CLASS': classes[random.randint(0, len(classes))]}, LineString(numpy.column_stack((xs, ys)))
+
+
+def points(count, extent, random, clusters=25):
+    '''
+    Dense points gathered in clusters, like wells in a gas field
+    '''
+    minx, miny, maxx, maxy = extent
+    centres = numpy.column_stack((random.uniform(minx, maxx, clusters), random.uniform(miny, maxy, clusters)))
+    uses = ['Domestic', 'Irrigation', 'Industrial', 'Observation']
+
+    for i in range(count):
+        x, y = centres[random.randint(0, clusters)] + random.normal(0, 5000, 2)
+        yield {'WELL_ID': i, 'WELL_USE': uses[random.randint(0, len(uses))]}, Point(min(max(x, minx), maxx), min(max(y, miny), maxy))
+
+
+def multipoints(count, extent, random, parts=10):
+    '''
+    Groups of points around a site, stored as one multipoint feature per site
+    '''
+    minx, miny, maxx, maxy = extent
+
+    for i in range(count):
+        centre = (random.uniform(minx, maxx), random.uniform(miny, maxy))
+        yield {'SITE_ID': i}, MultiPoint([tuple(xy) for xy in centre + random.normal(0, 500, (parts, 2))])
+
+
+def gridPolygons(extent, divisions, nameField, namePattern):
+    '''
+    The extent divided into divisions x divisions named squares, for the district and map sheet layers
+    '''
+    minx, miny, maxx, maxy = extent
+    size = (maxx - minx) / divisions
+
+    for i in range(divisions):
+        for j in range(divisions):
+            yield {nameField: namePattern.format(i, j)}, box(minx + i * size, miny + j * size, minx + (i + 1) * size, miny + (j + 1) * size)
+
+
+def aoiPolygon(hectares, vertices, extent, random):
+    '''
+    An AOI of about hectares in the middle of the extent, with vertices vertices jittered around a circle
+    '''
+    minx, miny, maxx, maxy = extent
+    radius = math.sqrt(hectares * 10000 / math.pi)
+    angles = numpy.linspace(0, 2 * math.pi, vertices, endpoint=False)
+    radii = radius * (1 + random.uniform(-0.05, 0.05, vertices))
+
+    return Polygon(numpy.column_stack(((minx + maxx) / 2 + radii * numpy.cos(angles), (miny + maxy) / 2 + radii * numpy.sin(angles))))
+
+
+def generateLayers(folder, size, seed=3005):
+    '''
+    A function to write the layers of one benchmark size under <folder>/data_<size>/BCGW
+    '''
+    random = numpy.random.RandomState(seed)
+    layerFolder = os.path.join(dataFolder(folder, size), "BCGW")
+    if not os.path.exists(layerFolder):
+        os.makedirs(layerFolder)
+
+    addMessage("Generating " + format(size, ",") + " feature layers in " + layerFolder + "...")
+
+    writeLayer(os.path.join(layerFolder, "TENURES.gpkg"), 'Polygon',
+               OrderedDict([('TENURE_NUMBER_ID', 'int'), ('OWNER_NAME', 'str'), ('TENURE_TYPE', 'str'), ('TENURE_STATUS', 'str')]),
+               tenureGrid(size, benchmarkExtent, random))
+    writeLayer(os.path.join(layerFolder, "ROADS.gpkg"), 'LineString', OrderedDict([('ROAD_ID', 'int'), ('ROAD_CLASS', 'str')]),
+               polylines(max(size // 10, 1), benchmarkExtent, random))
+    writeLayer(os.path.join(layerFolder, "WELLS.gpkg"), 'Point', OrderedDict([('WELL_ID', 'int'), ('WELL_USE', 'str')]),
+               points(size, benchmarkExtent, random))
+    writeLayer(os.path.join(layerFolder, "WELL_SITES.gpkg"), 'MultiPoint', OrderedDict([('SITE_ID', 'int')]),
+               multipoints(max(size // 10, 1), benchmarkExtent, random))
+    writeLayer(os.path.join(layerFolder, "DISTRICTS.gpkg"), 'Polygon', OrderedDict([('DISTRICT_NAME', 'str')]),
+               gridPolygons(benchmarkExtent, 2, 'DISTRICT_NAME', "Benchmark District {0}{1}"))
+    writeLayer(os.path.join(layerFolder, "MAP_SHEETS.gpkg"), 'Polygon', OrderedDict([('MAP_TILE', 'str')]),
+               gridPolygons(benchmarkExtent, 10, 'MAP_TILE', "093G.{0}{1}"))
+
+    generateCatalog(folder, size)
+
+
+def generateCatalog(folder, size):
+    '''
+    A function to write a configuration spreadsheet with the IOR_Data and Apps sheets of the MASTER spreadsheet,
+    listing the layers of one benchmark size
+    '''
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.title = 'IOR_Data'
+    sheet.append(catalogColumns)
+
+    for guid, category, name, dataSource, shapeType, defQuery, buffer, sort, fields, app, parameterField in catalogLayers:
+        regions = ['Y', None, None, None, None, None] if category not in ('District', 'Location') else [None] * 6
+        sheet.append([guid, category, name, 'N', 'BCGW', dataSource, shapeType, defQuery, None, None, None, None, buffer, sort] +
+                     fields + [None] * (13 - len(fields)) +
+                     [None, 'https://catalogue.data.gov.bc.ca/dataset/' + dataSource.lower(), guid] + regions + [app, parameterField])
+
+    apps = book.create_sheet('Apps')
+    apps.append(['App', 'URL'])
+    apps.append(['MTO', 'https://www.mtonline.gov.bc.ca/mtov/searchTenures.do?tenureNumber={0}'])
+
+    book.save(catalogXLS(folder, size))
+
+
+def generateAOIs(folder, seed=3005):
+    '''
+    A function to write the AOIs of aoiCases to <folder>/aoi.gpkg, named by the NAME field
+    '''
+    random = numpy.random.RandomState(seed)
+    addMessage("Generating AOIs in " + aoiPath(folder) + "...")
+
+    writeLayer(aoiPath(folder), 'Polygon', OrderedDict([('NAME', 'str'), ('HECTARES', 'float'), ('VERTICES', 'int')]),
+               [({'NAME': name, 'HECTARES': hectares, 'VERTICES': vertices}, aoiPolygon(hectares, vertices, benchmarkExtent, random))
+                for name, (hectares, vertices) in aoiCases.items()])
+
+
+def generate(folder, sizes, seed=3005):
+    '''
+    A function to generate the AOIs, and the layers and configuration spreadsheet of each size
+    '''
+    if fiona is None:
+        raise RuntimeError("Generating the benchmark data requires the numpy, shapely, fiona and openpyxl packages")
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+
+    generateAOIs(folder, seed)
+    for size in sizes:
+        generateLayers(folder, size, seed)
+
+
+def sourceVersion():
+    '''
+    The git commit of the IOR being benchmarked, or None outside a git checkout
+    '''
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=devnull).decode('utf-8').strip()
+    except Exception:
+        return None
+
+
+def runCase(folder, runId, size, aoiName, engineName='shapely', workers=1, tileVertices=0):
+    '''
+    A function to run the report of one AOI against the layers of one size, the way runReport does, with each
+    stage timed. Returns the trace of the case.
+    '''
+    # Imported here since the report script reads its tool parameters when it is imported
+    import Interest_Overlap_Report_v6_0_0 as report
+
+    outputFolder = os.path.join(folder, "runs", runId, str(size) + "_" + aoiName)
+    if not os.path.exists(outputFolder):
+        os.makedirs(outputFolder)
+
+    engine = getEngine(engineName, dataFolder(folder, size))
+    catalog = loadCatalog(catalogXLS(folder, size), engine)
+    layerList = [row[2] for row in catalog.rows if row[1] not in ('District', 'Location')]
+
+    report.setReportParameters({'AOI': aoiPath(folder),
+                                'sqlQuery': "NAME = '" + aoiName + "'",
+                                'layerList': layerList,
+                                'output_GDB': outputFolder,
+                                'output_excel': outputFolder,
+                                'output_name': "Benchmark_" + str(size) + "_" + aoiName,
+                                'workers': workers,
+                                'tileVertices': tileVertices})
+
+    trace = RunTrace(os.path.join(outputFolder, "trace.jsonl"))
+    report.runTrace = engine.trace = trace
+    engine.tileVertices = tileVertices
+
+    with trace.stage('createScratchGDB'):
+        output_folder, scratchGDB = report.createScratchGDB(outputFolder, engine)
+
+    with trace.stage('processAOI', features=1):
+        processedAOI, processedAOI_Hectares, iMapBCBaseURL = report.processAOI(report.AOI, report.sqlQuery, output_folder, scratchGDB, engine)
+
+    with trace.stage('processData') as record:
+        layerListDict, collectFeatsCountDict = report.processData(processedAOI, processedAOI_Hectares, catalog, output_folder, scratchGDB, layerList, engine, workers)
+        record['features'] = sum(counts[0] for layers in collectFeatsCountDict.values() for counts in layers.values())
+
+    # Each sheet writer and the save are timed by createReport
+    with trace.stage('createReport'):
+        report.createReport(report.output_name, processedAOI, processedAOI_Hectares, iMapBCBaseURL, '', layerListDict, collectFeatsCountDict,
+                            catalog, catalog.apps, output_folder, scratchGDB, engine)
+
+    featureClasses = report.reportFeatureClasses([processedAOI], {None: (layerListDict, collectFeatsCountDict)})
+    with trace.stage('flushWorkspace', features=len(featureClasses)):
+        report.flushWorkspace(engine, featureClasses, outputFolder, scratchGDB)
+
+    return trace
+
+
+def runBenchmark(folder, sizes, aois, engineName='shapely', workers=1, label='', tileVertices=0):
+    '''
+    A function to run every (size, AOI) case and add its stage totals to the results of the benchmark folder.
+    Returns the records added.
+    '''
+    runId = time.strftime('%Y%m%d_%H%M%S')
+    version = sourceVersion()
+    records = []
+
+    for size in sizes:
+        if not os.path.exists(catalogXLS(folder, size)):
+            raise ValueError("No benchmark data of size " + str(size) + " in " + folder + ", run with --generate first")
+
+        for aoiName in aois:
+            if aoiName not in aoiCases:
+                raise ValueError("Unknown benchmark AOI '" + aoiName + "'")
+
+            addMessage("Benchmarking " + format(size, ",") + " features against the " + aoiName + " AOI...")
+            trace = runCase(folder, runId, size, aoiName, engineName, workers, tileVertices)
+
+            record = OrderedDict([('run', runId),
+                                  ('label', label),
+                                  ('version', version),
+                                  ('host', socket.gethostname()),
+                                  ('platform', platform.platform()),
+                                  ('python', platform.python_version()),
+                                  ('engine', engineName),
+                                  ('workers', workers),
+                                  ('tileVertices', tileVertices),
+                                  ('size', size),
+                                  ('aoi', aoiName),
+                                  ('hectares', aoiCases[aoiName][0]),
+                                  ('vertices', aoiCases[aoiName][1]),
+                                  ('seconds', round(sum(r['seconds'] for r in trace.records if r['parent'] is None), 4)),
+                                  ('stages', trace.totals())])
+            records.append(record)
+
+            with open(resultsPath(folder), 'a') as f:
+                f.write(json.dumps(record) + "\n")
+
+            addMessage("    " + str(record['seconds']) + " seconds")
+
+    return records
+
+
+def readResults(folder):
+    '''
+    A function to return the benchmark results as lists of records keyed by run, oldest run first
+    '''
+    runs = OrderedDict()
+    if os.path.exists(resultsPath(folder)):
+        with open(resultsPath(folder), 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line, object_pairs_hook=OrderedDict)
+                    runs.setdefault(record['run'], []).append(record)
+    return runs
+
+
+def compareResults(folder, run=None, baseline=None, stages=('processAOI', 'processData', 'layer', 'clipWithMeasures', 'createReport')):
+    '''
+    A function to write the seconds of each case and stage of a run (the latest by default) next to those of a
+    baseline run (the one before it by default). Returns the rows written.
+    '''
+    runs = readResults(folder)
+    if not runs:
+        raise ValueError("No benchmark results in " + folder)
+
+    # Run ids are timestamps, so sorting them orders the runs even when two were appended at the same time
+    runIds = sorted(runs.keys())
+    run = run or runIds[-1]
+    if baseline is None:
+        baseline = runIds[runIds.index(run) - 1] if runIds.index(run) > 0 else None
+
+    baselineCases = dict(((record['size'], record['aoi']), record) for record in runs.get(baseline, []))
+
+    addMessage("Run " + run + " (" + (runs[run][0]['label'] or 'no label') + ") against " + (baseline or 'no baseline'))
+    addMessage("{0:>10} {1:>10} {2:<18} {3:>10} {4:>10} {5:>8}".format("Size", "AOI", "Stage", "Seconds", "Baseline", "Change"))
+
+    rows = []
+    for record in runs[run]:
+        before = baselineCases.get((record['size'], record['aoi']))
+        for stage in ('total',) + tuple(stages):
+            seconds = record['seconds'] if stage == 'total' else record['stages'].get(stage, {}).get('seconds')
+            if seconds is None:
+                continue
+
+            baseSeconds = None
+            if before is not None:
+                baseSeconds = before['seconds'] if stage == 'total' else before['stages'].get(stage, {}).get('seconds')
+
+            change = (seconds - baseSeconds) / baseSeconds * 100 if baseSeconds else None
+            rows.append((record['size'], record['aoi'], stage, seconds, baseSeconds, change))
+            addMessage("{0:>10} {1:>10} {2:<18} {3:>10.3f} {4:>10} {5:>8}".format(record['size'], record['aoi'], stage, seconds,
+                                                                                 "-" if baseSeconds is None else "{0:.3f}".format(baseSeconds),
+                                                                                 "-" if change is None else "{0:+.1f}%".format(change)))
+
+    return rows
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Interest Overlap Report benchmark")
+    parser.add_argument('--generate', action='store_true', help="generate the AOIs, layers and configuration spreadsheets")
+    parser.add_argument('--run', action='store_true', help="run the benchmark and add its results to results.jsonl")
+    parser.add_argument('--compare', action='store_true', help="compare a run with a baseline run")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help="layer sizes, from " + ", ".join(str(size) for size in benchmarkSizes))
+    parser.add_argument('--aois', nargs='+', default=['small', 'medium', 'large'], help="AOIs, from " + ", ".join(aoiCases))
+    parser.add_argument('--folder', default=defaultBenchmarkFolder, help="folder of the generated data and results")
+    parser.add_argument('--seed', type=int, default=3005, help="seed of the generated data")
+    parser.add_argument('--engine', default='shapely', help="geometry engine (shapely or arcpy)")
+    parser.add_argument('--workers', type=int, default=1, help="parallel workers of processData")
+    parser.add_argument('--tile-vertices', dest='tileVertices', type=int, default=0, help="split AOIs of more vertices than this into tiles (default 0, never)")
+    parser.add_argument('--label', default='', help="label of the run, i.e. the change being measured")
+    parser.add_argument('--run-id', dest='runId', help="run to compare (default the latest)")
+    parser.add_argument('--baseline', help="run to compare with (default the run before)")
+    args = parser.parse_args()
+
+    if not (args.generate or args.run or args.compare):
+        parser.error("one of --generate, --run or --compare is required")
+
+    if args.generate:
+        generate(args.folder, args.sizes, args.seed)
+
+    if args.run:
+        runBenchmark(args.folder, args.sizes, args.aois, args.engine, args.workers, args.label, args.tileVertices)
+
+    if args.compare:
+        compareResults(args.folder, args.runId, args.baseline)
@@ -0,0 +1,97 @@
+'''
+Tool name: Interest Overlap Report (IOR) - AOI Buffer Cache
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+Many layers in the configuration spreadsheet share a Buffer_Distance (e.g. 500 m). Buffered layers are selected
+by their distance from the AOI, so a buffer of the AOI is only needed to clip a layer that has features within
+that distance. The buffer cache computes each buffer of an AOI the first time a clip needs it, in the engine's
+memory workspace, and hands the same feature class to every later layer that asks for it. Buffers are keyed by
+a hash of the AOI geometry (normalized WKB and spatial reference) and the distance, so when a persistent folder is given,
+a later run against the same AOI (e.g. statusing the same application again) reuses them as well. Layers processed
+by a pool of workers share the buffers the run makes before handing the layers out, so no two workers buffer the
+same AOI or write to the same workspace.
+'''
+
+import os
+from IOR_Geometry_Engine import addMessage
+
+## Local (not network share) location of the buffers kept between runs
+if os.environ.get('LOCALAPPDATA'):
+    defaultBufferFolder = os.path.join(os.environ['LOCALAPPDATA'], 'IOR', 'Buffers')
+else:
+    defaultBufferFolder = os.path.join(os.path.expanduser('~'), '.ior', 'buffers')
+
+
+class BufferCache(object):
+    '''
+    Buffers of AOIs keyed by (AOI geometry hash, distance). New buffers are written to workspace (the engine's
+    memory workspace by default), or to Buffers.gdb in persistFolder when they should be kept for later runs.
+    '''
+
+    def __init__(self, workspace=None, persistFolder=None):
+        self.workspace = workspace
+        self.persistFolder = persistFolder
+        self.persistWorkspace = None
+        self.buffers = {}
+        self.hashes = {}
+
+    def aoiHash(self, engine, aoi):
+        if aoi not in self.hashes:
+            self.hashes[aoi] = engine.geometryHash(aoi)
+        return self.hashes[aoi]
+
+    def bufferWorkspace(self, engine):
+        if self.persistFolder is None:
+            return self.workspace or engine.memoryWorkspace
+
+        if self.persistWorkspace is None:
+            existing = [workspace for workspace in engine.listWorkspaces(self.persistFolder) if os.path.splitext(os.path.basename(workspace))[0] == 'Buffers']
+            if existing:
+                self.persistWorkspace = existing[0]
+            else:
+                if not os.path.exists(self.persistFolder):
+                    os.makedirs(self.persistFolder)
+                self.persistWorkspace = os.path.join(self.persistFolder, engine.createWorkspace(self.persistFolder, 'Buffers.gdb'))
+
+        return self.persistWorkspace
+
+    def get(self, engine, aoi, distance, log=addMessage):
+        '''
+        Return the feature class of aoi buffered by distance, computing it only the first time it is asked for
+        '''
+        key = (self.aoiHash(engine, aoi), float(distance))
+
+        if key in self.buffers:
+            return self.buffers[key]
+
+        # Named from the same float as the key, so 500, "500" and 500.0 share one buffer
+        outBuffer = os.path.join(self.bufferWorkspace(engine), "B_" + key[0] + "_" + repr(key[1]).replace('.', '_') + "m")
+
+        if self.persistFolder is not None and engine.exists(outBuffer):
+            log("    Reusing " + str(int(float(distance))) + " m AOI buffer from a previous run")
+        else:
+            log("    Buffering AOI by " + str(int(float(distance))) + " m")
+            engine.buffer(aoi, outBuffer, distance)
+
+        self.buffers[key] = outBuffer
+        return outBuffer
+
+    def shared(self):
+        '''
+        Return a cache of the buffers made so far, for a pool worker. Any other buffer the worker needs is made
+        in its own memory workspace rather than in the workspaces the run writes to.
+        '''
+        cache = BufferCache()
+        cache.buffers = dict(self.buffers)
+        cache.hashes = dict(self.hashes)
+        return cache
+
+    def clear(self, engine):
+        '''
+        Delete the buffers that are not kept for later runs
+        '''
+        if self.persistFolder is None:
+            for outBuffer in self.buffers.values():
+                engine.delete(outBuffer)
+        self.buffers = {}
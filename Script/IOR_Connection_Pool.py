@@ -0,0 +1,166 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Connection Pool
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+Every tool run used to create MTOPROD.sde and BCGW.sde in Interim_Files\<user> on the network share (login)
+and delete them when it finished (logout), so each report paid for new connection files and a new Oracle
+session in each database. The connection pool is held by the report service (IOR_Report_Service.py), a
+long-lived process on the analyst's desktop. It creates each connection file once, locally, the first time a
+report needs the workspace. A connection that has not been checked for checkInterval seconds is checked with a
+cheap query (and reconnected if it fails) before it is handed out again, and it is closed once it has not been
+used for idleTimeout seconds.
+'''
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from IOR_Geometry_Engine import addMessage
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+## Local (not network share) location of the pooled connection files
+if os.environ.get('LOCALAPPDATA'):
+    defaultConnectionFolder = os.path.join(os.environ['LOCALAPPDATA'], 'IOR', 'Connections')
+else:
+    defaultConnectionFolder = os.path.join(os.path.expanduser('~'), '.ior', 'connections')
+
+## Oracle instances of the warehouse workspaces in the configuration spreadsheet
+databaseInstances = OrderedDict([
+    ("MTOPROD", "nrkdb02.bcgov/mtoprod.nrs.bcgov"),
+    ("BCGW", "bcgw.bcgov/idwprod1.bcgov"),
+])
+
+
+class PooledConnection(object):
+    '''
+    One open connection: its connection file and the login it was made with, kept in memory only so the
+    connection can be made again when it fails a health check
+    '''
+
+    def __init__(self, workspace, path, username, password):
+        self.workspace = workspace
+        self.path = path
+        self.username = username
+        self.password = password
+        self.created = self.lastUsed = self.lastChecked = time.time()
+
+
+class ConnectionPool(object):
+    '''
+    Authenticated connections to the warehouse workspaces, keyed by workspace. The connection files are
+    written to folder without the username or password (DO_NOT_SAVE_USERNAME), so they only work in the
+    process that holds the pool.
+    '''
+
+    def __init__(self, folder=None, idleTimeout=1800, checkInterval=300):
+        if arcpy is None:
+            raise RuntimeError("The connection pool requires an ArcGIS installation")
+        self.folder = folder or defaultConnectionFolder
+        self.idleTimeout = idleTimeout
+        self.checkInterval = checkInterval
+        self.connections = OrderedDict()
+        self.lock = threading.RLock()
+
+    def connectionPath(self, workspace):
+        return os.path.join(self.folder, workspace + ".sde")
+
+    def connect(self, workspace, username, password):
+        if workspace not in databaseInstances:
+            raise ValueError("No database instance for workspace '" + workspace + "'")
+
+        with self.lock:
+            self.disconnect(workspace)
+
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+
+            addMessage("Logging into " + workspace + "...")
+            arcpy.CreateDatabaseConnection_management(self.folder,
+                                                      workspace + ".sde",
+                                                      "ORACLE",
+                                                      databaseInstances[workspace],
+                                                      "DATABASE_AUTH",
+                                                      username,
+                                                      password,
+                                                      "DO_NOT_SAVE_USERNAME")
+
+            self.connections[workspace] = PooledConnection(workspace, self.connectionPath(workspace), username, password)
+            return self.connections[workspace].path
+
+    def login(self, username, passwords):
+        '''
+        Make sure there is a healthy connection for username to each workspace of passwords (a dictionary of
+        password by workspace), connecting only where there is none yet or the login changed
+        '''
+        with self.lock:
+            for workspace, password in passwords.items():
+                connection = self.connections.get(workspace)
+                if connection is None or connection.username != username or connection.password != password:
+                    self.connect(workspace, username, password)
+                else:
+                    self.acquire(workspace)
+
+    def isHealthy(self, connection):
+        try:
+            arcpy.ArcSDESQLExecute(connection.path).execute("SELECT 1 FROM DUAL")
+            return True
+        except Exception:
+            return False
+
+    def check(self, connection):
+        '''
+        Run the health check on a connection, reconnecting it if the check fails. The query also keeps the
+        Oracle session from timing out between reports.
+        '''
+        with self.lock:
+            if self.isHealthy(connection):
+                connection.lastChecked = time.time()
+            else:
+                addMessage("    Connection to " + connection.workspace + " failed its health check, reconnecting...")
+                self.connect(connection.workspace, connection.username, connection.password)
+
+    def acquire(self, workspace):
+        '''
+        Return the connection file of workspace, checking the connection first when it is due for a check
+        '''
+        with self.lock:
+            if workspace not in self.connections:
+                raise ValueError("Not logged into " + workspace)
+
+            if time.time() - self.connections[workspace].lastChecked > self.checkInterval:
+                self.check(self.connections[workspace])
+
+            connection = self.connections[workspace]
+            connection.lastUsed = time.time()
+            return connection.path
+
+    def disconnect(self, workspace):
+        with self.lock:
+            self.connections.pop(workspace, None)
+
+            path = self.connectionPath(workspace)
+            if arcpy.Exists(path):
+                arcpy.ClearWorkspaceCache_management(path)
+                arcpy.Delete_management(path)
+
+    def maintain(self):
+        '''
+        Close the connections that have been idle for idleTimeout and check the others that are due
+        '''
+        with self.lock:
+            for workspace, connection in list(self.connections.items()):
+                if time.time() - connection.lastUsed > self.idleTimeout:
+                    addMessage("Closing idle connection to " + workspace + "...")
+                    self.disconnect(workspace)
+                elif time.time() - connection.lastChecked > self.checkInterval:
+                    self.check(connection)
+
+    def close(self):
+        with self.lock:
+            for workspace in list(self.connections):
+                self.disconnect(workspace)
@@ -1,5 +1,12 @@
-import arcpy, itertools
+import arcpy, itertools, sys
 from getpass import getuser
+
+# The layer catalog is shared with the IOR script, so the validator imports it from the script folder
+scriptFolder = r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Script"
+if scriptFolder not in sys.path:
+  sys.path.append(scriptFolder)
+
+from IOR_Layer_Catalog import loadCatalog
   
 
 class ToolValidator(object):
@@ -41,6 +48,10 @@ class ToolValidator(object):
           self.params[1].enabled = False
         else:
           self.params[1].enabled = True
+
+    # A batch run reports on every feature in the AOI, so the AOI field list is offered for the batch ID field too
+    if len(self.params) > 12 and self.params[0].value:
+      self.params[12].filter.list = [str(field.name) for field in arcpy.Describe(self.params[0].value).fields if field.type in ('String', 'Integer', 'SmallInteger')]
           
     if self.params[0].value:
 
@@ -71,12 +82,14 @@ class ToolValidator(object):
     else:
       pass
 
-    if self.params[1].enabled:
+    batchRun = len(self.params) > 12 and self.params[12].value
+
+    if self.params[1].enabled and not batchRun:
       if self.params[1].value is None:
         self.params[1].setErrorMessage("Query is required on Areas of Interest that have more than one feature.")
 
 
-    if self.params[0].value is not None:
+    if self.params[0].value is not None and not batchRun:
       if self.params[1].enabled:
         if self.params[1].value is not None:
 
@@ -102,79 +115,9 @@ class ToolValidator(object):
     in the fifth parameter of the tool. Also, this will eveluate the set of predfined layers
     found in the Predefined Layer list found in the fourth parameter of the tool."""
 
-    xls = r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Excel_Spreadsheets\InterestReport_Layer_List_MASTER.xlsx\IOR_Data$"
-
-    allLayers = []
-
-    # Mining only Layers
-    tenure = []
-    reserve = []
-    otherMiningLayers = []
-
-    # Regional Layers
-    pmaLayers = []
-    scLayers = []
-    swLayers = []
-    seLayers = []
-    nencLayers = []
-    nwLayers = []
-
-    with arcpy.da.SearchCursor(xls, '*') as cursor:
-
-      for row in cursor:
-
-        if row[30] == 'Y':
-          pmaLayers.append(str(row[2]))        
-
-        if row[31] == 'Y':
-          nencLayers.append(str(row[2]))
-
-        if row[32] == 'Y':
-          nwLayers.append(str(row[2]))
-
-        if row[33] == 'Y':
-          scLayers.append(str(row[2]))
-
-        if row[34] == 'Y':
-          seLayers.append(str(row[2]))
-
-        if row[35] == 'Y':
-          swLayers.append(str(row[2]))
-          
+    xls = r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Excel_Spreadsheets\InterestReport_Layer_List_MASTER.xlsx"
 
-        if row[1] not in ('District', 'Location', 'Mineral/Coal'):
-            allLayers.append(row[2])        
-
-        if row[1] == 'Mineral/Coal':
-            if 'Tenure -' in row[2]:
-                tenure.append(str(row[2]))
-            elif 'Reserves -' in row[2]:
-                reserve.append(str(row[2]))
-            else:
-              otherMiningLayers.append(row[2])
-              
-
-    vList = []
-
-    if layerGroup == 'All Layers':
-      vList = tenure + reserve + otherMiningLayers + sorted(allLayers)        
-    elif layerGroup == 'Mining Layers Only':
-      vList = tenure + reserve + otherMiningLayers
-    elif layerGroup == 'PMA Layers':
-      vList = tenure + reserve + otherMiningLayers + sorted(pmaLayers)      
-    elif layerGroup == 'North East\North Central Permitting Layers':
-      vList = tenure + reserve + otherMiningLayers + sorted(nencLayers)
-    elif layerGroup == 'North West Permitting Layers':
-      vList = tenure + reserve + otherMiningLayers + sorted(nwLayers)          
-    elif layerGroup == 'South Central Permitting Layers':
-      vList = tenure + reserve + otherMiningLayers + sorted(scLayers)
-    elif layerGroup == 'South East Permitting Layers':
-      vList = tenure + reserve + otherMiningLayers + sorted(seLayers)      
-    elif layerGroup == 'South West Permitting Layers':
-      vList = tenure + reserve + otherMiningLayers + sorted(swLayers)
-
-   
-
-    del xls
+    # The compiled catalog is kept in memory, so changing the predefined list does not re-read the spreadsheet
+    vList = loadCatalog(xls).presetLayers(layerGroup)
 
     return vList
@@ -0,0 +1,1535 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Geometry Engines
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+processAOI, processData and createDistrictSheet work through a geometry engine rather than calling
+arcpy directly. ArcpyEngine wraps the geoprocessing tools the IOR has always used on a licensed DTS
+desktop. ShapelyEngine does the same work with GEOS/Shapely against GeoPackage or FlatGeobuf copies
+of the layers so reports can be run (and benchmarked) on Linux workers without an ArcInfo license.
+'''
+
+import os
+import numpy
+import struct
+import hashlib
+import multiprocessing.pool
+from getpass import getuser
+from collections import OrderedDict, namedtuple
+from IOR_Query_Layer import oracleIdSet, oracleLiteral, SQLiteQueryLayer
+from IOR_Run_Trace import untraced
+
+try:
+    import arcpy
+except ImportError:
+    arcpy = None
+
+try:
+    import fiona
+    from shapely.geometry import shape, mapping, box, MultiPoint, MultiPolygon, MultiLineString, GeometryCollection
+    from shapely import wkb
+    from shapely.ops import unary_union, linemerge
+    from shapely.prepared import prep
+except ImportError:
+    fiona = None
+
+# STRtree queries by index need Shapely 2. Older versions fall back to testing every feature.
+try:
+    from shapely import STRtree
+except ImportError:
+    STRtree = None
+
+# Distance tests without computing the distance itself need Shapely 2
+try:
+    from shapely import dwithin
+except ImportError:
+    dwithin = None
+
+# Measuring and clipping arrays of geometries in one call needs Shapely 2. Older versions go one at a time.
+try:
+    from shapely import area as areas, length as lengths, intersection as intersections
+except ImportError:
+    areas = lengths = intersections = None
+
+# Testing an array of geometries against a prepared AOI in one call needs Shapely 2
+try:
+    from shapely import covers, bounds as geometryBounds, prepare
+except ImportError:
+    covers = geometryBounds = prepare = None
+
+# Splitting the AOI into tiles needs Shapely 2. Older versions test against the whole AOI.
+try:
+    from shapely import intersects, get_num_coordinates, clip_by_rect, make_valid
+except ImportError:
+    intersects = get_num_coordinates = clip_by_rect = make_valid = None
+
+try:
+    import pyproj
+    from shapely.ops import transform
+except ImportError:
+    pyproj = None
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+
+## Toolbox location and the per-user folder holding the BCGW/MTOPROD connection files
+toolPath = r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report"
+interimFolder = os.path.join(toolPath, "Interim_Files")
+
+## Fields written to clipped layers by the IOR: name -> (type, alias)
+measureFields = OrderedDict([
+    ("ORIGINAL_HECTARES", ("DOUBLE", "Original Area (Ha)")),
+    ("OVERLAPPING_HECTARES", ("DOUBLE", "Overlapping Area (Ha)")),
+    ("PERCENT_OF_LAYER_BEING_OVERLAPPED_BY_AOI", ("DOUBLE", "% Layer being Overlapped by AOI")),
+    ("PERCENT_OF_AOI_BEING_OVERLAPPED_BY_LAYER", ("DOUBLE", "% AOI being Overlapped by Layer")),
+    ("ORIGINAL_LENGTH", ("FLOAT", "Original Length")),
+    ("OVERLAPPING_LENGTH", ("FLOAT", "Overlapping Length")),
+    ("EASTING", ("DOUBLE", "EASTING")),
+    ("NORTHING", ("DOUBLE", "NORTHING")),
+    ("POINT_LOCATION", ("TEXT", "Point Location")),
+])
+
+Field = namedtuple("Field", ["name", "aliasName", "type", "required"])
+
+
+## Other places every message is sent to, i.e. the tool run that submitted a report to the report service
+messageListeners = []
+
+
+def addMessage(message):
+    '''
+    A function to write a message to the geoprocessing window, or to stdout when arcpy is not available
+    '''
+    if arcpy is not None:
+        arcpy.AddMessage(message)
+    else:
+        print(message)
+
+    for listener in messageListeners:
+        listener(message)
+
+
+def getEngine(name=None, dataFolder=None):
+    '''
+    A function to return the geometry engine used to process a report. Defaults to arcpy when it is installed.
+    dataFolder is where the engine finds the BCGW and MTOPROD layers: the folder holding the .sde connection
+    files for arcpy, or the GeoPackage/FlatGeobuf copies for shapely.
+    '''
+    if name is None:
+        name = 'arcpy' if arcpy is not None else 'shapely'
+
+    if name == 'arcpy':
+        return ArcpyEngine(dataFolder)
+    elif name == 'shapely':
+        return ShapelyEngine(dataFolder)
+    else:
+        raise ValueError("Unknown geometry engine: " + str(name))
+
+
+class GeometryEngine(object):
+    '''
+    The operations the IOR needs from a geometry engine. Feature classes are referenced by path
+    (workspace + name); layers are the handles returned by makeLayer and carry a selection.
+    '''
+
+    name = None
+
+    # Workspace for intermediate feature classes that are never written to disk
+    memoryWorkspace = 'in_memory'
+
+    # RunTrace the steps of the engine's operations are timed in, if any
+    trace = None
+
+    # An AOI of more vertices than this is split into tiles of at most this many, and features are selected and
+    # clipped a tile at a time (0 never splits the AOI)
+    tileVertices = 0
+
+    # Number of AOIs whose tiles are kept, i.e. the AOIs of a batch
+    maxTiledAOIs = 50
+
+    def stage(self, name, **attributes):
+        '''
+        Time a step of an operation in the run trace, when the engine has one
+        '''
+        if self.trace is None:
+            return untraced()
+        return self.trace.stage(name, **attributes)
+
+    # Workspaces and data sources
+    def sourcePath(self, workspace, dataSource):
+        raise NotImplementedError
+
+    def connectionPath(self, workspace):
+        raise NotImplementedError
+
+    def createWorkspace(self, folder, name):
+        raise NotImplementedError
+
+    def listWorkspaces(self, folder):
+        raise NotImplementedError
+
+    def exists(self, path):
+        raise NotImplementedError
+
+    def delete(self, path):
+        raise NotImplementedError
+
+    # Tables and schema
+    def readTable(self, table, fields, where=None):
+        raise NotImplementedError
+
+    def listFields(self, features):
+        raise NotImplementedError
+
+    def shapeType(self, features):
+        raise NotImplementedError
+
+    def extent(self, features):
+        raise NotImplementedError
+
+    def getCount(self, features, where=None):
+        raise NotImplementedError
+
+    def maxValue(self, table, field, where=None):
+        raise NotImplementedError
+
+    # Layers and selection
+    def makeLayer(self, source, name, definitionQuery=None, join=None):
+        raise NotImplementedError
+
+    def makeQueryLayer(self, connection, name, template, oidField, parameters):
+        raise NotImplementedError
+
+    def selectByIntersect(self, layer, aoi):
+        raise NotImplementedError
+
+    def selectWithinDistance(self, layer, aoi, distance):
+        raise NotImplementedError
+
+    def overlapsAny(self, layer, aoi, distance=None):
+        '''
+        Return whether any feature of layer overlaps the AOI, or is within distance of it
+        '''
+        if distance is not None:
+            return self.selectWithinDistance(layer, aoi, distance) > 0
+        return self.selectByIntersect(layer, aoi) > 0
+
+    def addSpatialIndex(self, features):
+        raise NotImplementedError
+
+    def copyFeatures(self, inFeatures, outFeatures, where=None, fieldList=None):
+        raise NotImplementedError
+
+    def copyFeatureClasses(self, inFeaturesList, outWorkspace):
+        '''
+        Copy feature classes into outWorkspace, keeping their names
+        '''
+        for inFeatures in inFeaturesList:
+            self.copyFeatures(inFeatures, os.path.join(outWorkspace, os.path.basename(inFeatures)))
+
+    # Geometry operations
+    def clip(self, inFeatures, clipFeatures, outFeatures):
+        raise NotImplementedError
+
+    def buffer(self, inFeatures, outFeatures, distance):
+        raise NotImplementedError
+
+    def project(self, inFeatures, outFeatures, wkid):
+        raise NotImplementedError
+
+    def spatialReference(self, features):
+        raise NotImplementedError
+
+    def geometryWKB(self, features):
+        raise NotImplementedError
+
+    def normalizedWKB(self, features):
+        '''
+        The WKB of each feature, written the same way for equal geometries
+        '''
+        return self.geometryWKB(features)
+
+    def geometryHash(self, features):
+        '''
+        A hash of the spatial reference and normalized WKB of features, the same whatever order the features are in
+        '''
+        sha = hashlib.sha1(str(self.spatialReference(features)).encode('utf-8'))
+        for geometryWKB in sorted(self.normalizedWKB(features)):
+            sha.update(geometryWKB)
+        return sha.hexdigest()[:16]
+
+    def area(self, features):
+        raise NotImplementedError
+
+    def length(self, features):
+        raise NotImplementedError
+
+    def centroid(self, features):
+        raise NotImplementedError
+
+    def mapScale(self, features):
+        raise NotImplementedError
+
+    # Report fields
+    def clipWithMeasures(self, inFeatures, clipFeatures, outFeatures, shapeType, aoiHectares, sortFields=None):
+        raise NotImplementedError
+
+    def sort(self, inFeatures, outFeatures, sortFields):
+        raise NotImplementedError
+
+
+class ArcpyEngine(GeometryEngine):
+    '''
+    The geometry engine used on the DTS desktop. Every call is the arcpy tool the IOR has always used.
+    '''
+
+    name = 'arcpy'
+
+    def __init__(self, dataFolder=None):
+        if arcpy is None:
+            raise RuntimeError("The arcpy geometry engine requires an ArcGIS installation")
+        self.dataFolder = dataFolder or os.path.join(interimFolder, getuser())
+        self.tiles = {}
+
+    def sourcePath(self, workspace, dataSource):
+        if workspace == 'BCGW':
+            return os.path.join(self.dataFolder, "BCGW.sde", dataSource)
+        elif workspace == 'MTOPROD':
+            return os.path.join(self.dataFolder, "MTOPROD.sde", dataSource)
+        else:
+            return os.path.join(workspace, dataSource)
+
+    def connectionPath(self, workspace):
+        return os.path.join(self.dataFolder, workspace + ".sde")
+
+    def createWorkspace(self, folder, name):
+        arcpy.CreateFileGDB_management(folder, name)
+        return name
+
+    def listWorkspaces(self, folder):
+        arcpy.env.workspace = folder
+        return arcpy.ListWorkspaces("*", "FileGDB") or []
+
+    def exists(self, path):
+        return arcpy.Exists(path)
+
+    def delete(self, path):
+        if arcpy.Exists(path):
+            arcpy.Delete_management(path)
+
+    def readTable(self, table, fields, where=None):
+        with arcpy.da.SearchCursor(table, fields, where) as cursor:
+            for row in cursor:
+                yield row
+
+    def listFields(self, features):
+        return [Field(field.name, field.aliasName, field.type, field.required) for field in arcpy.ListFields(features)]
+
+    def shapeType(self, features):
+        return arcpy.Describe(features).shapeType
+
+    def extent(self, features):
+        extent = arcpy.Describe(features).extent
+        return (extent.XMin, extent.YMin, extent.XMax, extent.YMax)
+
+    def getCount(self, features, where=None):
+        if where:
+            self.delete("countLyr")
+            features = arcpy.MakeFeatureLayer_management(features, "countLyr", where)
+        return int(arcpy.GetCount_management(features).getOutput(0))
+
+    def maxValue(self, table, field, where=None):
+        '''
+        Return the largest value of field, or None when it has none. The database sorts the rows (on its index
+        of field, if there is one) and only the first one is read. Oracle sorts NULLs first when descending,
+        so they are left out.
+        '''
+        where = field + " IS NOT NULL" + (" AND (" + where + ")" if where else "")
+        with arcpy.da.SearchCursor(table, [field], where, sql_clause=(None, "ORDER BY " + field + " DESC")) as cursor:
+            for row in cursor:
+                return row[0]
+        return None
+
+    def makeLayer(self, source, name, definitionQuery=None, join=None):
+        self.delete(name)
+
+        arcpy.MakeFeatureLayer_management(source, name)
+
+        # Test for table joins
+        if join is not None:
+            joinTable, layerField, joinField = join
+            with self.stage('join'):
+                arcpy.AddJoin_management(name, str(layerField), str(joinTable), str(joinField))
+            addMessage("    " + os.path.basename(source) + " joined with " + os.path.basename(joinTable))
+
+        lyr = arcpy.mapping.Layer(name)
+
+        # Test to see if a Definition Query is needed
+        if definitionQuery is not None:
+            if lyr.supports("DEFINITIONQUERY"):
+                with self.stage('definitionQuery'):
+                    lyr.definitionQuery = definitionQuery
+                addMessage("    Definition Query applied")
+            else:
+                addMessage("    Does not Support Definition Queries")
+
+        return lyr
+
+    def makeQueryLayer(self, connection, name, template, oidField, parameters):
+        # MakeQueryLayer takes SQL text only, so set parameters are written as one array rather than IN lists
+        sql = template.render(parameters, oracleIdSet, oracleLiteral)
+
+        self.delete(name)
+        arcpy.MakeQueryLayer_management(connection, name, sql, oidField)
+        return name
+
+    def aoiTiles(self, aoi):
+        '''
+        Return the AOI diced into parts of at most tileVertices vertices, or the AOI itself when it has fewer.
+        The parts of each AOI are made once and kept in memory.
+        '''
+        if not self.tileVertices:
+            return aoi
+
+        vertices = sum(row[0].pointCount for row in arcpy.da.SearchCursor(aoi, ["SHAPE@"]))
+        if vertices <= self.tileVertices:
+            return aoi
+
+        key = self.geometryHash(aoi)
+        if key not in self.tiles or not arcpy.Exists(self.tiles[key]):
+            if len(self.tiles) >= self.maxTiledAOIs:
+                for tiles in self.tiles.values():
+                    self.delete(tiles)
+                self.tiles.clear()
+
+            tiles = os.path.join(self.memoryWorkspace, "aoiTiles_" + key)
+            self.delete(tiles)
+            arcpy.Dice_management(aoi, tiles, self.tileVertices)
+            self.tiles[key] = tiles
+        return self.tiles[key]
+
+    def selectByIntersect(self, layer, aoi):
+        # Select Layer By Location filters on the source's spatial index before the exact intersect test
+        arcpy.SelectLayerByLocation_management(layer, "intersect", self.aoiTiles(aoi))
+        return self.getCount(layer)
+
+    def selectWithinDistance(self, layer, aoi, distance):
+        # The search distance is tested against the AOI itself, so no buffer of the AOI is written
+        arcpy.SelectLayerByLocation_management(layer, "WITHIN_A_DISTANCE", self.aoiTiles(aoi), str(distance) + " Meters")
+        return self.getCount(layer)
+
+    def addSpatialIndex(self, features):
+        arcpy.AddSpatialIndex_management(features)
+
+    def copyFeatures(self, inFeatures, outFeatures, where=None, fieldList=None):
+        outWorkspace, outName = os.path.split(outFeatures)
+
+        if where:
+            self.delete("copyLyr")
+            inFeatures = arcpy.MakeFeatureLayer_management(inFeatures, "copyLyr", where)
+
+        if fieldList is not None:
+            arcpy.FeatureClassToFeatureClass_conversion(inFeatures, outWorkspace, outName, '', field_mapping=self.mappingFields(inFeatures, fieldList))
+        else:
+            arcpy.FeatureClassToFeatureClass_conversion(inFeatures, outWorkspace, outName)
+
+        return outFeatures
+
+    def copyFeatureClasses(self, inFeaturesList, outWorkspace):
+        # One geoprocessing call copies every feature class
+        if inFeaturesList:
+            arcpy.FeatureClassToGeodatabase_conversion(inFeaturesList, outWorkspace)
+
+    def mappingFields(self, lyr, fieldList):
+        '''
+        Map the fields of the output (clipped) feature class. This will limit the output
+        fields to the fields chosen in the configuration spreadsheet. fieldList holds fields
+        of lyr, in the order of lyr, so the layer's fields are not listed again.
+        '''
+        fms = arcpy.FieldMappings()
+        for fieldName in fieldList:
+            fm = arcpy.FieldMap()
+            fm.addInputField(lyr, fieldName)
+            fms.addFieldMap(fm)
+
+        return fms
+
+    def clip(self, inFeatures, clipFeatures, outFeatures):
+        arcpy.Clip_analysis(inFeatures, clipFeatures, outFeatures)
+        return outFeatures
+
+    def buffer(self, inFeatures, outFeatures, distance):
+        arcpy.Buffer_analysis(inFeatures, outFeatures, distance)
+        return outFeatures
+
+    def project(self, inFeatures, outFeatures, wkid):
+        arcpy.Project_management(inFeatures, outFeatures, arcpy.SpatialReference(wkid))
+        return outFeatures
+
+    def spatialReference(self, features):
+        return arcpy.Describe(features).spatialReference.factoryCode
+
+    def geometryWKB(self, features):
+        return [bytes(row[0].WKB) for row in self.readTable(features, ["SHAPE@"]) if row[0] is not None]
+
+    def area(self, features):
+        return sum(row[0] for row in self.readTable(features, ["SHAPE@AREA"]))
+
+    def length(self, features):
+        return sum(row[0] for row in self.readTable(features, ["SHAPE@LENGTH"]))
+
+    def centroid(self, features):
+        for row in self.readTable(features, ["SHAPE@TRUECENTROID"]):
+            x, y = row[0]
+        return x, y
+
+    def mapScale(self, features):
+        self.delete('processedAOI')
+        arcpy.MakeFeatureLayer_management(features, 'processedAOI')
+        layer = arcpy.mapping.Layer('processedAOI')
+
+        mxd = arcpy.mapping.MapDocument(os.path.join(toolPath, "templates", "getScale_template.mxd"))
+        df = arcpy.mapping.ListDataFrames(mxd)[0]
+
+        arcpy.mapping.AddLayer(df, layer)
+
+        return df.scale
+
+    def writeMeasures(self, features, oids, values):
+        '''
+        Add the measure fields in values (field name -> array in the order of oids) to features in one cursor pass
+        '''
+        for name in values:
+            fieldType, alias = measureFields[name]
+            arcpy.AddField_management(features, name, fieldType, "", "", 20 if fieldType == "TEXT" else "", alias)
+
+        index = dict((oid, i) for i, oid in enumerate(oids))
+        with arcpy.da.UpdateCursor(features, ["OID@"] + list(values.keys())) as cursor:
+            for row in cursor:
+                i = index[row[0]]
+                cursor.updateRow([row[0]] + [fieldValue(values[name][i]) for name in values])
+
+    def clipCrossing(self, inFeatures, clipFeatures, outFeatures, shapeType, record):
+        '''
+        Clip inFeatures to outFeatures, running Clip_analysis on only the features that cross the AOI boundary.
+        Features completely within the AOI are copied as they are, and a polygon that contains the whole AOI
+        (of one feature) is copied with the AOI as its shape.
+        '''
+        # The inside, covering and crossing features are each held as the selection of a layer of their own,
+        # so none of them is read out as a list of OIDs
+        for layer in ('clipCandidates', 'clipInside', 'clipCovering'):
+            self.delete(layer)
+            arcpy.MakeFeatureLayer_management(inFeatures, layer)
+
+        aoiShapes = [row[0] for row in arcpy.da.SearchCursor(clipFeatures, ["SHAPE@"])]
+        checkCovering = shapeType == "Polygon" and len(aoiShapes) == 1
+
+        arcpy.SelectLayerByLocation_management('clipInside', "COMPLETELY_WITHIN", clipFeatures, "", "NEW_SELECTION")
+        record['inside'] = int(arcpy.GetCount_management('clipInside').getOutput(0))
+
+        # A feature the same shape as the AOI is both within and containing it, and is copied as an inside one
+        record['covering'] = 0
+        if checkCovering:
+            arcpy.SelectLayerByLocation_management('clipCovering', "COMPLETELY_CONTAINS", clipFeatures, "", "NEW_SELECTION")
+            arcpy.SelectLayerByLocation_management('clipCovering', "COMPLETELY_WITHIN", clipFeatures, "", "REMOVE_FROM_SELECTION")
+            record['covering'] = int(arcpy.GetCount_management('clipCovering').getOutput(0))
+
+        arcpy.SelectLayerByLocation_management('clipCandidates', "COMPLETELY_WITHIN", clipFeatures, "", "NEW_SELECTION")
+        if checkCovering:
+            arcpy.SelectLayerByLocation_management('clipCandidates', "COMPLETELY_CONTAINS", clipFeatures, "", "ADD_TO_SELECTION")
+        arcpy.SelectLayerByAttribute_management('clipCandidates', "SWITCH_SELECTION")
+        record['crossing'] = int(arcpy.GetCount_management('clipCandidates').getOutput(0))
+
+        # A tool run on a layer without a selection reads every feature, so each set is only used when it has
+        # features, and the output is otherwise made empty from the input's schema
+        if record['crossing'] > 0:
+            arcpy.Clip_analysis('clipCandidates', self.aoiTiles(clipFeatures), outFeatures)
+        else:
+            arcpy.CreateFeatureclass_management(os.path.dirname(outFeatures), os.path.basename(outFeatures),
+                                                shapeType.upper(), inFeatures, "", "", inFeatures)
+
+        if record['inside'] > 0:
+            arcpy.Append_management('clipInside', outFeatures, "NO_TEST")
+
+        if record['covering'] > 0:
+            lastOid = max([row[0] for row in arcpy.da.SearchCursor(outFeatures, ["OID@"])] or [0])
+            arcpy.Append_management('clipCovering', outFeatures, "NO_TEST")
+            with arcpy.da.UpdateCursor(outFeatures, ["OID@", "SHAPE@"]) as cursor:
+                for row in cursor:
+                    if row[0] > lastOid:
+                        cursor.updateRow([row[0], aoiShapes[0]])
+
+        for layer in ('clipCandidates', 'clipInside', 'clipCovering'):
+            self.delete(layer)
+        return outFeatures
+
+    def clipWithMeasures(self, inFeatures, clipFeatures, outFeatures, shapeType, aoiHectares, sortFields=None):
+        '''
+        Clip inFeatures and write outFeatures once, with the measure fields of the report and sorted by
+        sortFields. The measures are computed as arrays, and the clip is kept in memory until it is written.
+        '''
+        sizeField = {"Polygon": "SHAPE@AREA", "Polyline": "SHAPE@LENGTH"}.get(shapeType)
+
+        # The original measures go on the selected features so the clip carries them to each part
+        if sizeField is not None:
+            with self.stage('fields'):
+                sizes = arcpy.da.FeatureClassToNumPyArray(inFeatures, ["OID@", sizeField])
+                original = originalMeasures(shapeType, sizes[sizeField])
+                self.writeMeasures(inFeatures, sizes["OID@"], original)
+
+        clipped = os.path.join(self.memoryWorkspace, os.path.basename(outFeatures))
+        self.delete(clipped)
+        with self.stage('clip') as record:
+            self.clipCrossing(inFeatures, clipFeatures, clipped, shapeType, record)
+
+        with self.stage('fields'):
+            if sizeField is not None:
+                originalField = list(original.keys())[0]
+                sizes = arcpy.da.FeatureClassToNumPyArray(clipped, ["OID@", sizeField, originalField])
+                oids = sizes["OID@"]
+                values = overlapMeasures(shapeType, sizes[originalField], sizes[sizeField], aoiHectares)
+            elif shapeType == "Point":
+                points = arcpy.da.FeatureClassToNumPyArray(clipped, ["OID@", "SHAPE@X", "SHAPE@Y"])
+                oids = points["OID@"]
+                values = overlapMeasures(shapeType, None, numpy.column_stack((points["SHAPE@X"], points["SHAPE@Y"])), aoiHectares)
+            else:
+                oids = arcpy.da.FeatureClassToNumPyArray(clipped, ["OID@"])["OID@"]
+                values = overlapMeasures(shapeType, None, numpy.zeros(len(oids)), aoiHectares)
+
+            self.writeMeasures(clipped, oids, values)
+
+        # The only write of the clipped layer to the workspace
+        if sortFields:
+            with self.stage('sort'):
+                arcpy.Sort_management(clipped, outFeatures, sortFields)
+        else:
+            with self.stage('write'):
+                arcpy.CopyFeatures_management(clipped, outFeatures)
+
+        self.delete(clipped)
+        return outFeatures
+
+    def sort(self, inFeatures, outFeatures, sortFields):
+        arcpy.Sort_management(inFeatures, outFeatures, sortFields)
+        return outFeatures
+
+
+class ShapelyLayer(object):
+    '''
+    An in-memory layer for the Shapely engine: the features of a source that pass its definition query
+    plus the current selection. Layers made from a file are read lazily by the loader, either in full or
+    only the features within a bounding box (bbox), which is read through the file's spatial index.
+    '''
+
+    def __init__(self, name, schema, crs, features, loader=None):
+        self.name = name
+        self.schema = schema
+        self.crs = crs
+        self.loader = loader
+        self.loadedFeatures = features
+        self.bbox = None
+        self.index = None
+        self.selection = None
+
+    @property
+    def features(self):
+        if self.loadedFeatures is None or self.bbox is not None:
+            self.load()
+        return self.loadedFeatures
+
+    def load(self, bbox=None):
+        self.loadedFeatures = self.loader(bbox)
+        self.bbox = bbox
+        self.index = None
+        self.selection = None
+
+    def isLoaded(self):
+        return self.loadedFeatures is not None and self.bbox is None
+
+    def covers(self, bbox):
+        '''
+        True if the features read so far include every feature within bbox
+        '''
+        if self.isLoaded():
+            return True
+        if self.loadedFeatures is None:
+            return False
+        return self.bbox[0] <= bbox[0] and self.bbox[1] <= bbox[1] and self.bbox[2] >= bbox[2] and self.bbox[3] >= bbox[3]
+
+    def selected(self):
+        if self.selection is None:
+            return self.features
+        return [self.loadedFeatures[i] for i in self.selection]
+
+
+class ShapelyEngine(GeometryEngine):
+    '''
+    A geometry engine built on GEOS/Shapely. BCGW and MTOPROD sources are read from GeoPackage or
+    FlatGeobuf copies under dataFolder (i.e. <dataFolder>/BCGW/<dataSource>.gpkg), and scratch
+    workspaces are GeoPackages in place of file geodatabases.
+    '''
+
+    name = 'shapely'
+    containerExtensions = ('.gpkg', '.gdb', '.sqlite')
+    sourceExtensions = ('.gpkg', '.fgb')
+
+    def __init__(self, dataFolder=None):
+        if fiona is None:
+            raise RuntimeError("The shapely geometry engine requires the shapely and fiona packages")
+        self.dataFolder = dataFolder or os.path.join(toolPath, "Data")
+        self.layers = {}
+        self.queryLayers = {}
+        self.tiles = {}
+
+    # ------------------------------------------------------------------
+    # Paths
+    # ------------------------------------------------------------------
+    def splitPath(self, path):
+        '''
+        Split a feature class path into its datasource file and layer name (None for single layer files)
+        '''
+        if os.sep == '/':
+            path = path.replace('\\', '/')
+        head = path
+        tail = []
+        while head and os.path.splitext(head)[1].lower() not in self.containerExtensions:
+            head, name = os.path.split(head)
+            if not name:
+                return path, None
+            tail.insert(0, name)
+
+        if not head:
+            return path, None
+        return head, '/'.join(tail) or None
+
+    def sourcePath(self, workspace, dataSource):
+        if workspace in ('BCGW', 'MTOPROD'):
+            base = os.path.join(self.dataFolder, workspace, dataSource)
+            for ext in self.sourceExtensions:
+                if os.path.exists(base + ext):
+                    return base + ext
+            return base + self.sourceExtensions[0]
+        else:
+            return os.path.join(workspace, dataSource)
+
+    def connectionPath(self, workspace):
+        # Query layers run against the SQLite copies of the workspace's schemas (<SCHEMA>.sqlite)
+        return os.path.join(self.dataFolder, workspace)
+
+    def createWorkspace(self, folder, name):
+        if name.endswith('.gdb'):
+            name = name[:-4] + '.gpkg'
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        return name
+
+    def listWorkspaces(self, folder):
+        if not os.path.exists(folder):
+            return []
+        return [os.path.join(folder, f) for f in os.listdir(folder) if f.endswith('.gpkg')]
+
+    def exists(self, path):
+        if path in self.layers:
+            return True
+        dataset, layer = self.splitPath(path)
+        if not os.path.exists(dataset):
+            return False
+        if layer is None:
+            return True
+        return layer in fiona.listlayers(dataset)
+
+    def delete(self, path):
+        if path in self.layers:
+            del self.layers[path]
+            return
+        dataset, layer = self.splitPath(path)
+        if not os.path.exists(dataset):
+            return
+        if layer is None:
+            os.remove(dataset)
+            return
+        layers = fiona.listlayers(dataset)
+        if layers == [layer]:
+            # GDAL no longer opens a GeoPackage left without layers
+            os.remove(dataset)
+        elif layer in layers:
+            fiona.remove(dataset, layer=layer)
+
+    # ------------------------------------------------------------------
+    # Reading and writing
+    # ------------------------------------------------------------------
+    def read(self, features, where=None, bbox=None):
+        '''
+        Return (schema, crs, [(properties, geometry)]) for a feature class path or a layer. With a bbox, only
+        the features within it are read, using the spatial index of the file when it has one.
+        '''
+        if isinstance(features, ShapelyLayer):
+            return features.schema, features.crs, features.selected()
+        if features in self.layers:
+            return self.read(self.layers[features])
+
+        dataset, layer = self.splitPath(features)
+        with fiona.open(dataset, layer=layer) as src:
+            schema = src.schema
+            crs = src.crs_wkt
+            records = src.filter(bbox=bbox, where=where) if where or bbox else src
+            data = [(OrderedDict(rec['properties']), shape(rec['geometry']) if rec['geometry'] else None) for rec in records]
+
+        return schema, crs, data
+
+    def write(self, outFeatures, schema, crs, data):
+        # Feature classes in the memory workspace are kept as layers of the engine
+        if outFeatures.startswith(self.memoryWorkspace):
+            self.layers[outFeatures] = ShapelyLayer(os.path.basename(outFeatures), schema, crs, list(data))
+            return outFeatures
+
+        dataset, layer = self.splitPath(outFeatures)
+        self.delete(outFeatures)
+
+        driver = 'GPKG' if dataset.lower().endswith('.gpkg') else 'FlatGeobuf' if dataset.lower().endswith('.fgb') else 'ESRI Shapefile'
+
+        # GeoPackages get an R-tree and FlatGeobufs a packed Hilbert R-tree, used by read(bbox=...)
+        options = {'SPATIAL_INDEX': 'YES'} if driver in ('GPKG', 'FlatGeobuf') else {}
+
+        with fiona.open(dataset, 'w', driver=driver, layer=layer, schema=schema, crs_wkt=crs, **options) as dst:
+            for props, geom in data:
+                if geom is not None and 'Multi' + geom.geom_type == schema['geometry']:
+                    geom = {'Point': MultiPoint, 'LineString': MultiLineString, 'Polygon': MultiPolygon}[geom.geom_type]([geom])
+                dst.write({'geometry': mapping(geom) if geom is not None else None,
+                           'properties': dict((k, props.get(k)) for k in schema['properties'])})
+        return outFeatures
+
+    def readTable(self, table, fields, where=None):
+        dataset, sheet = self.splitExcel(table) if not isinstance(table, ShapelyLayer) else (table, None)
+        if sheet is not None:
+            for row in self.readSheet(dataset, sheet, fields):
+                yield row
+            return
+
+        schema, crs, data = self.read(table, where)
+        for props, geom in data:
+            yield tuple(self.fieldValue(props, geom, field) for field in fields)
+
+    def fieldValue(self, props, geom, field):
+        if field == 'SHAPE@':
+            return geom
+        elif field == 'SHAPE@AREA':
+            return geom.area
+        elif field == 'SHAPE@LENGTH':
+            return geom.length
+        elif field == 'SHAPE@TRUECENTROID':
+            return geom.centroid.coords[0]
+        return props.get(field)
+
+    def splitExcel(self, table):
+        '''
+        Split an arcpy style Excel sheet path (workbook.xlsx\\Sheet$) into the workbook and sheet name
+        '''
+        head, tail = os.path.split(table.replace('\\', '/'))
+        if head.lower().endswith(('.xlsx', '.xls')) and tail.endswith('$'):
+            return head, tail[:-1]
+        return table, None
+
+    def readSheet(self, workbook, sheet, fields):
+        if openpyxl is None:
+            raise RuntimeError("Reading the IOR configuration spreadsheet requires the openpyxl package")
+
+        book = openpyxl.load_workbook(workbook, read_only=True, data_only=True)
+        try:
+            rows = book[sheet].iter_rows(values_only=True)
+            header = [str(name) if name is not None else None for name in next(rows)]
+            indexes = [header.index(field) for field in fields]
+            for row in rows:
+                if all(value is None for value in row):
+                    continue
+                row = tuple(row) + (None,) * (len(header) - len(row))
+                yield tuple(row[i] for i in indexes)
+        finally:
+            book.close()
+
+    def listFields(self, features):
+        dataset, sheet = self.splitExcel(features) if not isinstance(features, ShapelyLayer) else (features, None)
+        if sheet is not None:
+            book = openpyxl.load_workbook(dataset, read_only=True)
+            try:
+                header = next(book[sheet].iter_rows(values_only=True))
+            finally:
+                book.close()
+            return [Field(str(name), str(name), 'String', False) for name in header if name is not None]
+
+        if isinstance(features, ShapelyLayer):
+            schema = features.schema
+        elif features in self.layers:
+            schema = self.layers[features].schema
+        else:
+            dataset, layer = self.splitPath(features)
+            with fiona.open(dataset, layer=layer) as src:
+                schema = src.schema
+
+        return [Field(name, measureFields.get(name, (None, name))[1], fieldType, False) for name, fieldType in schema['properties'].items()]
+
+    def shapeType(self, features):
+        if isinstance(features, ShapelyLayer):
+            geometryType = features.schema['geometry']
+        elif features in self.layers:
+            geometryType = self.layers[features].schema['geometry']
+        else:
+            dataset, layer = self.splitPath(features)
+            with fiona.open(dataset, layer=layer) as src:
+                geometryType = src.schema['geometry']
+        return {'Polygon': 'Polygon', 'MultiPolygon': 'Polygon',
+                'LineString': 'Polyline', 'MultiLineString': 'Polyline',
+                'Point': 'Point', 'MultiPoint': 'Multipoint'}.get(geometryType.replace('3D ', ''), geometryType)
+
+    def extent(self, features):
+        # Files keep their extent in their header, so only layers in memory are read
+        if isinstance(features, ShapelyLayer) or features in self.layers:
+            geoms = [geom for props, geom in self.read(features)[2] if geom is not None and not geom.is_empty]
+            if not geoms:
+                return None
+            return GeometryCollection(geoms).bounds
+
+        dataset, layer = self.splitPath(features)
+        with fiona.open(dataset, layer=layer) as src:
+            return tuple(src.bounds) if len(src) else None
+
+    def getCount(self, features, where=None):
+        # Count an unread layer from its source rather than reading every geometry
+        if isinstance(features, ShapelyLayer) and features.loadedFeatures is None and features.selection is None:
+            return features.loader(None, countOnly=True)
+        return len(self.read(features, where)[2])
+
+    def maxValue(self, table, field, where=None):
+        values = [row[0] for row in self.readTable(table, [field], where) if row[0] is not None]
+        return max(values) if values else None
+
+    # ------------------------------------------------------------------
+    # Layers and selection
+    # ------------------------------------------------------------------
+    def makeLayer(self, source, name, definitionQuery=None, join=None):
+        if isinstance(source, ShapelyLayer) or source in self.layers:
+            schema, crs, data = self.read(source, definitionQuery)
+            schema, data = self.joinFeatures(source, schema, data, join)
+            layer = ShapelyLayer(name, schema, crs, data)
+
+        else:
+            # Layers on file are only read when needed, so a selection can read just the features near the AOI
+            dataset, layerName = self.splitPath(source)
+            with fiona.open(dataset, layer=layerName) as src:
+                schema = src.schema
+                crs = src.crs_wkt
+
+            def loader(bbox, countOnly=False):
+                if countOnly:
+                    with fiona.open(dataset, layer=layerName) as src:
+                        return sum(1 for rec in src.filter(where=definitionQuery)) if definitionQuery else len(src)
+                return self.joinFeatures(source, schema, self.read(source, definitionQuery, bbox)[2], join)[1]
+
+            layer = ShapelyLayer(name, self.joinFeatures(source, schema, [], join)[0], crs, None, loader)
+
+        if definitionQuery is not None:
+            addMessage("    Definition Query applied")
+
+        if join is not None:
+            addMessage("    " + os.path.basename(source) + " joined with " + os.path.basename(join[0]))
+
+        self.layers[name] = layer
+        return layer
+
+    def joinFeatures(self, source, schema, data, join):
+        '''
+        Join a table to features, qualifying field names with their table names the same way an arcpy join does
+        '''
+        if join is None:
+            return schema, data
+
+        joinTable, layerField, joinField = join
+        layerName = os.path.splitext(os.path.basename(source))[0]
+        joinName = os.path.splitext(os.path.basename(joinTable))[0]
+
+        joinSchema, joinCrs, joinData = self.read(joinTable)
+        joinLookup = dict((props.get(joinField), props) for props, geom in joinData)
+
+        properties = OrderedDict((layerName + '.' + k, v) for k, v in schema['properties'].items())
+        properties.update((joinName + '.' + k, v) for k, v in joinSchema['properties'].items())
+
+        joined = []
+        for props, geom in data:
+            joinProps = joinLookup.get(props.get(layerField), {})
+            newProps = OrderedDict((layerName + '.' + k, v) for k, v in props.items())
+            newProps.update((joinName + '.' + k, joinProps.get(k)) for k in joinSchema['properties'])
+            joined.append((newProps, geom))
+
+        return {'geometry': schema['geometry'], 'properties': properties}, joined
+
+    def makeQueryLayer(self, connection, name, template, oidField, parameters):
+        '''
+        Run a SQL template against the SQLite stand-in of the workspace and keep the result as a layer.
+        The geometry column is the first column holding WKB or GeoPackage geometry blobs.
+        '''
+        # One connection per workspace is kept for the life of the engine
+        if connection not in self.queryLayers:
+            self.queryLayers[connection] = SQLiteQueryLayer(connection)
+
+        columns, rows = self.queryLayers[connection].execute(template, parameters)
+
+        geometryIndex = None
+        srsId = None
+        for i in range(len(columns)):
+            blobs = [row[i] for row in rows if isinstance(row[i], (bytes, bytearray, memoryview))]
+            if blobs:
+                geometryIndex = i
+                srsId = geometryBlobSRS(blobs[0])
+                break
+
+        properties = OrderedDict()
+        for i, column in enumerate(columns):
+            if i == geometryIndex or column in properties:
+                continue
+            values = [row[i] for row in rows if row[i] is not None]
+            if values and all(isinstance(value, int) for value in values):
+                properties[column] = 'int'
+            elif values and all(isinstance(value, (int, float)) for value in values):
+                properties[column] = 'float'
+            else:
+                properties[column] = 'str'
+
+        data = []
+        for row in rows:
+            geom = geometryFromBlob(row[geometryIndex]) if geometryIndex is not None and row[geometryIndex] is not None else None
+            props = OrderedDict((column, row[i] if properties[column] != 'str' or row[i] is None else str(row[i]))
+                                for i, column in enumerate(columns) if column in properties and i != geometryIndex)
+            data.append((props, geom))
+
+        geometryTypes = set(geom.geom_type for props, geom in data if geom is not None)
+        geometryType = geometryTypes.pop() if len(geometryTypes) == 1 else 'Unknown'
+
+        crs = ''
+        if srsId and pyproj is not None:
+            crs = pyproj.CRS.from_epsg(srsId).to_wkt()
+
+        layer = ShapelyLayer(name, {'geometry': geometryType, 'properties': properties}, crs, data)
+        self.layers[name] = layer
+        return layer
+
+    def aoiGeometry(self, aoi):
+        return unary_union([geom for props, geom in self.read(aoi)[2] if geom is not None])
+
+    def candidates(self, layer, bbox):
+        '''
+        Return the index of every feature of layer whose bounding box may meet bbox
+        '''
+        # Read a layer on file through the file's spatial index, or index a layer already in memory
+        if layer.loader is not None and not layer.covers(bbox):
+            layer.load(bbox)
+            return range(len(layer.loadedFeatures))
+        elif STRtree is not None:
+            if layer.index is None:
+                layer.index = STRtree([geom for props, geom in layer.loadedFeatures])
+            return sorted(layer.index.query(box(*bbox)))
+        else:
+            return range(len(layer.loadedFeatures))
+
+    def aoiTiles(self, aoiGeom):
+        '''
+        Return the AOI split into quad tiles of at most tileVertices vertices, or None when it has fewer (or
+        Shapely 1 is installed). The tiles of each AOI are made once.
+        '''
+        if not self.tileVertices or get_num_coordinates is None or get_num_coordinates(aoiGeom) <= self.tileVertices:
+            return None
+
+        key = hashlib.sha1(aoiGeom.wkb).hexdigest()
+        if key not in self.tiles:
+            if len(self.tiles) >= self.maxTiledAOIs:
+                self.tiles.clear()
+
+            tiles = quadTiles(aoiGeom, self.tileVertices)
+            for tile in tiles:
+                prepare(tile)
+            self.tiles[key] = tiles
+        return self.tiles[key]
+
+    def mapParallel(self, function, items):
+        '''
+        Run function on each item, on as many threads as there are processors. Shapely 2 releases the GIL while
+        GEOS works, so the items run in parallel.
+        '''
+        if not items:
+            return []
+
+        pool = multiprocessing.pool.ThreadPool(min(len(items), multiprocessing.cpu_count()))
+        try:
+            return pool.map(function, items)
+        finally:
+            pool.close()
+
+    def tiledSelection(self, layer, tiles, bbox, test, distance=0.0):
+        '''
+        Return the index of each candidate feature of layer (those whose bounding box meets bbox) that passes
+        test(tile, geometries) against at least one tile within distance of it
+        '''
+        indices = numpy.array([int(i) for i in self.candidates(layer, bbox) if layer.loadedFeatures[i][1] is not None], dtype=int)
+        geoms = numpy.empty(len(indices), dtype=object)
+        geoms[:] = [layer.loadedFeatures[i][1] for i in indices]
+        extents = geometryBounds(geoms).reshape(-1, 4)
+
+        def selectTile(tile):
+            minx, miny, maxx, maxy = tile.bounds
+            near = numpy.flatnonzero((extents[:, 0] <= maxx + distance) & (extents[:, 2] >= minx - distance) &
+                                     (extents[:, 1] <= maxy + distance) & (extents[:, 3] >= miny - distance))
+            return near[test(tile, geoms[near])]
+
+        # A feature that meets several tiles is only selected once
+        selected = numpy.zeros(len(indices), dtype=bool)
+        for near in self.mapParallel(selectTile, tiles):
+            selected[near] = True
+        return [int(i) for i in indices[selected]]
+
+    def tiledIntersections(self, geoms, tiles, aoiGeom, dimension):
+        '''
+        Intersect each geometry with the tiles of the AOI its bounding box meets. The pieces of a line in each tile
+        are joined back into one line. A polygon or point meeting several tiles is instead intersected with the
+        AOI cut to its bounding box, since joining polygon pieces along the tile edges takes longer than that.
+        '''
+        extents = geometryBounds(geoms).reshape(-1, 4)
+        tileExtents = numpy.array([tile.bounds for tile in tiles])
+        meets = ((extents[:, None, 0] <= tileExtents[None, :, 2]) & (extents[:, None, 2] >= tileExtents[None, :, 0]) &
+                 (extents[:, None, 1] <= tileExtents[None, :, 3]) & (extents[:, None, 3] >= tileExtents[None, :, 1]))
+        tileCounts = meets.sum(axis=1)
+
+        byTile = meets if dimension == 1 else meets & (tileCounts == 1)[:, None]
+        jobs = [(numpy.flatnonzero(byTile[:, t]), tile) for t, tile in enumerate(tiles)]
+        jobs = [(near, tile) for near, tile in jobs if len(near)]
+        if dimension != 1:
+            spanning = numpy.flatnonzero(tileCounts > 1)
+            jobs.extend((spanning[i:i + 64], None) for i in range(0, len(spanning), 64))
+
+        def clipJob(job):
+            near, tile = job
+            if tile is None:
+                return near, [geom.intersection(aoiWindow(aoiGeom, geom.bounds)) for geom in geoms[near]]
+            elif dimension == 1:
+                # Most of a long line is outside any one tile, and is cut away by the tile's rectangle first. The
+                # rectangle is padded, as clip_by_rect drops a line lying along its edge (i.e. along a tile edge)
+                minx, miny, maxx, maxy = tile.bounds
+                pad = max(maxx - minx, maxy - miny) * 0.01
+                return near, intersections(clip_by_rect(geoms[near], minx - pad, miny - pad, maxx + pad, maxy + pad), tile)
+            return near, intersections(geoms[near], tile)
+
+        pieces = [[] for geom in geoms]
+        for near, jobParts in self.mapParallel(clipJob, jobs):
+            for i, part in zip(near, jobParts):
+                part = extractDimension(part, dimension)
+                if part is not None:
+                    pieces[i].append(part)
+
+        # A feature whose bounding box meets no tile does not overlap the AOI
+        parts = numpy.empty(len(geoms), dtype=object)
+        parts[:] = [joinLines(geomPieces) if len(geomPieces) > 1 else geomPieces[0] if geomPieces else GeometryCollection() for geomPieces in pieces]
+        return parts
+
+    def selectByIntersect(self, layer, aoi):
+        '''
+        Select in two passes: find the candidates whose bounding box meets the AOI's, then test only those
+        against the prepared AOI geometry (or the tiles of a large AOI)
+        '''
+        aoiGeom = self.aoiGeometry(aoi)
+
+        tiles = self.aoiTiles(aoiGeom)
+        if tiles is not None:
+            layer.selection = self.tiledSelection(layer, tiles, aoiGeom.bounds, intersects)
+            return len(layer.selection)
+
+        preparedAOI = prep(aoiGeom)
+        layer.selection = [int(i) for i in self.candidates(layer, aoiGeom.bounds) if layer.loadedFeatures[i][1] is not None and preparedAOI.intersects(layer.loadedFeatures[i][1])]
+        return len(layer.selection)
+
+    def selectWithinDistance(self, layer, aoi, distance):
+        '''
+        Select the features within distance of the AOI: find the candidates whose bounding box meets the AOI's
+        grown by distance, then test only those against the AOI geometry without buffering it
+        '''
+        aoiGeom = self.aoiGeometry(aoi)
+        distance = float(distance)
+        minx, miny, maxx, maxy = aoiGeom.bounds
+
+        tiles = self.aoiTiles(aoiGeom)
+        if tiles is not None:
+            layer.selection = self.tiledSelection(layer, tiles, (minx - distance, miny - distance, maxx + distance, maxy + distance),
+                                                  lambda tile, geoms: dwithin(tile, geoms, distance), distance)
+            return len(layer.selection)
+
+        if dwithin is not None:
+            isWithin = lambda geom: dwithin(aoiGeom, geom, distance)
+        else:
+            isWithin = lambda geom: aoiGeom.distance(geom) <= distance
+
+        candidates = self.candidates(layer, (minx - distance, miny - distance, maxx + distance, maxy + distance))
+        layer.selection = [int(i) for i in candidates if layer.loadedFeatures[i][1] is not None and isWithin(layer.loadedFeatures[i][1])]
+        return len(layer.selection)
+
+    def overlapsAny(self, layer, aoi, distance=None):
+        '''
+        Test the candidates against the AOI geometry and stop at the first one that overlaps it, or is within
+        distance of it
+        '''
+        aoiGeom = self.aoiGeometry(aoi)
+        distance = float(distance or 0)
+        minx, miny, maxx, maxy = aoiGeom.bounds
+
+        if distance == 0:
+            isOverlap = prep(aoiGeom).intersects
+        elif dwithin is not None:
+            isOverlap = lambda geom: dwithin(aoiGeom, geom, distance)
+        else:
+            isOverlap = lambda geom: aoiGeom.distance(geom) <= distance
+
+        for i in self.candidates(layer, (minx - distance, miny - distance, maxx + distance, maxy + distance)):
+            geom = layer.loadedFeatures[i][1]
+            if geom is not None and isOverlap(geom):
+                return True
+        return False
+
+    def addSpatialIndex(self, features):
+        # write() already builds the R-tree of GeoPackages and FlatGeobufs
+        pass
+
+    def copyFeatures(self, inFeatures, outFeatures, where=None, fieldList=None):
+        schema, crs, data = self.read(inFeatures, where)
+
+        properties = OrderedDict((k.replace('.', '_'), v) for k, v in schema['properties'].items() if fieldList is None or k in fieldList)
+        data = [(OrderedDict((k.replace('.', '_'), v) for k, v in props.items() if fieldList is None or k in fieldList), geom) for props, geom in data]
+
+        geometryType = schema['geometry']
+        if geometryType in ('Polygon', 'LineString'):
+            geometryType = 'Multi' + geometryType
+
+        return self.write(outFeatures, {'geometry': geometryType, 'properties': properties}, crs, data)
+
+    # ------------------------------------------------------------------
+    # Geometry operations
+    # ------------------------------------------------------------------
+    def clip(self, inFeatures, clipFeatures, outFeatures):
+        schema, crs, data = self.read(inFeatures)
+        clipGeom = self.aoiGeometry(clipFeatures)
+        dimension = {'Polygon': 2, 'Polyline': 1}.get(self.shapeType(inFeatures), 0)
+
+        clipped = []
+        for props, geom in data:
+            if geom is None:
+                continue
+            part = extractDimension(geom.intersection(clipGeom), dimension)
+            if part is not None:
+                clipped.append((props, part))
+
+        return self.write(outFeatures, schema, crs, clipped)
+
+    def buffer(self, inFeatures, outFeatures, distance):
+        schema, crs, data = self.read(inFeatures)
+        schema = {'geometry': 'MultiPolygon', 'properties': schema['properties']}
+        return self.write(outFeatures, schema, crs, [(props, geom.buffer(float(distance))) for props, geom in data])
+
+    def project(self, inFeatures, outFeatures, wkid):
+        if pyproj is None:
+            raise RuntimeError("Re-projecting with the shapely geometry engine requires the pyproj package")
+
+        schema, crs, data = self.read(inFeatures)
+        transformer = pyproj.Transformer.from_crs(pyproj.CRS.from_wkt(crs), pyproj.CRS.from_epsg(wkid), always_xy=True)
+        outCrs = pyproj.CRS.from_epsg(wkid).to_wkt()
+
+        return self.write(outFeatures, schema, outCrs, [(props, transform(transformer.transform, geom)) for props, geom in data])
+
+    def spatialReference(self, features):
+        crs = self.read(features)[1]
+        if pyproj is not None and crs:
+            return pyproj.CRS.from_wkt(crs).to_epsg() or 0
+        return 0
+
+    def geometryWKB(self, features):
+        return [geom.wkb for props, geom in self.read(features)[2] if geom is not None]
+
+    def normalizedWKB(self, features):
+        # Same ring start and orientation, and same order of parts, for equal geometries
+        return [geom.normalize().wkb for props, geom in self.read(features)[2] if geom is not None]
+
+    def area(self, features):
+        return sum(geom.area for props, geom in self.read(features)[2] if geom is not None)
+
+    def length(self, features):
+        return sum(geom.length for props, geom in self.read(features)[2] if geom is not None)
+
+    def centroid(self, features):
+        return self.aoiGeometry(features).centroid.coords[0]
+
+    def mapScale(self, features):
+        '''
+        Approximate the full extent scale arcpy reports from the getScale_template data frame
+        (roughly 25cm x 18cm of page)
+        '''
+        minx, miny, maxx, maxy = self.aoiGeometry(features).bounds
+        return max((maxx - minx) / 0.25, (maxy - miny) / 0.18, 500)
+
+    # ------------------------------------------------------------------
+    # Report fields
+    # ------------------------------------------------------------------
+    def clipWithMeasures(self, inFeatures, clipFeatures, outFeatures, shapeType, aoiHectares, sortFields=None):
+        '''
+        Clip inFeatures and write outFeatures once, with the measure fields of the report and sorted by
+        sortFields. The clip and the measures are computed over arrays of geometries in one pass.
+        '''
+        with self.stage('clip') as record:
+            schema, crs, data = self.read(inFeatures)
+            clipGeom = self.aoiGeometry(clipFeatures)
+            dimension = {'Polygon': 2, 'Polyline': 1}.get(shapeType, 0)
+
+            data = [(props, geom) for props, geom in data if geom is not None]
+            geoms = numpy.empty(len(data), dtype=object)
+            geoms[:] = [geom for props, geom in data]
+
+            inside, covering = self.containment(geoms, clipGeom, dimension)
+            crossing = ~(inside | covering)
+            record['inside'], record['covering'], record['crossing'] = int(inside.sum()), int(covering.sum()), int(crossing.sum())
+
+            # Only the features crossing the AOI boundary are intersected: a feature inside the AOI is its own
+            # overlap, and the overlap of a feature covering the AOI is the AOI
+            parts = numpy.empty(len(geoms), dtype=object)
+            parts[inside] = geoms[inside]
+            parts[covering] = clipGeom
+
+            # The features crossing a large AOI are intersected with the tiles they meet instead of the whole AOI
+            tiles = self.aoiTiles(clipGeom)
+            if tiles is not None:
+                record['tiles'] = len(tiles)
+                parts[crossing] = self.tiledIntersections(geoms[crossing], tiles, clipGeom, dimension)
+            elif intersections is not None:
+                parts[crossing] = intersections(geoms[crossing], clipGeom)
+            else:
+                parts[crossing] = [geom.intersection(clipGeom) for geom in geoms[crossing]]
+
+            kept = []
+            clipped = []
+            for i, part in enumerate(parts):
+                part = extractDimension(part, dimension)
+                if part is not None:
+                    kept.append(i)
+                    clipped.append(part)
+
+        with self.stage('fields'):
+            original = geoms[kept]
+            clippedGeoms = numpy.empty(len(clipped), dtype=object)
+            clippedGeoms[:] = clipped
+
+            if shapeType == 'Polygon':
+                values = originalMeasures(shapeType, areas(original) if areas is not None else numpy.array([geom.area for geom in original]))
+                overlap = areas(clippedGeoms) if areas is not None else numpy.array([geom.area for geom in clippedGeoms])
+            elif shapeType == 'Polyline':
+                values = originalMeasures(shapeType, lengths(original) if lengths is not None else numpy.array([geom.length for geom in original]))
+                overlap = lengths(clippedGeoms) if lengths is not None else numpy.array([geom.length for geom in clippedGeoms])
+            elif shapeType == 'Point':
+                values = OrderedDict()
+                overlap = numpy.array([(geom.x, geom.y) for geom in clippedGeoms]).reshape(-1, 2)
+            else:
+                values = OrderedDict()
+                overlap = numpy.zeros(len(clipped))
+
+            values.update(overlapMeasures(shapeType, list(values.values())[0] if values else None, overlap, aoiHectares))
+
+            properties = OrderedDict(schema['properties'])
+            for name in values:
+                properties[name] = 'str:20' if measureFields[name][0] == 'TEXT' else 'float'
+
+            newData = []
+            for n, i in enumerate(kept):
+                props = OrderedDict(data[i][0])
+                for name, column in values.items():
+                    props[name] = fieldValue(column[n])
+                newData.append((props, clipped[n]))
+
+        if sortFields:
+            with self.stage('sort'):
+                sortRecords(newData, sortFields)
+
+        with self.stage('write'):
+            return self.write(outFeatures, {'geometry': schema['geometry'], 'properties': properties}, crs, newData)
+
+    def containment(self, geoms, clipGeom, dimension):
+        '''
+        Return the boolean arrays (inside, covering) of the geometries that lie entirely inside the AOI and of
+        the polygons that cover the whole AOI. Every other geometry crosses the AOI boundary.
+        '''
+        covering = numpy.zeros(len(geoms), dtype=bool)
+
+        if covers is not None:
+            prepare(clipGeom)
+            inside = covers(clipGeom, geoms)
+        else:
+            preparedAOI = prep(clipGeom)
+            inside = numpy.array([preparedAOI.covers(geom) for geom in geoms], dtype=bool)
+
+        # Only a polygon whose bounding box holds the AOI's can cover it, so test just those
+        if dimension == 2 and len(geoms):
+            minx, miny, maxx, maxy = clipGeom.bounds
+            if geometryBounds is not None:
+                extents = geometryBounds(geoms)
+            else:
+                extents = numpy.array([geom.bounds for geom in geoms])
+            candidates = ~inside & (extents[:, 0] <= minx) & (extents[:, 1] <= miny) & (extents[:, 2] >= maxx) & (extents[:, 3] >= maxy)
+            covering[candidates] = [geom.covers(clipGeom) for geom in geoms[candidates]]
+
+        return inside, covering
+
+    def sort(self, inFeatures, outFeatures, sortFields):
+        schema, crs, data = self.read(inFeatures)
+        return self.write(outFeatures, schema, crs, sortRecords(data, sortFields))
+
+
+def sortRecords(data, sortFields):
+    '''
+    Sort (properties, geometry) records in place by a list of [field, 'ASCENDING'|'DESCENDING'] pairs
+    '''
+    # Python sorts are stable, so sort on the last key first
+    for field, direction in reversed(sortFields):
+        data.sort(key=lambda item: (item[0].get(field) is None, item[0].get(field)), reverse=direction.upper().startswith('DESC'))
+    return data
+
+
+def originalMeasures(shapeType, sizes):
+    '''
+    The ORIGINAL_ measure of each feature before it is clipped, from an array of its area (Polygon, square
+    metres) or length (Polyline, metres)
+    '''
+    if shapeType == "Polygon":
+        return OrderedDict([("ORIGINAL_HECTARES", numpy.round(sizes / 10000.0, 6))])
+    elif shapeType == "Polyline":
+        return OrderedDict([("ORIGINAL_LENGTH", numpy.round(sizes / 1000.0, 6))])
+    return OrderedDict()
+
+
+def overlapMeasures(shapeType, original, sizes, aoiHectares):
+    '''
+    The overlap measures of clipped features. original is the array of ORIGINAL_ values carried by each clipped
+    feature, and sizes the array of its clipped area or length, or of its (x, y) for points.
+    '''
+    if shapeType == "Polygon":
+        overlap = numpy.round(sizes / 10000.0, 6)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            percentOfLayer = numpy.where(original != 0, numpy.round(overlap / original * 100, 6), numpy.nan)
+        percentOfAOI = numpy.round(overlap / aoiHectares * 100, 12) if aoiHectares else numpy.full(len(overlap), numpy.nan)
+        return OrderedDict([("OVERLAPPING_HECTARES", overlap),
+                            ("PERCENT_OF_LAYER_BEING_OVERLAPPED_BY_AOI", percentOfLayer),
+                            ("PERCENT_OF_AOI_BEING_OVERLAPPED_BY_LAYER", percentOfAOI)])
+
+    elif shapeType == "Polyline":
+        return OrderedDict([("OVERLAPPING_LENGTH", numpy.round(sizes / 1000.0, 6))])
+
+    elif shapeType == "Point":
+        return OrderedDict([("EASTING", sizes[:, 0]), ("NORTHING", sizes[:, 1])])
+
+    elif shapeType == "Multipoint":
+        return OrderedDict([("POINT_LOCATION", ["Point Location"] * len(sizes))])
+
+    return OrderedDict()
+
+
+def fieldValue(value):
+    '''
+    Turn a numpy value into the python value written to a field (NaN is written as null)
+    '''
+    if isinstance(value, numpy.generic):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def geometryBlobHeader(blob):
+    '''
+    Return (header length, srs id) of a GeoPackage geometry blob, or (0, None) for plain WKB
+    '''
+    blob = bytes(blob)
+    if blob[:2] != b'GP':
+        return 0, None
+
+    flags = bytearray(blob[3:4])[0]
+    envelopeLength = {0: 0, 1: 32, 2: 48, 3: 48, 4: 64}.get((flags >> 1) & 7, 0)
+    srsId = struct.unpack('<i' if flags & 1 else '>i', blob[4:8])[0]
+    return 8 + envelopeLength, srsId
+
+
+def geometryBlobSRS(blob):
+    return geometryBlobHeader(blob)[1]
+
+
+def geometryFromBlob(blob):
+    '''
+    Read a WKB or GeoPackage geometry blob from a SQLite query
+    '''
+    headerLength = geometryBlobHeader(blob)[0]
+    return wkb.loads(bytes(blob)[headerLength:])
+
+
+def extractDimension(geom, dimension):
+    '''
+    Keep only the parts of a clip result with the same dimension as the input layer
+    (a polygon clipped along a shared edge can return lines and points as well)
+    '''
+    if geom.is_empty:
+        return None
+
+    if geom.geom_type == 'GeometryCollection':
+        parts = [part for part in geom.geoms if dimensionOf(part) == dimension]
+        if not parts:
+            return None
+        geom = unary_union(parts)
+
+    return geom if dimensionOf(geom) == dimension else None
+
+
+def joinLines(pieces):
+    '''
+    Join the pieces of a line clipped by adjacent tiles back into one line. A piece lying along the edge two tiles
+    share is handed back by both, so the pieces are unioned first to keep one copy of it.
+    '''
+    return linemerge(unary_union(pieces))
+
+
+def aoiWindow(aoiGeom, bounds):
+    '''
+    The part of the AOI within bounds
+    '''
+    # Clipping by a rectangle is much faster than an overlay with it, but can leave rings that touch themselves
+    window = clip_by_rect(aoiGeom, *bounds)
+    if not window.is_valid:
+        window = extractDimension(make_valid(window), 2) or MultiPolygon()
+    return window
+
+
+def quadTiles(geom, limit, depth=12):
+    '''
+    Split a polygon into its parts in each quadrant of its bounding box, and split those parts again, until no
+    part has more than limit vertices
+    '''
+    if depth == 0 or get_num_coordinates(geom) <= limit:
+        # Rings left touching themselves by clip_by_rect are only repaired in the tiles, since checking a large
+        # part takes far longer than clipping it
+        if not geom.is_valid:
+            geom = extractDimension(make_valid(geom), 2)
+        return [geom] if geom is not None else []
+
+    minx, miny, maxx, maxy = geom.bounds
+    midx, midy = (minx + maxx) / 2.0, (miny + maxy) / 2.0
+
+    tiles = []
+    for quadrant in ((minx, miny, midx, midy), (midx, miny, maxx, midy), (minx, midy, midx, maxy), (midx, midy, maxx, maxy)):
+        part = extractDimension(clip_by_rect(geom, *quadrant), 2)
+        if part is not None:
+            tiles.extend(quadTiles(part, limit, depth - 1))
+    return tiles
+
+
+def dimensionOf(geom):
+    return {'Point': 0, 'MultiPoint': 0, 'LineString': 1, 'MultiLineString': 1, 'LinearRing': 1,
+            'Polygon': 2, 'MultiPolygon': 2}.get(geom.geom_type, -1)
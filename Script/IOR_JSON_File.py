@@ -0,0 +1,74 @@
+'''
+Tool name: Interest Overlap Report (IOR) - JSON Files
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+The IOR keeps its manifests and caches as small JSON files in the local IOR folder, and a report may read
+one while the snapshot refresh job or another report writes it. A file is written to a temporary file of its
+own in the same folder and then moved over the old one, so a reader finds the whole old file or the whole
+new one. A file that is missing or cannot be parsed is read as None, so one bad file only costs the
+cache it holds.
+'''
+
+import os
+import json
+import time
+import tempfile
+
+## Windows MoveFileEx flag to move a file over an existing one
+MOVEFILE_REPLACE_EXISTING = 0x1
+
+
+def readJSON(path):
+    '''
+    A function to read a JSON file. Returns None if the file is missing, truncated or not JSON.
+    '''
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def writeJSON(path, data, **options):
+    '''
+    A function to write data to a JSON file through a temporary file of its own, then move it over path
+    '''
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    handle, tempPath = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=folder or None)
+    try:
+        with os.fdopen(handle, 'w') as f:
+            json.dump(data, f, **options)
+        replaceFile(tempPath, path)
+    except:
+        if os.path.exists(tempPath):
+            os.remove(tempPath)
+        raise
+
+
+def replaceFile(tempPath, path, attempts=5):
+    '''
+    A function to move tempPath over path in one step. Python 3 uses os.replace. Python 2 (ArcMap) has no
+    os.replace and its os.rename will not overwrite a file on Windows, so there MoveFileEx is called directly.
+    Windows refuses the move while another process has path open, so the move is tried a few times.
+    '''
+    for attempt in range(attempts):
+        try:
+            if hasattr(os, 'replace'):
+                os.replace(tempPath, path)
+            elif os.name == 'nt':
+                import ctypes
+                if not ctypes.windll.kernel32.MoveFileExW(tempPath, path, MOVEFILE_REPLACE_EXISTING):
+                    raise ctypes.WinError()
+            else:
+                os.rename(tempPath, path)
+            return
+        except OSError:
+            if os.name != 'nt' or attempt == attempts - 1:
+                raise
+            time.sleep(0.1 * (attempt + 1))
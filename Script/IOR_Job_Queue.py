@@ -0,0 +1,134 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Job Queue
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+The reports submitted to the report service (IOR_Report_Service.py) wait in a local SQLite database until one
+of the service's workers claims them. Each job keeps its tool parameters, its status (queued, running, done or
+failed), the messages written while it ran and the paths of its report workbooks, so a report can be submitted
+from the toolbox, the command line or HTTP and followed from any of them. Every call opens its own database
+connection, so the queue can be shared by the service's threads and worker processes.
+'''
+
+import os
+import json
+import time
+import sqlite3
+from contextlib import closing
+
+## Status of a job as it moves through the queue
+jobStatuses = ('queued', 'running', 'done', 'failed')
+
+
+class JobQueue(object):
+    '''
+    The report jobs of the SQLite database at path
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+        if not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        with closing(self.connect()) as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, status TEXT, parameters TEXT, "
+                               "submitted REAL, started REAL, finished REAL, worker INTEGER, artifacts TEXT, error TEXT)")
+            connection.execute("CREATE TABLE IF NOT EXISTS messages (seq INTEGER PRIMARY KEY AUTOINCREMENT, job INTEGER, message TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS messages_job ON messages (job, seq)")
+
+    def connect(self):
+        # Autocommit, so a claim can hold the write lock with BEGIN IMMEDIATE until it has marked its job
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def submit(self, parameters):
+        '''
+        Add a report to the end of the queue. Returns the id of its job.
+        '''
+        with closing(self.connect()) as connection:
+            cursor = connection.execute("INSERT INTO jobs (status, parameters, submitted) VALUES ('queued', ?, ?)",
+                                        (json.dumps(parameters, sort_keys=True), time.time()))
+            return cursor.lastrowid
+
+    def claim(self, worker):
+        '''
+        Mark the oldest queued job as running on worker. Returns (id, parameters), or None when no job is queued.
+        '''
+        with closing(self.connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute("SELECT id, parameters FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+
+            connection.execute("UPDATE jobs SET status = 'running', started = ?, worker = ? WHERE id = ?", (time.time(), worker, row[0]))
+            connection.execute("COMMIT")
+            return row[0], json.loads(row[1])
+
+    def requeue(self):
+        '''
+        Put the jobs left running by a service that stopped back in the queue. Returns how many there were.
+        '''
+        with closing(self.connect()) as connection:
+            return connection.execute("UPDATE jobs SET status = 'queued', started = NULL, worker = NULL WHERE status = 'running'").rowcount
+
+    def addMessage(self, job, message):
+        with closing(self.connect()) as connection:
+            connection.execute("INSERT INTO messages (job, message) VALUES (?, ?)", (job, message))
+
+    def finish(self, job, artifacts):
+        with closing(self.connect()) as connection:
+            connection.execute("UPDATE jobs SET status = 'done', finished = ?, artifacts = ? WHERE id = ?", (time.time(), json.dumps(artifacts), job))
+
+    def fail(self, job, error):
+        with closing(self.connect()) as connection:
+            connection.execute("UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE id = ?", (time.time(), error, job))
+
+    def job(self, job):
+        '''
+        Return a job as a dictionary, or None when there is no such job
+        '''
+        jobs = self.jobs(job=job)
+        return jobs[0] if jobs else None
+
+    def jobs(self, status=None, job=None, limit=100):
+        '''
+        Return the latest jobs as dictionaries, newest first
+        '''
+        sql = "SELECT id, status, parameters, submitted, started, finished, worker, artifacts, error FROM jobs"
+        where, values = [], []
+        if status is not None:
+            where.append("status = ?")
+            values.append(status)
+        if job is not None:
+            where.append("id = ?")
+            values.append(job)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        values.append(limit)
+
+        with closing(self.connect()) as connection:
+            rows = connection.execute(sql, values).fetchall()
+
+        return [{'id': row[0],
+                 'status': row[1],
+                 'parameters': json.loads(row[2]),
+                 'submitted': row[3],
+                 'started': row[4],
+                 'finished': row[5],
+                 'worker': row[6],
+                 'artifacts': json.loads(row[7]) if row[7] else [],
+                 'error': row[8]} for row in rows]
+
+    def messages(self, job, after=0):
+        '''
+        Return the (seq, message) written by a job after message seq after
+        '''
+        with closing(self.connect()) as connection:
+            return connection.execute("SELECT seq, message FROM messages WHERE job = ? AND seq > ? ORDER BY seq", (job, after)).fetchall()
+
+    def counts(self):
+        with closing(self.connect()) as connection:
+            counts = dict(connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return dict((status, counts.get(status, 0)) for status in jobStatuses)
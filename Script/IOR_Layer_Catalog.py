@@ -0,0 +1,295 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Layer Catalog
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+The report, the district sheet and the toolbox validator all need the rows of the IOR_Data and Apps sheets of
+InterestReport_Layer_List_MASTER.xlsx. Reading the workbook through a cursor is slow, so the sheets are compiled
+once into a local catalog file (JSON) holding the rows, the column types, a name/category/predefined layer list
+index and the sha1 of the workbook. The catalog is only compiled again when the workbook's modified time and
+content hash change, and loadCatalog keeps one copy in memory for the rest of the run.
+
+The statistics of each source (row count, extent and shape type, with its definition query applied) are kept
+next to the compiled catalogs in layer_statistics.json. They are written by the snapshot refresh job, so a report
+can log the size of a layer and plan its work without counting the live source.
+'''
+
+import os
+import json
+import time
+import hashlib
+import datetime
+from IOR_Geometry_Engine import getEngine, addMessage, toolPath
+from IOR_JSON_File import readJSON, writeJSON
+
+## The master configuration spreadsheet
+masterXLS = os.path.join(toolPath, "Excel_Spreadsheets", "InterestReport_Layer_List_MASTER.xlsx")
+
+## Local (not network share) location of the compiled catalogs
+if os.environ.get('LOCALAPPDATA'):
+    catalogFolder = os.path.join(os.environ['LOCALAPPDATA'], 'IOR', 'Catalog')
+else:
+    catalogFolder = os.path.join(os.path.expanduser('~'), '.ior', 'catalog')
+
+## Statistics of the catalog's sources, written by the snapshot refresh job
+statisticsPath = os.path.join(catalogFolder, 'layer_statistics.json')
+
+## Statistics already loaded in this process, keyed by path
+loadedStatistics = {}
+
+## Bump when the layout of the compiled catalog changes so old catalogs are compiled again
+catalogVersion = 1
+
+## Predefined layer lists of the toolbox and the region flag column used by each
+regionPresets = [('PMA Layers', 30),
+                 ('North East\\North Central Permitting Layers', 31),
+                 ('North West Permitting Layers', 32),
+                 ('South Central Permitting Layers', 33),
+                 ('South East Permitting Layers', 34),
+                 ('South West Permitting Layers', 35)]
+
+## Compiled catalogs already loaded in this process, keyed by workbook path
+loadedCatalogs = {}
+
+
+class LayerCatalog(object):
+    '''
+    The compiled rows of the IOR_Data sheet, the Apps sheet and their indexes. Rows are tuples in the
+    column order of IOR_Data, so row[2] is still Featureclass_Name, row[12] Buffer_Distance and so on.
+    '''
+
+    def __init__(self, xls, sourceHash, sourceMTime, fields, fieldTypes, rows, apps):
+        self.xls = xls
+        self.sourceHash = sourceHash
+        self.sourceMTime = sourceMTime
+        self.fields = fields
+        self.fieldTypes = fieldTypes
+        self.rows = [tuple(row) for row in rows]
+        self.apps = apps
+
+        self.byName = {}
+        self.categories = {}
+        for i, row in enumerate(self.rows):
+            self.byName.setdefault(row[2], i)
+            self.categories.setdefault(row[1], []).append(i)
+
+        self.presets = self.buildPresets()
+
+    def layer(self, name):
+        '''
+        Return the row of a layer by its Featureclass_Name
+        '''
+        return self.rows[self.byName[name]]
+
+    def category(self, category):
+        '''
+        Return the rows of one category in spreadsheet order
+        '''
+        return [self.rows[i] for i in self.categories.get(category, [])]
+
+    def layers(self, layerList):
+        '''
+        Return the rows of the layers in layerList, in spreadsheet order
+        '''
+        layerList = set(layerList)
+        return [row for row in self.rows if row[2] in layerList]
+
+    def buildPresets(self):
+        '''
+        Build the predefined layer lists offered by the toolbox. Mining layers (tenures, then reserves, then the
+        other Mineral/Coal layers) always come first, followed by the other layers of the list in name order.
+        '''
+        tenure = [str(row[2]) for row in self.category('Mineral/Coal') if 'Tenure -' in row[2]]
+        reserve = [str(row[2]) for row in self.category('Mineral/Coal') if 'Tenure -' not in row[2] and 'Reserves -' in row[2]]
+        otherMiningLayers = [row[2] for row in self.category('Mineral/Coal') if 'Tenure -' not in row[2] and 'Reserves -' not in row[2]]
+        miningLayers = tenure + reserve + otherMiningLayers
+
+        allLayers = [row[2] for row in self.rows if row[1] not in ('District', 'Location', 'Mineral/Coal')]
+
+        presets = {'All Layers': miningLayers + sorted(allLayers),
+                   'Mining Layers Only': miningLayers}
+
+        for presetName, column in regionPresets:
+            presets[presetName] = miningLayers + sorted(str(row[2]) for row in self.rows if row[column] == 'Y')
+
+        return presets
+
+    def presetLayers(self, layerGroup):
+        return list(self.presets.get(layerGroup, []))
+
+    def statistics(self, row):
+        '''
+        Return the cached statistics of a layer's source, or None when the refresh job has not recorded them
+        '''
+        return loadStatistics().get(row)
+
+    def toJSON(self):
+        return {'version': catalogVersion,
+                'xls': self.xls,
+                'sourceHash': self.sourceHash,
+                'sourceMTime': self.sourceMTime,
+                'fields': self.fields,
+                'fieldTypes': self.fieldTypes,
+                'rows': self.rows,
+                'apps': self.apps,
+                'byName': self.byName,
+                'categories': self.categories,
+                'presets': self.presets}
+
+    @classmethod
+    def fromJSON(cls, data):
+        return cls(data['xls'], data['sourceHash'], data['sourceMTime'], data['fields'], data['fieldTypes'], data['rows'], data['apps'])
+
+
+class LayerStatistics(object):
+    '''
+    The row count, extent and shape type of each source, keyed by workspace_path, dataSource and
+    Definition_Query (the same source read by several layers is only recorded once)
+    '''
+
+    def __init__(self, path=None):
+        self.path = path or statisticsPath
+        self.mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+        self.entries = self.load()
+
+    def load(self):
+        if self.mtime is None:
+            return {}
+        return readJSON(self.path) or {}
+
+    def save(self):
+        writeJSON(self.path, self.entries, indent=2, sort_keys=True)
+        self.mtime = os.path.getmtime(self.path)
+
+    def get(self, row):
+        return self.entries.get(sourceKey(row[4], row[5], row[7]))
+
+    def record(self, row, count, extent, shapeType):
+        self.entries[sourceKey(row[4], row[5], row[7])] = {'name': row[2],
+                                                            'count': count,
+                                                            'extent': list(extent) if extent is not None else None,
+                                                            'shapeType': shapeType,
+                                                            'updated': time.time()}
+
+
+def sourceKey(workspace, dataSource, definitionQuery):
+    '''
+    A key for one source as a layer reads it: its workspace, dataSource and definition query
+    '''
+    return hashlib.sha1('|'.join([str(workspace), str(dataSource), str(definitionQuery or '')]).encode('utf-8')).hexdigest()[:16]
+
+
+def loadStatistics(path=None):
+    '''
+    A function to return the layer statistics at path. The copy in memory is reused while the file is unchanged,
+    so a run (and each pool worker) reads them once.
+    '''
+    path = path or statisticsPath
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+
+    statistics = loadedStatistics.get(path)
+    if statistics is None or statistics.mtime != mtime:
+        statistics = loadedStatistics[path] = LayerStatistics(path)
+
+    return statistics
+
+
+def hashFile(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def rowHash(row):
+    '''
+    A hash of every column of a layer's row, so results made from an earlier version of the row are not reused
+    '''
+    return hashlib.sha1(json.dumps(list(row)).encode('utf-8')).hexdigest()[:16]
+
+
+def catalogPath(xls):
+    '''
+    The compiled catalog of a workbook, named after the workbook so test and master lists do not collide
+    '''
+    name = os.path.splitext(os.path.basename(xls))[0]
+    return os.path.join(catalogFolder, name + '_' + hashlib.sha1(os.path.abspath(xls).encode('utf-8')).hexdigest()[:8] + '.json')
+
+
+def typedValue(value):
+    '''
+    Keep cell values JSON friendly: text, numbers and None pass through, dates are written as ISO strings
+    '''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def compileCatalog(xls, engine, sourceHash=None):
+    '''
+    A function to read the IOR_Data and Apps sheets of a configuration spreadsheet into a LayerCatalog
+    '''
+    addMessage("Compiling layer catalog...")
+
+    IOR_Data = os.path.join(xls, 'IOR_Data$')
+    apps_Data = os.path.join(xls, 'Apps$')
+
+    fieldList = engine.listFields(IOR_Data)
+    fields = [field.name for field in fieldList]
+    fieldTypes = [str(field.type) for field in fieldList]
+
+    rows = [[typedValue(value) for value in row] for row in engine.readTable(IOR_Data, fields)]
+
+    apps = {}
+    for row in engine.readTable(apps_Data, ['App', 'URL']):
+        if row[0] is not None:
+            apps[str(row[0])] = row[1]
+
+    return LayerCatalog(xls, sourceHash or hashFile(xls), os.path.getmtime(xls), fields, fieldTypes, rows, apps)
+
+
+def saveCatalog(catalog, path):
+    writeJSON(path, catalog.toJSON())
+
+
+def readCatalog(path):
+    data = readJSON(path)
+    if data is None or data.get('version') != catalogVersion:
+        return None
+    return LayerCatalog.fromJSON(data)
+
+
+def loadCatalog(xls=None, engine=None):
+    '''
+    A function to return the compiled catalog of a configuration spreadsheet. The catalog in memory is reused
+    while the workbook's modified time is unchanged. Otherwise the compiled catalog file is reused when the
+    workbook's content hash still matches, and the workbook is only compiled again when it has changed.
+    '''
+    xls = xls or masterXLS
+    mtime = os.path.getmtime(xls)
+
+    catalog = loadedCatalogs.get(xls)
+    if catalog is not None and catalog.sourceMTime == mtime:
+        return catalog
+
+    path = catalogPath(xls)
+    catalog = readCatalog(path)
+
+    if catalog is None or catalog.sourceMTime != mtime:
+        sourceHash = hashFile(xls)
+
+        if catalog is not None and catalog.sourceHash == sourceHash:
+            # The workbook was saved without changes, so only the modified time is updated
+            catalog.sourceMTime = mtime
+        else:
+            catalog = compileCatalog(xls, engine or getEngine(), sourceHash)
+
+        try:
+            saveCatalog(catalog, path)
+        except (IOError, OSError):
+            addMessage("    Could not save the layer catalog to " + path)
+
+    loadedCatalogs[xls] = catalog
+
+    return catalog
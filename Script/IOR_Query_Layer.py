@@ -0,0 +1,112 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Query Layers
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+Layers with a Query_Layer (i.e. Tenure - Good Standing.sql;TENURE_NUMBER_ID) are read through one of the SQL
+templates in sqls, limited to the IDs of the features selected by the AOI. The IDs used to be written into the
+SQL as "t.X IN (...) OR t.X IN (...)" lists of 1000, so thousands of overlapping tenures made SQL that was slow
+for Oracle to parse. The ID set now fills the template's IN (:ids) parameter as a single value instead:
+
+    - Oracle (arcpy engine): one JSON array literal read back into rows by JSON_TABLE. This is still written
+      into the SQL, not bound: Make Query Layer takes SQL text only and runs it in its own sessions, so a bind
+      variable, or a temporary table filled through ArcSDESQLExecute (whose rows only its own session sees),
+      cannot reach it. The AOI cannot be pushed into the SQL either, as the IDs come from the layer's selection.
+    - SQLite (shapely engine): rows of a temporary table filled through parameters
+
+SQLiteQueryLayer is the local stand-in for the warehouse. Each <SCHEMA>.sqlite file in a workspace folder
+(i.e. <data folder>/MTOPROD/MTA.sqlite) is attached under its schema name, so the SQL files can name tables
+the same way they do in Oracle (mta.mta_tenure). SpatiaLite is loaded when it is installed.
+'''
+
+import os
+import json
+import numbers
+import sqlite3
+
+## Oracle string literals are limited to 4000 bytes, so longer ID arrays are concatenated from pieces
+oracleLiteralLength = 4000
+
+
+def oracleIdSet(ids):
+    '''
+    A function to return a subquery of ids, with the ID set written as one JSON array literal (a CLOB built from
+    4000 byte pieces) read by JSON_TABLE rather than as IN lists of literals
+    '''
+    ids = sorted(set(ids))
+
+    if all(isinstance(i, numbers.Number) for i in ids):
+        idType = "NUMBER"
+    else:
+        idType = "VARCHAR2(4000)"
+        ids = [str(i) for i in ids]
+
+    array = json.dumps(ids, separators=(',', ':'))
+
+    # Quotes are doubled after splitting so a doubled quote is never split across two pieces
+    pieces = ["TO_CLOB('" + array[i:i + oracleLiteralLength // 2].replace("'", "''") + "')" for i in range(0, len(array), oracleLiteralLength // 2)]
+
+    return "SELECT ID FROM JSON_TABLE(" + " || ".join(pieces) + ", '$[*]' COLUMNS (ID " + idType + " PATH '$'))"
+
+
+def oracleLiteral(value):
+    '''
+    A function to write a single parameter value as an Oracle literal
+    '''
+    if value is None:
+        return "NULL"
+    elif isinstance(value, numbers.Number):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class SQLiteQueryLayer(object):
+    '''
+    Run SQL templates against the SQLite copies of a workspace's schemas in folder. The connection is kept
+    open, so the compiled statement of each template is reused by later queries.
+    '''
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(':memory:')
+
+            try:
+                self.connection.enable_load_extension(True)
+                self.connection.load_extension('mod_spatialite')
+            except (AttributeError, sqlite3.OperationalError):
+                pass
+
+            for filename in sorted(os.listdir(self.folder)):
+                if filename.lower().endswith('.sqlite'):
+                    self.connection.execute("ATTACH DATABASE ? AS " + os.path.splitext(filename)[0], (os.path.join(self.folder, filename),))
+
+        return self.connection
+
+    def execute(self, template, parameters):
+        '''
+        Run a SQL template with its set parameters bound through temporary tables and its other parameters
+        bound by name. Returns the column names and the rows.
+        '''
+        template.checkParameters(parameters)
+        connection = self.connect()
+
+        for name in template.setParameters:
+            connection.execute("CREATE TEMP TABLE IF NOT EXISTS ior_" + name + " (ID PRIMARY KEY)")
+            connection.execute("DELETE FROM temp.ior_" + name)
+            connection.executemany("INSERT OR IGNORE INTO temp.ior_" + name + " (ID) VALUES (?)", [(i,) for i in parameters[name]])
+
+        sql = template.prepare(lambda name: "SELECT ID FROM temp.ior_" + name)
+        values = dict((name, value) for name, value in parameters.items() if name not in template.setParameters)
+
+        cursor = connection.execute(sql, values)
+        columns = [description[0] for description in cursor.description]
+        return columns, cursor.fetchall()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
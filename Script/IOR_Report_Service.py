@@ -0,0 +1,514 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Report Service
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+The report service is a long-lived process that runs IOR reports without a desktop session. Reports are queued
+in a local SQLite database (IOR_Job_Queue.py) and run by N worker processes. Each worker keeps its own
+connections to MTOPROD and BCGW open between reports in a ConnectionPool (IOR_Connection_Pool.py), since an
+arcpy connection cannot be shared between processes. Start it with the login the reports run under (the
+passwords are asked for, or read from IOR_MTOPROD_PASSWORD and IOR_BCGW_PASSWORD):
+
+    python IOR_Report_Service.py --serve --username <user> [--workers 4] [--http-port 8470]
+    python IOR_Report_Service.py --submit <parameters.json>
+    python IOR_Report_Service.py --job <id>
+    python IOR_Report_Service.py --status
+    python IOR_Report_Service.py --stop
+
+A report is submitted with the tool parameters of the toolbox (see defaultReportParameters in
+Interest_Overlap_Report_v6_0_0.py) from any of:
+
+    - the IOR toolbox (submitReport) with Run On Report Service checked, which waits for the report and shows
+      its messages as it runs. The toolbox only hands a report to a service logged in as the tool's user.
+    - the command line (--submit), which adds the job straight to the queue
+    - HTTP, when --http-port is given: POST /jobs, GET /jobs, GET /jobs/<id> and GET /jobs/<id>/messages
+
+Without Run On Report Service, or with no service running under the user's login, the toolbox runs the report
+itself as before. The service only listens on localhost unless --http-host is given, and a client must present the key the service writes to its local
+folder when it starts (the X-IOR-Key header over HTTP).
+'''
+
+import os
+import sys
+import json
+import time
+import getpass
+import argparse
+import binascii
+import threading
+import traceback
+import multiprocessing
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+from collections import OrderedDict
+from IOR_Geometry_Engine import getEngine, addMessage, messageListeners
+from IOR_Connection_Pool import ConnectionPool, defaultConnectionFolder, databaseInstances
+from IOR_Job_Queue import JobQueue
+from IOR_Run_Trace import RunTrace
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+## Local (not network share) location of the service key, job queue and job outputs
+if os.environ.get('LOCALAPPDATA'):
+    defaultServiceFolder = os.path.join(os.environ['LOCALAPPDATA'], 'IOR', 'Service')
+else:
+    defaultServiceFolder = os.path.join(os.path.expanduser('~'), '.ior', 'service')
+
+## Address the service listens on
+serviceAddress = ('localhost', 47017)
+
+
+def serviceKeyPath(folder=None):
+    return os.path.join(folder or defaultServiceFolder, 'service.key')
+
+
+def jobQueuePath(folder=None):
+    return os.path.join(folder or defaultServiceFolder, 'jobs.sqlite')
+
+
+def readServiceKey(folder=None):
+    '''
+    A function to return the key of the running service, or None when no service has been started
+    '''
+    if not os.path.exists(serviceKeyPath(folder)):
+        return None
+    with open(serviceKeyPath(folder), 'rb') as f:
+        return f.read()
+
+
+def writeServiceKey(folder=None):
+    '''
+    A function to write a new random key for the service to folder
+    '''
+    if not os.path.exists(folder or defaultServiceFolder):
+        os.makedirs(folder or defaultServiceFolder)
+
+    key = binascii.hexlify(os.urandom(32))
+    with open(serviceKeyPath(folder), 'wb') as f:
+        f.write(key)
+    return key
+
+
+def connectService(address=serviceAddress, folder=None):
+    '''
+    A function to open a connection to the running service, or return None when there is none
+    '''
+    key = readServiceKey(folder)
+    if key is None:
+        return None
+
+    try:
+        return Client(address, authkey=key)
+    except (IOError, OSError, EOFError, AuthenticationError):
+        return None
+
+
+def exchange(connection, request):
+    '''
+    A function to send one request to the service and wait for its result. Messages written by the service
+    while it handles the request are written here with addMessage.
+    '''
+    try:
+        connection.send(request)
+        while True:
+            status, value = connection.recv()
+            if status == 'message':
+                addMessage(value)
+            elif status == 'error':
+                raise Exception("The IOR report service could not complete the request:\n" + value)
+            else:
+                return value
+    finally:
+        connection.close()
+
+
+def requestService(request, address=serviceAddress, folder=None):
+    '''
+    A function to send one request to the running service. Returns its result, or None when no service is
+    running.
+    '''
+    connection = connectService(address, folder)
+    if connection is None:
+        return None
+    return exchange(connection, request)
+
+
+def submitReport(parameters, username, address=serviceAddress, folder=None):
+    '''
+    A function to run a report on the local report service and wait for it. parameters are the tool parameters
+    of the report (see reportParameters in Interest_Overlap_Report_v6_0_0.py), and username is the login of the
+    user running the tool. The service's workers read MTOPROD and BCGW with the service's own login, so the
+    report is only handed over when that login is username. Returns the paths of the report workbooks, or None
+    when no service is running or it runs under another login, and the caller should run the report itself.
+    '''
+    status = requestService({'action': 'status'}, address, folder)
+    if status is None:
+        addMessage("No IOR report service is running, so the report is run here...")
+        return None
+
+    serviceUsername = status.get('username')
+    if not username or not serviceUsername or serviceUsername.lower() != username.lower():
+        addMessage("The IOR report service runs reports as " + str(serviceUsername) + ", not " + str(username) + ", so the report is run here...")
+        return None
+
+    connection = connectService(address, folder)
+    if connection is None:
+        return None
+
+    addMessage("Handing the report to the IOR report service running as " + serviceUsername + " on " + address[0] + ":" + str(address[1]) + "...")
+    return exchange(connection, {'action': 'report', 'parameters': parameters})
+
+
+def runJob(queue, jobId, parameters, report, engine, pool, username, passwords, jobFolder):
+    '''
+    A function to run one queued report. Its messages are kept with the job, and its workbooks and clipped
+    layers go to a folder of its own under jobFolder unless the parameters name an output folder.
+    '''
+    def jobMessage(message):
+        queue.addMessage(jobId, message)
+
+    messageListeners.append(jobMessage)
+    try:
+        parameters = dict(parameters)
+
+        # Reports running at the same time must not share (and clear) the default scratch folder
+        outputFolder = os.path.join(jobFolder, str(jobId))
+        for name in ('output_GDB', 'output_excel'):
+            if not parameters.get(name):
+                if not os.path.exists(outputFolder):
+                    os.makedirs(outputFolder)
+                parameters[name] = outputFolder
+        if not parameters.get('output_name'):
+            parameters['output_name'] = "Job_" + str(jobId)
+
+        report.setReportParameters(parameters)
+        trace = RunTrace(report.tracePath())
+
+        if pool is not None:
+            with trace.stage('login'):
+                pool.login(username, passwords)
+
+        queue.finish(jobId, report.runReport(engine, trace))
+    except Exception:
+        queue.fail(jobId, traceback.format_exc())
+    finally:
+        messageListeners.remove(jobMessage)
+
+
+def runWorker(workerId, folder, engineName, dataFolder, username, passwords, idleTimeout, checkInterval, stopEvent, pollInterval=2):
+    '''
+    A function to run the queued reports one after another until the service stops. With the arcpy engine
+    the worker keeps its own pool of connections, checked and evicted while it waits for jobs.
+    '''
+    # Imported here since the report script imports this module to submit its reports
+    import Interest_Overlap_Report_v6_0_0 as report
+
+    queue = JobQueue(jobQueuePath(folder))
+
+    if engineName == 'arcpy':
+        pool = ConnectionPool(os.path.join(defaultConnectionFolder, "Worker_" + str(workerId)), idleTimeout, checkInterval)
+        engine = getEngine('arcpy', pool.folder)
+    else:
+        pool = None
+        engine = getEngine(engineName, dataFolder)
+
+    lastMaintained = time.time()
+
+    try:
+        while not stopEvent.is_set():
+            job = queue.claim(workerId)
+
+            if job is not None:
+                runJob(queue, job[0], job[1], report, engine, pool, username, passwords, os.path.join(folder or defaultServiceFolder, 'Jobs'))
+
+            elif pool is not None and time.time() - lastMaintained > min(checkInterval, 60):
+                pool.maintain()
+                lastMaintained = time.time()
+
+            else:
+                stopEvent.wait(pollInterval)
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    '''
+    The HTTP API of the service. The server's service attribute is the ReportService it belongs to.
+    '''
+
+    def sendJSON(self, status, value):
+        body = json.dumps(value, indent=2, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def authorized(self):
+        if (self.headers.get('X-IOR-Key') or '').encode('utf-8') != self.server.service.key:
+            self.sendJSON(403, {'error': "Missing or wrong X-IOR-Key header"})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+        queue = self.server.service.queue
+
+        if parts == ['jobs']:
+            self.sendJSON(200, queue.jobs())
+        elif len(parts) in (2, 3) and parts[0] == 'jobs' and parts[1].isdigit() and queue.job(int(parts[1])) is not None:
+            if len(parts) == 2:
+                self.sendJSON(200, queue.job(int(parts[1])))
+            elif parts[2] == 'messages':
+                self.sendJSON(200, [message for seq, message in queue.messages(int(parts[1]))])
+            else:
+                self.sendJSON(404, {'error': "Not found: " + self.path})
+        else:
+            self.sendJSON(404, {'error': "Not found: " + self.path})
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+
+        if self.path.rstrip('/') != '/jobs':
+            self.sendJSON(404, {'error': "Not found: " + self.path})
+            return
+
+        try:
+            parameters = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8'))
+            jobId = self.server.service.submit(parameters)
+        except ValueError as e:
+            self.sendJSON(400, {'error': str(e)})
+            return
+
+        self.sendJSON(201, self.server.service.queue.job(jobId))
+
+    def log_message(self, format, *args):
+        addMessage("HTTP " + self.address_string() + " " + (format % args))
+
+
+class ReportService(object):
+    '''
+    Queues the reports submitted to it and runs them on workers worker processes
+    '''
+
+    def __init__(self, workers=1, engineName='arcpy', dataFolder=None, username=None, passwords=None, idleTimeout=1800, checkInterval=300,
+                 address=serviceAddress, httpAddress=None, folder=None):
+        self.workers = workers
+        self.engineName = engineName
+        self.dataFolder = dataFolder
+        self.username = username
+        self.passwords = passwords or OrderedDict()
+        self.idleTimeout = idleTimeout
+        self.checkInterval = checkInterval
+        self.address = address
+        self.httpAddress = httpAddress
+        self.folder = folder
+        self.queue = JobQueue(jobQueuePath(folder))
+        self.key = None
+        self.running = False
+
+    def submit(self, parameters):
+        '''
+        Check the tool parameters of a report and add it to the queue. Returns the id of its job.
+        '''
+        import Interest_Overlap_Report_v6_0_0 as report
+
+        if not isinstance(parameters, dict):
+            raise ValueError("The report parameters must be a JSON object")
+        report.checkReportParameters(parameters)
+        return self.queue.submit(parameters)
+
+    def startWorkers(self):
+        self.stopEvent = multiprocessing.Event()
+        self.processes = []
+        for workerId in range(1, self.workers + 1):
+            process = multiprocessing.Process(target=runWorker, args=(workerId, self.folder, self.engineName, self.dataFolder, self.username, self.passwords,
+                                                                      self.idleTimeout, self.checkInterval, self.stopEvent))
+            process.start()
+            self.processes.append(process)
+
+    def stopWorkers(self):
+        '''
+        Let each worker finish the report it is running, then stop it
+        '''
+        self.stopEvent.set()
+        for process in self.processes:
+            process.join()
+
+    def serve(self):
+        requeued = self.queue.requeue()
+        if requeued:
+            addMessage("Queued again " + str(requeued) + " report(s) left running when the service last stopped")
+
+        self.key = writeServiceKey(self.folder)
+        listener = Listener(self.address, authkey=self.key)
+        self.running = True
+        self.startWorkers()
+
+        httpServer = None
+        if self.httpAddress is not None:
+            httpServer = ThreadingHTTPServer(self.httpAddress, JobRequestHandler)
+            httpServer.service = self
+            httpThread = threading.Thread(target=httpServer.serve_forever)
+            httpThread.daemon = True
+            httpThread.start()
+            addMessage("IOR report service accepting jobs over HTTP on " + self.httpAddress[0] + ":" + str(self.httpAddress[1]) + "...")
+
+        addMessage("IOR report service listening on " + self.address[0] + ":" + str(self.address[1]) + " with " + str(self.workers) + " worker(s)...")
+
+        try:
+            while self.running:
+                try:
+                    connection = listener.accept()
+                    request = connection.recv()
+                except (IOError, OSError, EOFError, AuthenticationError):
+                    continue
+
+                # A tool run waits for its report, so each one is followed on its own thread
+                if request.get('action') == 'report':
+                    follower = threading.Thread(target=self.followReport, args=(connection, request))
+                    follower.daemon = True
+                    follower.start()
+                else:
+                    try:
+                        self.handle(connection, request)
+                    except (IOError, OSError, EOFError):
+                        pass
+                    finally:
+                        connection.close()
+        finally:
+            if httpServer is not None:
+                httpServer.shutdown()
+            listener.close()
+            if os.path.exists(serviceKeyPath(self.folder)):
+                os.remove(serviceKeyPath(self.folder))
+            addMessage("Waiting for the running reports to finish...")
+            self.stopWorkers()
+            addMessage("IOR report service stopped...")
+
+    def handle(self, connection, request):
+        action = request.get('action')
+
+        if action == 'status':
+            connection.send(('done', {'workers': self.workers, 'engine': self.engineName, 'username': self.username, 'jobs': self.queue.counts()}))
+        elif action == 'stop':
+            self.running = False
+            connection.send(('done', {'workers': self.workers, 'jobs': self.queue.counts()}))
+        else:
+            connection.send(('error', "Unknown request: " + str(action)))
+
+    def followReport(self, connection, request, pollInterval=1):
+        '''
+        Queue the report of a tool run and send it the report's messages as they are written, then its result
+        '''
+        try:
+            try:
+                jobId = self.submit(request['parameters'])
+            except ValueError as e:
+                connection.send(('error', str(e)))
+                return
+
+            connection.send(('message', "    Report queued as job " + str(jobId)))
+
+            seq = 0
+            while True:
+                job = self.queue.job(jobId)
+                for seq, message in self.queue.messages(jobId, seq):
+                    connection.send(('message', message))
+
+                if job['status'] == 'done':
+                    connection.send(('done', job['artifacts']))
+                    return
+                elif job['status'] == 'failed':
+                    connection.send(('error', job['error']))
+                    return
+
+                time.sleep(pollInterval)
+        except (IOError, OSError, EOFError):
+            addMessage("Lost the connection to a tool run; its report is still queued")
+        finally:
+            connection.close()
+
+
+def showJob(job):
+    addMessage("Job " + str(job['id']) + ": " + job['status'])
+    for path in job['artifacts']:
+        addMessage("    " + path)
+    if job['error']:
+        addMessage(job['error'])
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Run the IOR report service, which queues reports and runs them on worker processes that keep their MTOPROD and BCGW connections open.")
+    parser.add_argument('--serve', action='store_true', help="start the service and run the queued reports until it is stopped")
+    parser.add_argument('--submit', default=None, help="queue the report of a JSON file of tool parameters")
+    parser.add_argument('--job', type=int, default=None, help="show the status, messages and workbooks of a job")
+    parser.add_argument('--status', action='store_true', help="show whether the service is running and how many jobs are queued")
+    parser.add_argument('--stop', action='store_true', help="stop the running service once its running reports finish")
+    parser.add_argument('--workers', type=int, default=max(1, multiprocessing.cpu_count() // 2), help="number of reports run at the same time")
+    parser.add_argument('--engine', default='arcpy', help="geometry engine: arcpy or shapely")
+    parser.add_argument('--data', default=None, help="folder holding the layer copies (shapely)")
+    parser.add_argument('--username', default=None, help="login the reports run under (arcpy)")
+    parser.add_argument('--idle-timeout', type=int, default=1800, help="seconds a connection may stay unused before it is closed")
+    parser.add_argument('--check-interval', type=int, default=300, help="seconds between health checks of an open connection")
+    parser.add_argument('--port', type=int, default=serviceAddress[1], help="local port of the service")
+    parser.add_argument('--http-host', default='localhost', help="interface of the HTTP API")
+    parser.add_argument('--http-port', type=int, default=None, help="port of the HTTP API (no HTTP API when left out)")
+    parser.add_argument('--folder', default=defaultServiceFolder, help="folder of the service key, job queue and job outputs")
+    args = parser.parse_args()
+
+    address = (serviceAddress[0], args.port)
+
+    if args.serve:
+        passwords = OrderedDict()
+        if args.engine == 'arcpy':
+            if not args.username:
+                parser.error("--username is required with the arcpy engine")
+            for workspace in databaseInstances:
+                passwords[workspace] = os.environ.get('IOR_' + workspace + '_PASSWORD') or getpass.getpass(workspace + " password: ")
+
+        httpAddress = (args.http_host, args.http_port) if args.http_port else None
+        ReportService(args.workers, args.engine, args.data, args.username, passwords, args.idle_timeout, args.check_interval,
+                      address, httpAddress, args.folder).serve()
+
+    elif args.submit:
+        with open(args.submit, 'r') as f:
+            jobId = ReportService(folder=args.folder).submit(json.load(f))
+        addMessage("Report queued as job " + str(jobId))
+
+    elif args.job is not None:
+        queue = JobQueue(jobQueuePath(args.folder))
+        job = queue.job(args.job)
+        if job is None:
+            addMessage("No job " + str(args.job))
+        else:
+            for seq, message in queue.messages(args.job):
+                addMessage(message)
+            showJob(job)
+
+    elif args.status or args.stop:
+        result = requestService({'action': 'stop' if args.stop else 'status'}, address, args.folder)
+        if result is None:
+            addMessage("No IOR report service is running")
+        elif args.status:
+            addMessage("IOR report service is running as " + str(result['username']) + " with " + str(result['workers']) + " worker(s). Jobs: " +
+                       ", ".join(status + " " + str(count) for status, count in sorted(result['jobs'].items())))
+
+    else:
+        parser.print_help()
+        sys.exit(0)
@@ -0,0 +1,505 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Report Writers
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+The report sheets are written through a report writer so the workbook can be built without Excel:
+
+- xlsx (default): buffers the cell values and their shared formats in memory and streams the workbook straight
+  to an .xlsx file with xlsxwriter. Runs headless (e.g. on Linux) and needs no Excel installation.
+- excel: the original Excel automation through win32com, one COM call per cell property. Kept for desktops
+  without xlsxwriter.
+
+Both writers offer the same sheet methods (cell, borderAround, formatRange, groupRows, insertPicture, ...), so
+the report functions do not need to know which one is used.
+'''
+
+import os
+import re
+import struct
+import datetime
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+try:
+    import win32com.client
+except ImportError:
+    win32com = None
+
+try:
+    unicode
+except NameError:
+    unicode = str
+
+## The default Excel colour palette, so ColorIndex values used by the report can be written to an xlsx file
+colorIndex = {1: '#000000', 2: '#FFFFFF', 3: '#FF0000', 4: '#00FF00', 5: '#0000FF', 6: '#FFFF00', 7: '#FF00FF', 8: '#00FFFF',
+              9: '#800000', 10: '#008000', 11: '#000080', 12: '#808000', 13: '#800080', 14: '#008080', 15: '#C0C0C0', 16: '#808080',
+              17: '#9999FF', 18: '#993366', 19: '#FFFFCC', 20: '#CCFFFF', 21: '#660066', 22: '#FF8080', 23: '#0066CC', 24: '#CCCCFF',
+              25: '#000080', 26: '#FF00FF', 27: '#FFFF00', 28: '#00FFFF', 29: '#800080', 30: '#800000', 31: '#008080', 32: '#0000FF',
+              33: '#00CCFF', 34: '#CCFFFF', 35: '#CCFFCC', 36: '#FFFF99', 37: '#99CCFF', 38: '#FF99CC', 39: '#CC99FF', 40: '#FFCC99',
+              41: '#3366FF', 42: '#33CCCC', 43: '#99CC00', 44: '#FFCC00', 45: '#FF9900', 46: '#FF6600', 47: '#666699', 48: '#969696',
+              49: '#003366', 50: '#339966', 51: '#003300', 52: '#333300', 53: '#993300', 54: '#993366', 55: '#333399', 56: '#333333'}
+
+fontName = 'BC Sans'
+
+
+def cellValue(value, numFormat=None):
+    '''
+    Convert a value read from a feature class to the value and number format written to a cell.
+    Numbers stored as text are written as numbers and dates before 1900 (which Excel cannot store) as text.
+    '''
+    if isinstance(value, int):
+        value = int(value)
+        numFormat = 0
+    elif isinstance(value, float):
+        value = float(value)
+        numFormat = '0.' + '0' * 3
+    elif isinstance(value, (str, unicode)):
+        if value.isdigit():
+            value = int(value)
+            numFormat = 0
+        else:
+            try:
+                float(value)
+                value = float(value)
+            except:
+                pass
+    elif isinstance(value, datetime.datetime):
+        if value < datetime.datetime.strptime('01 01 1900', '%m %d %Y'):
+            dateSplit = str(datetime.datetime.strptime(str(value.date()), '%Y-%m-%d').date()).split('-')
+            value  = dateSplit[0] + '-' + datetime.date(1900, datetime.datetime.strptime(dateSplit[1], '%m').date().month, 1).strftime('%b') + '-' + dateSplit[2]
+        else:
+            numFormat = "yyyy-mmm-dd"
+
+    return value, numFormat
+
+
+def displayText(value):
+    '''
+    The text Excel shows for a cell, used to size columns. Formulas show their last quoted string
+    (the friendly name of a HYPERLINK) or, for joined strings, the longest piece.
+    '''
+    if value is None:
+        return ''
+    if isinstance(value, (str, unicode)) and value.startswith('='):
+        quoted = re.findall(r'"([^"]*)"', value)
+        if not quoted:
+            return value
+        if value.upper().startswith('=HYPERLINK('):
+            return quoted[-1]
+        return max(quoted, key=len)
+    if isinstance(value, float):
+        return '{0:,.3f}'.format(value)
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%b-%d')
+    return unicode(value)
+
+
+def imageSize(path):
+    '''
+    Return the (width, height) in pixels of a PNG or JPEG image, or None if it cannot be read
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return struct.unpack('>II', data[16:24])
+
+    if data[:2] == b'\xff\xd8':
+        i = 2
+        while i < len(data) - 9:
+            if data[i:i + 1] != b'\xff':
+                i += 1
+                continue
+            marker = ord(data[i + 1:i + 2])
+            if marker in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+                height, width = struct.unpack('>HH', data[i + 5:i + 9])
+                return width, height
+            i += 2 + struct.unpack('>H', data[i + 2:i + 4])[0]
+
+    return None
+
+
+def getReportWriter(name=None):
+    '''
+    Return a report writer by name ('xlsx' or 'excel'). The xlsx writer is used when xlsxwriter is installed.
+    '''
+    if name is None:
+        name = 'xlsx' if xlsxwriter is not None else 'excel'
+
+    if name == 'xlsx':
+        return XlsxReportWriter()
+    elif name == 'excel':
+        return ExcelReportWriter()
+    else:
+        raise ValueError("Unknown report writer: " + str(name))
+
+
+class ReportWriter(object):
+    '''
+    A workbook being built for the report. Sheets are added with addSheet and written with the sheet methods.
+    '''
+
+    name = None
+
+    def addSheet(self, name):
+        raise NotImplementedError
+
+    def sheet(self, name):
+        raise NotImplementedError
+
+    def save(self, path):
+        '''
+        Save the workbook to path and close it
+        '''
+        raise NotImplementedError
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# xlsx writer (xlsxwriter)
+# ----------------------------------------------------------------------------------------------------------------------
+
+class XlsxSheet(object):
+    '''
+    A buffered worksheet. Cells, borders, row groups and pictures are kept in memory until the workbook is saved,
+    as the report does not write its cells in row order (e.g. the legend is filled in last).
+    '''
+
+    def __init__(self, writer, name):
+        self.writer = writer
+        self.name = name
+        self.cells = {}
+        self.borders = {}
+        self.groups = []
+        self.pictures = []
+        self.gridlines = True
+        self.fitColumns = False
+        self.selection = (1, 1)
+
+    def activate(self):
+        self.writer.activeSheet = self.name
+
+    def cell(self, excelrow, excelcol, value="", size=10, bold=False, italic=False, underline=False, fontcolor=0, fillcolor=0, wrap=False, numFormat=None):
+        value, numFormat = cellValue(value, numFormat)
+        self.cells[(excelrow, excelcol)] = [value, {'size': size, 'bold': bold, 'italic': italic, 'underline': underline,
+                                                     'fontcolor': fontcolor, 'fillcolor': fillcolor, 'wrap': wrap, 'numFormat': numFormat}]
+
+    def styleOf(self, excelrow, excelcol):
+        if (excelrow, excelcol) not in self.cells:
+            self.cells[(excelrow, excelcol)] = [None, {'size': 10}]
+        return self.cells[(excelrow, excelcol)][1]
+
+    def formatRange(self, firstrow, firstcol, lastrow, lastcol, size=None, fillcolor=None, alignRight=None):
+        for excelrow in range(firstrow, lastrow + 1):
+            for excelcol in range(firstcol, lastcol + 1):
+                style = self.styleOf(excelrow, excelcol)
+                if size is not None:
+                    style['size'] = size
+                if fillcolor is not None:
+                    style['fillcolor'] = fillcolor
+                if alignRight is not None:
+                    style['alignRight'] = alignRight
+
+    def borderAround(self, firstrow, firstcol, lastrow, lastcol):
+        for excelrow in range(firstrow, lastrow + 1):
+            for excelcol in range(firstcol, lastcol + 1):
+                sides = self.borders.setdefault((excelrow, excelcol), set())
+                if excelrow == firstrow:
+                    sides.add('top')
+                if excelrow == lastrow:
+                    sides.add('bottom')
+                if excelcol == firstcol:
+                    sides.add('left')
+                if excelcol == lastcol:
+                    sides.add('right')
+                self.styleOf(excelrow, excelcol)
+
+    def groupRows(self, firstrow, lastrow):
+        self.groups.append((firstrow, lastrow))
+
+    def insertPicture(self, path, excelrow, excelcol, height, width, offsetLeft=0):
+        self.pictures.append((path, excelrow, excelcol, height, width, offsetLeft))
+
+    def hideGridlines(self):
+        self.gridlines = False
+
+    def autoFitColumns(self):
+        self.fitColumns = True
+
+    def autoFitRows(self):
+        # Excel fits rows without a set height when the workbook is opened
+        pass
+
+    def select(self, excelrow, excelcol):
+        self.selection = (excelrow, excelcol)
+
+    def columnWidths(self):
+        '''
+        Approximate Excel's AutoFit: the widest text in each column, scaled by its font size
+        '''
+        widths = {}
+        for (excelrow, excelcol), (value, style) in self.cells.items():
+            lines = displayText(value).split('\n')
+            width = max(len(line) for line in lines) * float(style.get('size') or 10) / 10 * 1.1 + 2
+            widths[excelcol] = min(max(widths.get(excelcol, 0), width), 255)
+        return widths
+
+    def write(self, workbook, formats):
+        '''
+        Stream the buffered sheet to an xlsxwriter workbook, one row at a time
+        '''
+        worksheet = workbook.add_worksheet(self.name)
+
+        if not self.gridlines:
+            worksheet.hide_gridlines(2)
+
+        if self.fitColumns:
+            for excelcol, width in self.columnWidths().items():
+                worksheet.set_column(excelcol - 1, excelcol - 1, width)
+
+        groupLevels = {}
+        for firstrow, lastrow in self.groups:
+            for excelrow in range(firstrow, lastrow + 1):
+                groupLevels[excelrow] = groupLevels.get(excelrow, 0) + 1
+
+        if groupLevels:
+            # Summary rows above the detail, the same as xlAbove
+            worksheet.outline_settings(True, False, True, False)
+
+        rows = {}
+        for (excelrow, excelcol) in self.cells:
+            rows.setdefault(excelrow, []).append(excelcol)
+
+        for excelrow in sorted(set(rows) | set(groupLevels)):
+
+            # Wrapped cells only grow with their row when the row height is set
+            height = None
+            for excelcol in rows.get(excelrow, []):
+                value, style = self.cells[(excelrow, excelcol)]
+                if style.get('wrap'):
+                    lines = len(re.findall(r'CHAR\(10\)|\n', unicode(value))) + 1
+                    height = max(height or 0, lines * float(style.get('size') or 10) * 1.3)
+
+            # Row options have to be set before the row's cells are streamed
+            if height is not None or excelrow in groupLevels:
+                worksheet.set_row(excelrow - 1, height, None, {'level': groupLevels.get(excelrow, 0)})
+
+            for excelcol in sorted(rows.get(excelrow, [])):
+                value, style = self.cells[(excelrow, excelcol)]
+                cellFormat = formats.get(style, self.borders.get((excelrow, excelcol)))
+
+                if value is None or value == '':
+                    worksheet.write_blank(excelrow - 1, excelcol - 1, None, cellFormat)
+                elif isinstance(value, (str, unicode)) and value.startswith('='):
+                    worksheet.write_formula(excelrow - 1, excelcol - 1, value, cellFormat)
+                elif isinstance(value, datetime.datetime):
+                    worksheet.write_datetime(excelrow - 1, excelcol - 1, value, cellFormat)
+                elif isinstance(value, (str, unicode)):
+                    worksheet.write_string(excelrow - 1, excelcol - 1, value, cellFormat)
+                else:
+                    worksheet.write(excelrow - 1, excelcol - 1, value, cellFormat)
+
+        for path, excelrow, excelcol, height, width, offsetLeft in self.pictures:
+            options = {'x_offset': int(offsetLeft / 0.75), 'object_position': 3}
+            size = imageSize(path) if os.path.exists(path) else None
+            if size is not None:
+                # Picture sizes are in points, images are placed in pixels at 96 dpi
+                options['x_scale'] = (width / 0.75) / size[0]
+                options['y_scale'] = (height / 0.75) / size[1]
+            if os.path.exists(path):
+                worksheet.insert_image(excelrow - 1, excelcol - 1, path, options)
+
+        worksheet.set_selection(self.selection[0] - 1, self.selection[1] - 1, self.selection[0] - 1, self.selection[1] - 1)
+
+        if self.writer.activeSheet == self.name:
+            worksheet.activate()
+
+        return worksheet
+
+
+class XlsxFormats(object):
+    '''
+    Shared cell formats: one xlsxwriter format per distinct cell style and border
+    '''
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.formats = {}
+
+    def get(self, style, borders=None):
+        key = (style.get('size'), bool(style.get('bold')), bool(style.get('italic')), bool(style.get('underline')),
+               style.get('fontcolor'), style.get('fillcolor'), bool(style.get('wrap')), style.get('numFormat'),
+               style.get('alignRight', True), tuple(sorted(borders or ())))
+
+        if key not in self.formats:
+            size, bold, italic, underline, fontcolor, fillcolor, wrap, numFormat, alignRight, borderSides = key
+
+            properties = {'font_name': fontName, 'font_size': size or 10, 'bold': bold, 'italic': italic,
+                          'underline': 1 if underline else 0, 'text_wrap': wrap}
+            if alignRight:
+                properties['align'] = 'right'
+            if fontcolor in colorIndex:
+                properties['font_color'] = colorIndex[fontcolor]
+            if fillcolor in colorIndex:
+                properties['bg_color'] = colorIndex[fillcolor]
+                properties['pattern'] = 1
+            if numFormat is not None:
+                properties['num_format'] = '0' if numFormat == 0 else numFormat
+            for side in borderSides:
+                properties[side] = 1
+
+            self.formats[key] = self.workbook.add_format(properties)
+
+        return self.formats[key]
+
+
+class XlsxReportWriter(ReportWriter):
+    '''
+    Builds the workbook in memory and writes it straight to an .xlsx file with xlsxwriter
+    '''
+
+    name = 'xlsx'
+
+    def __init__(self):
+        if xlsxwriter is None:
+            raise RuntimeError("The xlsx report writer requires the xlsxwriter package")
+        self.sheets = []
+        self.activeSheet = None
+
+    def addSheet(self, name):
+        sheet = XlsxSheet(self, name)
+        self.sheets.append(sheet)
+        return sheet
+
+    def sheet(self, name):
+        return [sheet for sheet in self.sheets if sheet.name == name][0]
+
+    def save(self, path):
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'strings_to_numbers': False, 'strings_to_formulas': False})
+        try:
+            formats = XlsxFormats(workbook)
+            for sheet in self.sheets:
+                sheet.write(workbook, formats)
+        finally:
+            workbook.close()
+
+        return path
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Excel writer (win32com)
+# ----------------------------------------------------------------------------------------------------------------------
+
+class ExcelSheet(object):
+    '''
+    A worksheet of a running Excel instance
+    '''
+
+    def __init__(self, sheet):
+        self.sheet = sheet
+
+    def activate(self):
+        self.sheet.Activate()
+
+    def cell(self, excelrow, excelcol, value="", size=10, bold=False, italic=False, underline=False, fontcolor=0, fillcolor=0, wrap=False, numFormat=None):
+        value, numFormat = cellValue(value, numFormat)
+        if isinstance(value, unicode) and str is not unicode:
+            value = value.encode('utf-8')
+
+        sheet = self.sheet
+        sheet.Cells(excelrow, excelcol).Value = value
+        sheet.Cells(excelrow, excelcol).Font.Name = fontName
+        sheet.Cells(excelrow, excelcol).Font.Size = size
+        sheet.Cells(excelrow, excelcol).Font.Bold = bold
+        sheet.Cells(excelrow, excelcol).Font.Italic = italic
+        sheet.Cells(excelrow, excelcol).Font.Underline = underline
+        sheet.Cells(excelrow, excelcol).Font.ColorIndex = fontcolor
+        sheet.Cells(excelrow, excelcol).Interior.ColorIndex = fillcolor
+        sheet.Cells(excelrow, excelcol).WrapText = wrap
+        sheet.Cells(excelrow, excelcol).NumberFormat = numFormat
+        sheet.Cells(excelrow, excelcol).HorizontalAlignment = win32com.client.constants.xlRight
+
+    def range(self, firstrow, firstcol, lastrow, lastcol):
+        return self.sheet.Range(self.sheet.Cells(firstrow, firstcol), self.sheet.Cells(lastrow, lastcol))
+
+    def formatRange(self, firstrow, firstcol, lastrow, lastcol, size=None, fillcolor=None, alignRight=None):
+        if size is not None:
+            self.range(firstrow, firstcol, lastrow, lastcol).Font.Size = size
+        if fillcolor is not None:
+            self.range(firstrow, firstcol, lastrow, lastcol).Interior.ColorIndex = fillcolor
+        if alignRight:
+            self.range(firstrow, firstcol, lastrow, lastcol).HorizontalAlignment = win32com.client.constants.xlRight
+
+    def borderAround(self, firstrow, firstcol, lastrow, lastcol):
+        self.range(firstrow, firstcol, lastrow, lastcol).BorderAround()
+
+    def groupRows(self, firstrow, lastrow):
+        self.sheet.Range(self.sheet.Rows(firstrow), self.sheet.Rows(lastrow)).Rows.Group()
+        self.sheet.Outline.SummaryRow = win32com.client.constants.xlAbove
+        self.sheet.Outline.ShowLevels(RowLevels=2)
+
+    def insertPicture(self, path, excelrow, excelcol, height, width, offsetLeft=0):
+        pic = self.sheet.Pictures().Insert(path)
+        pic.Height = height
+        pic.Width = width
+        cell = self.sheet.Cells(excelrow, excelcol)
+        pic.Left = cell.Left + offsetLeft
+        pic.Top = cell.Top
+
+    def hideGridlines(self):
+        self.sheet.Application.ActiveWindow.DisplayGridlines = False
+
+    def autoFitColumns(self):
+        self.sheet.Columns.AutoFit()
+
+    def autoFitRows(self):
+        self.sheet.Rows.AutoFit()
+
+    def select(self, excelrow, excelcol):
+        self.sheet.Cells(excelrow, excelcol).Select()
+
+
+class ExcelReportWriter(ReportWriter):
+    '''
+    Builds the workbook in a visible Excel instance through win32com
+    '''
+
+    name = 'excel'
+
+    def __init__(self):
+        if win32com is None:
+            raise RuntimeError("The excel report writer requires Excel and the pywin32 package")
+
+        self.excel = win32com.client.gencache.EnsureDispatch("Excel.Application")
+        self.excel.Visible = True
+
+        # Initialize a workbook within excel and remember its default sheets, which are reused before new ones are added
+        self.book = self.excel.Workbooks.Add()
+        self.unusedSheets = [self.book.Worksheets(i) for i in range(1, self.book.Sheets.Count + 1)]
+        self.sheets = []
+
+    def addSheet(self, name):
+        if self.unusedSheets:
+            sheet = self.unusedSheets.pop(0)
+        else:
+            sheet = self.book.Sheets.Add(After=self.sheets[-1].sheet)
+        sheet.Name = name
+        self.sheets.append(ExcelSheet(sheet))
+        return self.sheets[-1]
+
+    def sheet(self, name):
+        return [sheet for sheet in self.sheets if sheet.sheet.Name == name][0]
+
+    def save(self, path):
+        for sheet in self.unusedSheets:
+            sheet.Delete()
+
+        self.book.SaveAs(path)
+
+        # Quit the instance of excel from the process list in Task Manager
+        self.excel.Quit()
+
+        return path
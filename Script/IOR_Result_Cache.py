@@ -0,0 +1,168 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Layer Result Cache
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+Statusing staff often run the same AOI again after changing only the layer list or the report name. The result
+cache keeps the result of each layer against each AOI, so a layer that has not changed is not selected and
+clipped again. A result is keyed by:
+
+    - a hash of the AOI geometry (normalized WKB and spatial reference)
+    - a hash of the layer's row in the configuration spreadsheet (source, definition query, join, buffer,
+      sort and summary fields)
+    - the version of the local snapshot the layer was read from (IOR_Snapshot_Cache.py)
+
+Layers read live, and query layers (whose SQL reads live warehouse tables), are never cached. A result is the
+layer's feature count and, when the layer overlaps the AOI, a copy of its clipped feature class in a workspace
+of its own. The least recently used results are removed once there are more than maxEntries of them or they
+take more than maxSize bytes.
+'''
+
+import os
+import time
+import hashlib
+from IOR_Geometry_Engine import addMessage
+from IOR_JSON_File import readJSON, writeJSON
+from IOR_Layer_Catalog import rowHash
+
+## Local (not network share) location of the cached results
+if os.environ.get('LOCALAPPDATA'):
+    defaultResultFolder = os.path.join(os.environ['LOCALAPPDATA'], 'IOR', 'Results')
+else:
+    defaultResultFolder = os.path.join(os.path.expanduser('~'), '.ior', 'results')
+
+## Changed whenever the clipped layers are written differently, so results of older versions are not reused
+resultVersion = 1
+
+
+def workspaceSize(path):
+    '''
+    A function to return the size in bytes of a workspace (a file geodatabase folder or a GeoPackage file)
+    '''
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(folder, name)) for folder, folders, names in os.walk(path) for name in names)
+    elif os.path.exists(path):
+        return os.path.getsize(path)
+    return 0
+
+
+class ResultCache(object):
+    '''
+    Layer results of earlier reports, keyed by AOI, layer definition and source version
+    '''
+
+    def __init__(self, folder=None, maxEntries=5000, maxSize=2 * 1024 ** 3):
+        self.folder = folder or defaultResultFolder
+        self.maxEntries = maxEntries
+        self.maxSize = maxSize
+        self.manifest = self.loadManifest()
+        self.removed = set()
+        self.hashes = {}
+
+    def manifestPath(self):
+        return os.path.join(self.folder, 'results.json')
+
+    def loadManifest(self):
+        return readJSON(self.manifestPath()) or {}
+
+    def save(self, engine):
+        '''
+        Write the manifest, with the results other reports added since this one started, after evicting the
+        least recently used results
+        '''
+        manifest = self.loadManifest()
+        manifest.update(self.manifest)
+        for key in self.removed:
+            manifest.pop(key, None)
+        self.manifest = manifest
+
+        self.evict(engine)
+
+        writeJSON(self.manifestPath(), self.manifest, indent=2, sort_keys=True)
+
+    def layerKeys(self, engine, row, aoiDict, snapshots):
+        '''
+        Return the result key of a row's layer for each AOI, or None when the layer's results are not cached
+        (it is read live or it is a query layer)
+        '''
+        if snapshots is None or row[8] is not None:
+            return None
+
+        version = snapshots.sourceVersion(row, engine)
+        if version is None:
+            return None
+
+        keys = {}
+        for aoiKey, aoi in aoiDict.items():
+            if aoi['processedAOI'] not in self.hashes:
+                self.hashes[aoi['processedAOI']] = engine.geometryHash(aoi['processedAOI'])
+
+            parts = [str(resultVersion), engine.name, self.hashes[aoi['processedAOI']], rowHash(row), version]
+            keys[aoiKey] = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:20]
+
+        return keys
+
+    def fetch(self, engine, key, clipFC):
+        '''
+        Return the cached (clip feature class, count) of key with the clipped features copied to clipFC, or
+        None when there is no result to reuse
+        '''
+        entry = self.manifest.get(key)
+        if entry is None:
+            return None
+
+        if entry['path'] is None:
+            result = (None, 0)
+        else:
+            try:
+                engine.copyFeatures(entry['path'], clipFC)
+            except Exception:
+                # Evicted by another report since this one read the manifest
+                self.remove(engine, key)
+                return None
+            result = (clipFC, entry['count'])
+
+        entry['used'] = time.time()
+        return result
+
+    def store(self, engine, key, clipFC, count):
+        '''
+        Keep a layer's result against one AOI. The clipped features are copied, since clipFC belongs to the report.
+        '''
+        if clipFC is None:
+            path, size = None, 0
+        else:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+
+            workspace = os.path.join(self.folder, engine.createWorkspace(self.folder, "R_" + key + ".gdb"))
+            path = engine.copyFeatures(clipFC, os.path.join(workspace, "R_" + key))
+            size = workspaceSize(workspace)
+
+        self.manifest[key] = {'path': path, 'count': count, 'size': size, 'created': time.time(), 'used': time.time()}
+        self.removed.discard(key)
+
+    def remove(self, engine, key):
+        entry = self.manifest.pop(key, None)
+        self.removed.add(key)
+
+        if entry is not None and entry['path'] is not None:
+            try:
+                engine.delete(os.path.dirname(entry['path']))
+            except Exception:
+                addMessage("    Cached result is in use and will be removed later: " + entry['path'])
+
+    def evict(self, engine):
+        '''
+        Remove the least recently used results until no more than maxEntries results and maxSize bytes are kept
+        '''
+        entries = sorted(self.manifest.items(), key=lambda item: item[1]['used'])
+        count = len(entries)
+        size = sum(entry['size'] for key, entry in entries)
+
+        for key, entry in entries:
+            if count <= self.maxEntries and size <= self.maxSize:
+                break
+            self.remove(engine, key)
+            count -= 1
+            size -= entry['size']
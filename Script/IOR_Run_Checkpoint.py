@@ -0,0 +1,111 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Run Checkpoint
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+A report that errors out part way through its layers (most often because the ArcCatalog/ArcMap session or a
+database connection timed out) used to be started over from the login. The run checkpoint is written next to
+the scratch geodatabase (<geodatabase name>_checkpoint.json) after each layer finishes, and records for each
+layer and AOI:
+
+    - its status, and the error of the layer the run failed on
+    - its clipped feature class and feature count, from which the layer's part of the report is rebuilt
+    - a hash of the layer's row in the configuration spreadsheet and of the AOI geometry, so a layer is only
+      resumed when it would be processed the same way again
+
+A resumed run keeps the scratch geodatabase, skips the layers that finished and continues from the first one
+that did not. The checkpoint is removed once the report workbooks are written.
+'''
+
+import os
+import time
+from IOR_Geometry_Engine import addMessage
+from IOR_JSON_File import readJSON, writeJSON
+from IOR_Layer_Catalog import rowHash
+
+
+def checkpointPath(workspace):
+    '''
+    A function to return the path of the run checkpoint of the geodatabase at workspace
+    '''
+    return os.path.splitext(workspace)[0] + "_checkpoint.json"
+
+
+class RunCheckpoint(object):
+    '''
+    The finished layers of the report run into the geodatabase at workspace. The checkpoint of an earlier run
+    is only read back when resuming and the run was made with the same parameters.
+    '''
+
+    def __init__(self, workspace, parameters, resume=False):
+        self.workspace = workspace
+        self.hashes = {}
+
+        state = self.load() if resume else None
+        if state is not None and state['parameters'] != parameters:
+            addMessage("    The checkpoint of " + workspace + " was written for a different AOI or engine, starting over")
+            state = None
+        elif state is not None and state.get('failed'):
+            addMessage("    Resuming the run that failed on '" + state['failed']['name'] + "'")
+
+        self.resumed = state is not None
+        self.state = state or {'parameters': parameters, 'started': time.time(), 'layers': {}, 'failed': None}
+        self.save()
+
+    def path(self):
+        return checkpointPath(self.workspace)
+
+    def load(self):
+        return readJSON(self.path())
+
+    def save(self):
+        writeJSON(self.path(), self.state, indent=2, sort_keys=True)
+
+    def remove(self):
+        if os.path.exists(self.path()):
+            os.remove(self.path())
+
+    def entryKey(self, row, aoiKey):
+        return str(row[0]) + "|" + str(aoiKey)
+
+    def aoiHash(self, engine, aoi):
+        if aoi['processedAOI'] not in self.hashes:
+            self.hashes[aoi['processedAOI']] = engine.geometryHash(aoi['processedAOI'])
+        return self.hashes[aoi['processedAOI']]
+
+    def fetch(self, engine, row, aoiKey, aoi):
+        '''
+        Return the (clip feature class, count) of a layer that finished before the run was interrupted, or None
+        when the layer has to be processed
+        '''
+        entry = self.state['layers'].get(self.entryKey(row, aoiKey))
+        if entry is None or entry['status'] != 'done':
+            return None
+        if entry['row'] != rowHash(row) or entry['aoi'] != self.aoiHash(engine, aoi):
+            return None
+        if entry['clip'] is not None and not engine.exists(entry['clip']):
+            return None
+        return entry['clip'], entry['count']
+
+    def record(self, engine, row, aoiDict, layerResult):
+        '''
+        Mark a layer as done with its (clip feature class, count) for each AOI of layerResult, and save
+        '''
+        for aoiKey, (clipFC, count) in layerResult.items():
+            self.state['layers'][self.entryKey(row, aoiKey)] = {'name': row[2],
+                                                                'status': 'done',
+                                                                'row': rowHash(row),
+                                                                'aoi': self.aoiHash(engine, aoiDict[aoiKey]),
+                                                                'clip': clipFC,
+                                                                'count': count,
+                                                                'finished': time.time()}
+        if self.state['failed'] is not None and self.state['failed']['layer'] == row[0]:
+            self.state['failed'] = None
+        self.save()
+
+    def fail(self, row, error):
+        '''
+        Keep the layer the run failed on, and why, so a resumed run can report where it picked up
+        '''
+        self.state['failed'] = {'layer': row[0], 'name': row[2], 'error': str(error), 'time': time.time()}
+        self.save()
@@ -0,0 +1,87 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Run Manifest
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+When a report is run again into the same output geodatabase (i.e. after adding a layer to the layer list or
+fixing one row of the configuration spreadsheet), most of its clipped layers are still good. The run manifest
+is written next to the geodatabase (<geodatabase name>_manifest.json) and records, for each layer and AOI, what
+its clip was made from:
+
+    - a hash of the layer's row in the configuration spreadsheet
+    - a hash of the AOI geometry
+    - the version of the layer's source: the local snapshot it was read from
+
+An incremental run keeps the geodatabase and only processes the layers whose inputs changed or that are new to
+the layer list. Query layers, layers with a table join and layers read live have no version to compare (a live
+layer may have been edited since the refresh job last recorded it), so they are always processed again.
+'''
+
+import os
+import time
+from IOR_JSON_File import readJSON, writeJSON
+from IOR_Layer_Catalog import rowHash
+
+
+class RunManifest(object):
+    '''
+    The inputs and result of each (layer, AOI) clipped into the geodatabase at workspace
+    '''
+
+    def __init__(self, workspace):
+        self.workspace = workspace
+        self.entries = self.load()
+        self.hashes = {}
+
+    def path(self):
+        return os.path.splitext(self.workspace)[0] + "_manifest.json"
+
+    def load(self):
+        return readJSON(self.path()) or {}
+
+    def save(self):
+        writeJSON(self.path(), self.entries, indent=2, sort_keys=True)
+
+    def entryKey(self, row, aoiKey):
+        return str(row[0]) + "|" + str(aoiKey)
+
+    def sourceVersion(self, engine, row, snapshots):
+        '''
+        Return the version of a row's source: its snapshot version when it is read from a snapshot. None when
+        the layer's inputs cannot be versioned, which includes a layer read live, as its source may have
+        changed since the refresh job last looked at it.
+        '''
+        if row[8] is not None or row[9] is not None or snapshots is None:
+            return None
+
+        return snapshots.sourceVersion(row, engine)
+
+    def layerInputs(self, engine, row, aoiDict, snapshots):
+        '''
+        Return the inputs of a row's layer for each AOI, or None when they cannot be versioned
+        '''
+        version = self.sourceVersion(engine, row, snapshots)
+        if version is None:
+            return None
+
+        inputs = {}
+        for aoiKey, aoi in aoiDict.items():
+            if aoi['processedAOI'] not in self.hashes:
+                self.hashes[aoi['processedAOI']] = engine.geometryHash(aoi['processedAOI'])
+            inputs[aoiKey] = {'row': rowHash(row), 'aoi': self.hashes[aoi['processedAOI']], 'source': version}
+        return inputs
+
+    def fetch(self, engine, row, aoiKey, inputs):
+        '''
+        Return the (clip feature class, count) a previous run made from the same inputs, or None when the layer
+        has to be processed again
+        '''
+        entry = self.entries.get(self.entryKey(row, aoiKey))
+        if entry is None or entry['inputs'] != inputs:
+            return None
+        if entry['clip'] is not None and not engine.exists(entry['clip']):
+            return None
+        return entry['clip'], entry['count']
+
+    def record(self, row, aoiKey, inputs, clipFC, count):
+        self.entries[self.entryKey(row, aoiKey)] = {'name': row[2], 'inputs': inputs, 'clip': clipFC, 'count': count, 'updated': time.time()}
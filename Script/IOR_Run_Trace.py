@@ -0,0 +1,111 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Run Trace
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+The geoprocessing messages say what a report is doing, not how long each part takes. The run trace times the
+stages of a report (login, scratch geodatabase, AOI, each step of each layer and each sheet) and keeps, for each
+one, its wall time and, where it applies, the features it produced and the bytes it wrote. Stages nest: a step
+run inside a layer's stage is recorded against that layer and AOI. Each stage is written as one JSON line to the
+trace file as soon as it finishes, so the trace of a report that errors out shows how far it got, and the
+totals are added to the Input_Information sheet of the report.
+'''
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+## Attributes a stage takes from the stage it runs inside of
+inheritedAttributes = ('layer', 'aoi')
+
+
+@contextmanager
+def untraced():
+    '''
+    A stage that is not recorded, for code run without a trace
+    '''
+    yield {}
+
+
+class RunTrace(object):
+    '''
+    The timed stages of one report run, written to the JSON lines file at path when one is given
+    '''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+        if self.path is not None and not os.path.exists(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+    def openStages(self):
+        if not hasattr(self.local, 'stages'):
+            self.local.stages = []
+        return self.local.stages
+
+    @contextmanager
+    def stage(self, name, **attributes):
+        '''
+        Time the code run inside the with block as the stage name. The record is yielded so the block can add its
+        counts, i.e. record['features'] and record['bytes'].
+        '''
+        stages = self.openStages()
+
+        record = OrderedDict([('stage', name), ('parent', stages[-1]['stage'] if stages else None)])
+        for attribute in inheritedAttributes:
+            if stages and attribute in stages[-1]:
+                record[attribute] = stages[-1][attribute]
+        record.update((attribute, value) for attribute, value in attributes.items() if value is not None)
+        record['start'] = time.time()
+
+        stages.append(record)
+        started = time.time()
+        try:
+            yield record
+        except Exception as e:
+            record['error'] = str(e)
+            raise
+        finally:
+            stages.pop()
+            record['seconds'] = round(time.time() - started, 4)
+            self.add(record)
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+            if self.path is not None:
+                with open(self.path, 'a') as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def extend(self, records):
+        '''
+        Add the records of the stages run in a pool worker
+        '''
+        for record in records:
+            self.add(record)
+
+    def totals(self):
+        '''
+        Return the number of calls, seconds, features and bytes of each stage, in the order the stages first finished
+        '''
+        totals = OrderedDict()
+        for record in self.records:
+            total = totals.setdefault(record['stage'], OrderedDict([('calls', 0), ('seconds', 0.0), ('features', 0), ('bytes', 0)]))
+            total['calls'] += 1
+            total['seconds'] += record['seconds']
+            total['features'] += record.get('features') or 0
+            total['bytes'] += record.get('bytes') or 0
+        return totals
+
+    def slowestLayers(self, count=10):
+        '''
+        Return the (layer, seconds, features) of the count layers that took the longest
+        '''
+        layers = [(record['layer'], record['seconds'], record.get('features') or 0) for record in self.records if record['stage'] == 'layer']
+        return sorted(layers, key=lambda layer: -layer[1])[:count]
@@ -0,0 +1,178 @@
+'''
+Tool name: Interest Overlap Report (IOR) - SQL Templates
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+The SQL files in sqls are read and checked once per session rather than looked up on the network share for
+every query layer. Values are passed to a template as named parameters (:name) instead of replacing text in
+the file. A parameter written as IN (:name) takes a set of IDs, i.e.
+
+    WHERE
+      t.TENURE_NUMBER_ID IN (:ids)
+
+Each template is prepared once per SQL dialect: the form of a set parameter is fixed for the dialect (a
+JSON_TABLE of the IDs in Oracle, a temporary table in the SQLite stand-in), so the SQLite stand-in runs the same
+statement text for every query of a template and reuses its compiled statement.
+'''
+
+import os
+import re
+from IOR_Geometry_Engine import addMessage
+
+## Templates already loaded in this process, keyed by folder
+loadedRegistries = {}
+
+## Placeholder used by SQL files before named parameters
+legacyPlaceholder = "update_query"
+
+setParameterPattern = re.compile(r"\bIN\s*\(\s*:(\w+)\s*\)", re.IGNORECASE)
+
+
+def parameterSpans(sql):
+    '''
+    A function to return (start, end, name) of each :name parameter of sql, skipping quoted text and comments
+    '''
+    spans = []
+    i = 0
+    while i < len(sql):
+        if sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = len(sql) if end == -1 else end
+        elif sql.startswith('/*', i):
+            end = sql.find('*/', i + 2)
+            i = len(sql) if end == -1 else end + 2
+        elif sql[i] in ("'", '"'):
+            end = sql.find(sql[i], i + 1)
+            i = len(sql) if end == -1 else end + 1
+        elif sql[i] == ':' and sql[i - 1:i] != ':' and re.match(r":[A-Za-z_]", sql[i:i + 2]):
+            match = re.match(r":(\w+)", sql[i:])
+            spans.append((i, i + len(match.group(0)), match.group(1)))
+            i += len(match.group(0))
+        else:
+            i += 1
+    return spans
+
+
+def parameterNames(sql):
+    names = []
+    for start, end, name in parameterSpans(sql):
+        if name not in names:
+            names.append(name)
+    return names
+
+
+class SQLTemplate(object):
+    '''
+    One SQL file of sqls, with its named parameters. setParameters take a set of IDs (IN (:name)) and
+    the other parameters a single value.
+    '''
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql.strip().rstrip(';')
+        self.parameters = parameterNames(self.sql)
+        self.setParameters = [name for name in setParameterPattern.findall(self.sql) if name in self.parameters]
+        self.statements = {}
+
+    def validate(self):
+        '''
+        Return a list of the problems with the template, if any
+        '''
+        problems = []
+        body = re.sub(r"--[^\n]*|/\*.*?\*/", " ", self.sql, flags=re.DOTALL).strip()
+
+        if not re.match(r"(SELECT|WITH)\b", body, re.IGNORECASE):
+            problems.append("is not a SELECT statement")
+        if re.sub(r"'[^']*'", "", body).count("'"):
+            problems.append("has an unclosed quote")
+        if body.count("(") != body.count(")"):
+            problems.append("has unbalanced parentheses")
+        if re.search(r"\b" + legacyPlaceholder + r"\b", body):
+            problems.append("uses " + legacyPlaceholder + ", write the ID filter as <column> IN (:ids)")
+        if not self.parameters:
+            problems.append("has no :name parameters")
+
+        return problems
+
+    def checkParameters(self, parameters):
+        missing = [name for name in self.parameters if name not in parameters]
+        unknown = [name for name in parameters if name not in self.parameters]
+        if missing or unknown:
+            raise ValueError("SQL template '" + self.name + "' was given the wrong parameters (missing: " +
+                             ", ".join(missing) + "; unknown: " + ", ".join(unknown) + ")")
+
+    def substitute(self, parameterSQL):
+        '''
+        Return the template with each parameter written out by parameterSQL(name)
+        '''
+        pieces = []
+        last = 0
+        for start, end, name in parameterSpans(self.sql):
+            pieces.append(self.sql[last:start])
+            pieces.append(parameterSQL(name))
+            last = end
+        pieces.append(self.sql[last:])
+        return ''.join(pieces)
+
+    def prepare(self, setParameterSQL):
+        '''
+        Return the statement of the template for drivers that bind values: each set parameter is written by
+        setParameterSQL(name) and the other parameters are left as :name. Prepared once per form of set
+        parameter (i.e. per SQL dialect).
+        '''
+        key = setParameterSQL(':name')
+        if key not in self.statements:
+            self.statements[key] = self.substitute(lambda name: setParameterSQL(name) if name in self.setParameters else ':' + name)
+        return self.statements[key]
+
+    def render(self, parameters, setSQL, valueSQL):
+        '''
+        Return the statement of the template for tools that take SQL text only (i.e. MakeQueryLayer): set
+        parameters are written by setSQL(ids) and the other parameters by valueSQL(value)
+        '''
+        self.checkParameters(parameters)
+        return self.substitute(lambda name: setSQL(parameters[name]) if name in self.setParameters else valueSQL(parameters[name]))
+
+
+class SQLTemplateRegistry(object):
+    '''
+    The checked SQL templates of a folder, keyed by file name
+    '''
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.templates = {}
+        self.problems = {}
+
+    def load(self):
+        for filename in sorted(os.listdir(self.folder)):
+            if not filename.lower().endswith('.sql'):
+                continue
+
+            with open(os.path.join(self.folder, filename), 'r') as f:
+                template = SQLTemplate(filename, f.read())
+
+            problems = template.validate()
+            if problems:
+                self.problems[filename] = problems
+                addMessage("    SQL template '" + filename + "' " + " and ".join(problems))
+            else:
+                self.templates[filename] = template
+
+        return self
+
+    def template(self, name):
+        if name in self.problems:
+            raise ValueError("SQL template '" + name + "' " + " and ".join(self.problems[name]))
+        if name not in self.templates:
+            raise ValueError("No SQL template named '" + name + "' in " + self.folder)
+        return self.templates[name]
+
+
+def loadTemplates(folder):
+    '''
+    A function to return the SQL templates of folder, read and checked the first time they are asked for
+    '''
+    if folder not in loadedRegistries:
+        loadedRegistries[folder] = SQLTemplateRegistry(folder).load()
+    return loadedRegistries[folder]
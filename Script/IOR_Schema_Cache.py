@@ -0,0 +1,150 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Layer Schema Cache
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+Each layer's fields were listed three times a run (for the field list, for the field mapping of the export and
+for the columns of the Interest Report sheet) and its shape type described once more, every one a round trip to
+BCGW or MTOPROD. The schema cache keeps, for each layer definition (its row in the configuration spreadsheet):
+
+    - the fields of the layer (name, alias, type and required flag) and its shape type
+    - the fields of its clipped feature classes, which every AOI of a batch shares
+
+A layer's schema is kept between runs in schemas.json for as long as its source keeps the same version: the
+local snapshot it is read from. A live source may have been changed since the snapshot refresh job last looked
+at it, and query layers and layers with a table join read tables that are not versioned, so their schemas are
+only kept for the run.
+'''
+
+import os
+import time
+from IOR_Geometry_Engine import Field
+from IOR_JSON_File import readJSON, writeJSON
+from IOR_Layer_Catalog import rowHash
+
+## Local (not network share) location of the schemas kept between runs
+if os.environ.get('LOCALAPPDATA'):
+    defaultSchemaFolder = os.path.join(os.environ['LOCALAPPDATA'], 'IOR', 'Schemas')
+else:
+    defaultSchemaFolder = os.path.join(os.path.expanduser('~'), '.ior', 'schemas')
+
+## Changed whenever the clipped layers get different fields, so schemas of older versions are not reused
+schemaVersion = 1
+
+## Schemas not used for this many days are dropped when the schemas are saved
+maxAgeDays = 90
+
+
+class SchemaCache(object):
+    '''
+    Layer schemas keyed by the hash of the layer's row. Schemas are only kept in memory for the run, unless a
+    persistFolder is given.
+    '''
+
+    def __init__(self, persistFolder=None, snapshots=None):
+        self.persistFolder = persistFolder
+        self.snapshots = snapshots
+        self.entries = self.load()
+        self.runEntries = {}
+        self.changed = set()
+
+    def path(self):
+        return os.path.join(self.persistFolder, 'schemas.json')
+
+    def load(self):
+        if self.persistFolder is None:
+            return {}
+        return readJSON(self.path()) or {}
+
+    def save(self):
+        '''
+        Write the schemas, with the ones other reports added since this one started
+        '''
+        if self.persistFolder is None or not self.changed:
+            return
+
+        entries = self.load()
+        entries.update((key, self.entries[key]) for key in self.changed)
+        oldest = time.time() - maxAgeDays * 86400
+        entries = dict((key, entry) for key, entry in entries.items() if entry['used'] >= oldest)
+
+        writeJSON(self.path(), entries, indent=2, sort_keys=True)
+
+        self.entries = entries
+        self.changed = set()
+
+    def sourceVersion(self, engine, row):
+        '''
+        Return the version of a row's source: its snapshot version when it is read from a snapshot. None when
+        the schema cannot be versioned, which includes a layer read live.
+        '''
+        if row[8] is not None or row[9] is not None:
+            return None
+
+        version = self.snapshots.sourceVersion(row, engine) if self.snapshots is not None else None
+        if version is None:
+            return None
+        return str(schemaVersion) + "_" + version
+
+    def entry(self, engine, row):
+        '''
+        Return the schema entry of a row's layer, looking up its source version once per run
+        '''
+        key = rowHash(row)
+        if key in self.runEntries:
+            return key, self.runEntries[key]
+
+        version = self.sourceVersion(engine, row)
+        entry = self.entries.get(key) if version is not None else None
+        if entry is None or entry['version'] != version:
+            entry = {'name': row[2], 'version': version, 'fields': None, 'shapeType': None, 'clipFields': None, 'used': time.time()}
+            if version is not None:
+                self.entries[key] = entry
+        elif time.time() - entry['used'] > 86400:
+            entry['used'] = time.time()
+            self.changed.add(key)
+
+        self.runEntries[key] = entry
+        return key, entry
+
+    def lookup(self, engine, row, name, read):
+        key, entry = self.entry(engine, row)
+        if entry[name] is None:
+            entry[name] = read()
+            if entry['version'] is not None:
+                self.changed.add(key)
+        return entry[name]
+
+    def fields(self, engine, row, layer):
+        '''
+        Return the fields of a row's layer
+        '''
+        fields = self.lookup(engine, row, 'fields', lambda: [list(field) for field in engine.listFields(layer)])
+        return [Field(*field) for field in fields]
+
+    def shapeType(self, engine, row, layer):
+        '''
+        Return the shape type of a row's layer
+        '''
+        return self.lookup(engine, row, 'shapeType', lambda: engine.shapeType(layer))
+
+    def clipFields(self, engine, row, clipFC):
+        '''
+        Return the fields of the clipped feature classes of a row's layer, listed from the first one asked for
+        '''
+        fields = self.lookup(engine, row, 'clipFields', lambda: [list(field) for field in engine.listFields(clipFC)])
+        return [Field(*field) for field in fields]
+
+    def changes(self):
+        '''
+        Return the schemas read since the cache was made, for a pool worker to hand back to the run
+        '''
+        return dict((key, self.entries[key]) for key in self.changed)
+
+    def merge(self, entries):
+        '''
+        Add the schemas a pool worker read
+        '''
+        for key, entry in entries.items():
+            self.entries[key] = self.runEntries[key] = entry
+            self.changed.add(key)
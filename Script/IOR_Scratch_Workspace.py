@@ -0,0 +1,103 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Scratch Workspace
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+Reports used to write every feature class they made (each layer's export, its clip, the fields added to it and
+its sort) to a geodatabase on the network share, so each step of each layer was SMB I/O. A report now writes:
+
+    - its intermediate feature classes (the selected features of each layer, exported before they are clipped)
+      to a scratch workspace: the engine's memory workspace, or a workspace of its own on local disk
+    - its AOI and clipped layers to a geodatabase in a local folder (%LOCALAPPDATA%\IOR\Scratch), from which
+      the report workbooks are written
+
+Once the workbooks are written, the AOI and clipped layers are copied in one bulk copy to the Output Geodatabase
+Location, when one was given. Without one, they are never copied to the network share.
+'''
+
+import os
+import time
+import uuid
+import hashlib
+from IOR_Geometry_Engine import addMessage
+
+## Local (not network share) location of the scratch and clip workspaces
+if os.environ.get('LOCALAPPDATA'):
+    defaultScratchFolder = os.path.join(os.environ['LOCALAPPDATA'], 'IOR', 'Scratch')
+else:
+    defaultScratchFolder = os.path.join(os.path.expanduser('~'), '.ior', 'scratch')
+
+## Intermediate workspaces older than this many hours were left by runs that ended, and are removed
+maxIntermediateAge = 24
+
+
+class ScratchWorkspace(object):
+    '''
+    Where a run (or a pool worker) writes its intermediate feature classes: the engine's memory workspace
+    (backend 'memory') or a workspace of its own in folder (backend 'local'), made when it is first needed
+    '''
+
+    def __init__(self, backend='local', folder=None):
+        self.backend = backend
+        self.folder = folder or defaultScratchFolder
+        self.workspace = None
+
+    def location(self, engine):
+        if self.backend == 'memory':
+            return engine.memoryWorkspace
+
+        if self.workspace is None:
+            self.removeStale(engine)
+            name = engine.createWorkspace(self.folder, "intermediate_" + uuid.uuid4().hex[:8] + ".gdb")
+            self.workspace = os.path.join(self.folder, name)
+
+        return self.workspace
+
+    def path(self, engine, name):
+        '''
+        Return the path of the intermediate feature class name
+        '''
+        return os.path.join(self.location(engine), name)
+
+    def removeStale(self, engine):
+        oldest = time.time() - maxIntermediateAge * 3600
+        for workspace in engine.listWorkspaces(self.folder):
+            if os.path.basename(workspace).startswith("intermediate_") and os.path.getmtime(workspace) < oldest:
+                try:
+                    engine.delete(workspace)
+                except Exception:
+                    pass
+
+    def clear(self, engine):
+        if self.workspace is not None:
+            try:
+                engine.delete(self.workspace)
+            except Exception:
+                addMessage("    Scratch workspace is in use and will be removed by a later run: " + self.workspace)
+            self.workspace = None
+
+
+def localFolder(output_folder=''):
+    '''
+    A function to return the local folder of the clip workspaces of reports written to output_folder (the
+    Output Geodatabase Location), or of reports run without one
+    '''
+    if not output_folder:
+        return os.path.join(defaultScratchFolder, 'Interim_Files')
+    return os.path.join(defaultScratchFolder, 'Output_' + hashlib.sha1(os.path.abspath(output_folder).encode('utf-8')).hexdigest()[:8])
+
+
+def flushWorkspace(engine, featureClasses, output_folder, workspaceName):
+    '''
+    A function to copy featureClasses (the AOI and the clipped layers of a report) into a new workspace named
+    workspaceName in output_folder, in one bulk copy. Returns the path of the workspace.
+    '''
+    addMessage("Copying clipped layers to " + output_folder + "...")
+
+    outWorkspace = os.path.join(output_folder, workspaceName)
+    engine.delete(outWorkspace)
+    outWorkspace = os.path.join(output_folder, engine.createWorkspace(output_folder, workspaceName))
+
+    engine.copyFeatureClasses(featureClasses, outWorkspace)
+
+    return outWorkspace
@@ -0,0 +1,237 @@
+'''
+Tool name: Interest Overlap Report (IOR) - Layer Snapshot Cache
+Developer: Mike MacRae for the Ministry of Mines and Critical Minerals
+Contact: michael.macrae@gov.bc.ca or mineral.titles@gov.bc.ca
+
+Most BCGW and MTOPROD layers change weekly at most, yet every report used to read them over the network.
+The snapshot store keeps a local, spatially indexed copy of each layer (one workspace per source and
+definition query) with a fingerprint of the live source: its row count and, where the layer has one, the
+latest edit date. A scheduled job re-checks the fingerprints and re-copies only the layers that changed:
+
+    python IOR_Snapshot_Cache.py --refresh [--force] [--engine arcpy|shapely] [--data <folder>]
+
+processData reads a layer from its snapshot while it is fresh (checked within maxAge hours) and goes to the
+live source when it is stale, missing, or when the user asks for live data.
+
+The same job records the statistics of every source in the configuration spreadsheet (row count, extent and
+shape type) in the layer catalog, which reports read instead of counting the live source.
+'''
+
+import os
+import sys
+import time
+import argparse
+from IOR_Geometry_Engine import getEngine, addMessage
+from IOR_Layer_Catalog import loadCatalog, loadStatistics, sourceKey, masterXLS
+from IOR_JSON_File import readJSON, writeJSON
+
+## Local (not network share) location of the snapshots
+if os.environ.get('LOCALAPPDATA'):
+    defaultSnapshotFolder = os.path.join(os.environ['LOCALAPPDATA'], 'IOR', 'Snapshots')
+else:
+    defaultSnapshotFolder = os.path.join(os.path.expanduser('~'), '.ior', 'snapshots')
+
+## Fields used, in order of preference, to detect edits in a source that kept the same row count
+dateFieldNames = ['WHEN_UPDATED', 'UPDATE_TIMESTAMP', 'LAST_UPDATE_TIMESTAMP', 'LAST_UPDATED', 'DATE_UPDATED', 'EDIT_DATE', 'REVISION_DATE']
+
+
+def sourceFingerprint(engine, source, definitionQuery):
+    '''
+    A function to return a cheap fingerprint of a live source: its row count and the latest edit date, if it has one
+    '''
+    fingerprint = {'count': engine.getCount(source, definitionQuery), 'maxDate': None}
+
+    fieldNames = dict((field.name.upper(), field.name) for field in engine.listFields(source) if str(field.type).lower().startswith('date'))
+    for name in dateFieldNames:
+        if name in fieldNames:
+            maxDate = engine.maxValue(source, fieldNames[name], definitionQuery)
+            fingerprint['maxDate'] = str(maxDate) if maxDate is not None else None
+            break
+
+    return fingerprint
+
+
+class SnapshotStore(object):
+    '''
+    Local snapshots of the IOR source layers, keyed by workspace_path, dataSource and Definition_Query
+    '''
+
+    def __init__(self, folder=None, maxAge=24, useLive=False):
+        self.folder = folder or defaultSnapshotFolder
+        self.maxAge = maxAge
+        self.useLive = useLive
+        self.manifest = self.loadManifest()
+
+    def manifestPath(self):
+        return os.path.join(self.folder, 'snapshots.json')
+
+    def loadManifest(self):
+        return readJSON(self.manifestPath()) or {}
+
+    def saveManifest(self):
+        writeJSON(self.manifestPath(), self.manifest, indent=2, sort_keys=True)
+
+    def snapshotKey(self, workspace, dataSource, definitionQuery):
+        return sourceKey(workspace, dataSource, definitionQuery)
+
+    def isSnapshotSource(self, row):
+        '''
+        Only warehouse layers are snapshotted. Joined layers are left live since the join table is not copied.
+        '''
+        return row[4] in ('BCGW', 'MTOPROD') and row[9] is None
+
+    def isFresh(self, entry, engine):
+        return entry is not None and time.time() - entry['checked'] < self.maxAge * 3600 and engine.exists(entry['path'])
+
+    def resolve(self, row, engine):
+        '''
+        Return (source, definitionQuery, status) for a configuration spreadsheet row. status is 'snapshot' when
+        the fresh local copy is used (the definition query is already applied to it), 'stale' when a snapshot
+        exists but is out of date, and 'live' otherwise.
+        '''
+        live = (engine.sourcePath(row[4], row[5]), row[7], 'live')
+
+        if self.useLive or not self.isSnapshotSource(row):
+            return live
+
+        entry = self.manifest.get(self.snapshotKey(row[4], row[5], row[7]))
+
+        if entry is None:
+            return live
+        elif not self.isFresh(entry, engine):
+            return live[0], live[1], 'stale'
+
+        return entry['path'], None, 'snapshot'
+
+    def sourceVersion(self, row, engine):
+        '''
+        Return the version of the snapshot a report reads a row's layer from (its key and when it was copied),
+        or None when the layer is read live
+        '''
+        if self.resolve(row, engine)[2] != 'snapshot':
+            return None
+
+        key = self.snapshotKey(row[4], row[5], row[7])
+        return key + "_" + str(self.manifest[key]['created'])
+
+    def refresh(self, engine, workspace, dataSource, definitionQuery, force=False):
+        '''
+        Re-check one layer against its live source and re-copy it if its fingerprint changed. Returns True
+        if the snapshot was (re)built.
+        '''
+        key = self.snapshotKey(workspace, dataSource, definitionQuery)
+        source = engine.sourcePath(workspace, dataSource)
+        entry = self.manifest.get(key)
+
+        fingerprint = sourceFingerprint(engine, source, definitionQuery)
+
+        rebuilt = False
+        if force or entry is None or entry['fingerprint'] != fingerprint or not engine.exists(entry['path']):
+
+            # Copy into a new workspace so a report still reading the old snapshot is not disturbed
+            created = time.strftime('%Y%m%d%H%M%S')
+            workspaceName = engine.createWorkspace(self.folder, 'L_' + key + '_' + created + '.gdb')
+            path = engine.copyFeatures(source, os.path.join(self.folder, workspaceName, 'L_' + key), definitionQuery)
+
+            # Selections against the snapshot read only the features near the AOI through its spatial index
+            engine.addSpatialIndex(path)
+
+            if entry is not None:
+                try:
+                    engine.delete(os.path.dirname(entry['path']))
+                except Exception:
+                    addMessage("    Old snapshot is in use and will be removed on the next refresh: " + entry['path'])
+
+            entry = {'workspace': workspace,
+                     'dataSource': dataSource,
+                     'definitionQuery': definitionQuery,
+                     'path': path,
+                     'fingerprint': fingerprint,
+                     'created': time.time()}
+            rebuilt = True
+
+        entry['checked'] = time.time()
+        self.manifest[key] = entry
+        self.saveManifest()
+
+        return rebuilt
+
+
+def refreshSnapshots(catalog, engine, store, force=False, statistics=None):
+    '''
+    A function to refresh the snapshot of every warehouse layer in the configuration spreadsheet, and the
+    statistics of every source in it
+    '''
+
+    addMessage("Refreshing layer snapshots in " + store.folder + "...")
+
+    if not os.path.exists(store.folder):
+        os.makedirs(store.folder)
+
+    if statistics is None:
+        statistics = loadStatistics()
+
+    refreshed = set()
+    for row in catalog.rows:
+
+        key = store.snapshotKey(row[4], row[5], row[7])
+        if key in refreshed:
+            continue
+        refreshed.add(key)
+
+        if not store.isSnapshotSource(row):
+            refreshStatistics(engine, statistics, row)
+            continue
+
+        try:
+            if store.refresh(engine, row[4], row[5], row[7], force):
+                addMessage("  Updated: " + str(row[2]))
+            else:
+                addMessage("  Unchanged: " + str(row[2]))
+        except Exception as e:
+            addMessage("  Could not refresh " + str(row[2]) + ": " + str(e))
+            continue
+
+        # The snapshot is a copy of the source with its definition query applied, so its statistics are the
+        # source's and are read locally
+        entry = store.manifest[key]
+        cached = statistics.get(row)
+        if cached is None or cached['updated'] < entry['created'] or cached['count'] != entry['fingerprint']['count']:
+            refreshStatistics(engine, statistics, row, entry['path'], entry['fingerprint']['count'])
+
+    statistics.save()
+
+    addMessage("Snapshots refreshed...")
+
+
+def refreshStatistics(engine, statistics, row, source=None, count=None):
+    '''
+    A function to record the row count, extent and shape type of a layer's source (or of its snapshot)
+    '''
+    try:
+        if source is None:
+            source = engine.sourcePath(row[4], row[5])
+            count = engine.getCount(source, row[7])
+        statistics.record(row, count, engine.extent(source), engine.shapeType(source))
+    except Exception as e:
+        addMessage("  Could not read the statistics of " + str(row[2]) + ": " + str(e))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Refresh the local IOR layer snapshots. Run on a schedule (e.g. nightly).")
+    parser.add_argument('--refresh', action='store_true', help="check every layer against its live source and re-copy the ones that changed")
+    parser.add_argument('--force', action='store_true', help="re-copy every layer whether or not it changed")
+    parser.add_argument('--engine', default=None, help="geometry engine: arcpy (default when installed) or shapely")
+    parser.add_argument('--data', default=None, help="folder holding BCGW.sde and MTOPROD.sde (arcpy) or the layer copies (shapely)")
+    parser.add_argument('--snapshots', default=defaultSnapshotFolder, help="snapshot folder")
+    parser.add_argument('--xls', default=masterXLS, help="IOR configuration spreadsheet")
+    args = parser.parse_args()
+
+    if not args.refresh:
+        parser.print_help()
+        sys.exit(0)
+
+    engine = getEngine(args.engine, args.data)
+
+    refreshSnapshots(loadCatalog(args.xls, engine), engine, SnapshotStore(args.snapshots), args.force)
@@ -6,13 +6,11 @@ Date: Developed March 2014. Updated May 2025
 '''
 
 # Import required modules
-import arcpy
 import sys
 import re
 import os
-import win32com.client
+import math
 import itertools
-import datetime
 import urllib
 import hmac
 import json
@@ -20,24 +18,151 @@ import requests
 import hashlib
 import base64
 import time
-from arcpy import env
+import uuid
+import traceback
+import threading
+import multiprocessing
+import multiprocessing.pool
 from getpass import getuser
 from collections import OrderedDict
+from IOR_Geometry_Engine import getEngine, addMessage, toolPath
+from IOR_Snapshot_Cache import SnapshotStore
+from IOR_Layer_Catalog import loadCatalog, loadStatistics
+from IOR_Report_Writer import getReportWriter
+from IOR_Buffer_Cache import BufferCache, defaultBufferFolder
+from IOR_Result_Cache import ResultCache, defaultResultFolder, workspaceSize
+from IOR_Run_Manifest import RunManifest
+from IOR_Run_Checkpoint import RunCheckpoint, checkpointPath
+from IOR_Run_Trace import RunTrace
+from IOR_Schema_Cache import SchemaCache, defaultSchemaFolder
+from IOR_Scratch_Workspace import ScratchWorkspace, localFolder, flushWorkspace
+from IOR_SQL_Templates import loadTemplates
+from IOR_Report_Service import submitReport
+
+# arcpy is only available on the DTS desktop. Without it the processing functions can still be
+# imported and run through the Shapely geometry engine, and the report written with the xlsx report writer.
+try:
+    import arcpy
+    from arcpy import env
+except ImportError:
+    arcpy = None
+
+## SQL files of the query layers (Query_Layer column of the configuration spreadsheet)
+sqlFolder = os.path.join(toolPath, "sqls")
+
+## Timed stages of the report being run (IOR_Run_Trace.py). runReport starts a new trace for each report.
+runTrace = RunTrace()
 
 ## Set the parameters for the ArcGIS GUI
-AOI = arcpy.GetParameterAsText(0)
-sqlQuery = arcpy.GetParameterAsText(1)
-shFieldList = arcpy.GetParameter(2)
-pre_defined_layer_list_choice = arcpy.GetParameterAsText(3)
-layerList = [x.strip("'") for x in arcpy.GetParameterAsText(4).split(";")]
-output_GDB = arcpy.GetParameterAsText(5)
-output_excel = arcpy.GetParameterAsText(6)
-output_name = arcpy.GetParameterAsText(7)
-username = arcpy.GetParameterAsText(8)
-mtoprodpassword = arcpy.GetParameter(9)
-bcgwpassword = arcpy.GetParameter(10)
-createGeomark = arcpy.GetParameter(11)
+if arcpy is not None:
+    AOI = arcpy.GetParameterAsText(0)
+    sqlQuery = arcpy.GetParameterAsText(1)
+    shFieldList = arcpy.GetParameter(2)
+    pre_defined_layer_list_choice = arcpy.GetParameterAsText(3)
+    layerList = [x.strip("'") for x in arcpy.GetParameterAsText(4).split(";")]
+    output_GDB = arcpy.GetParameterAsText(5)
+    output_excel = arcpy.GetParameterAsText(6)
+    output_name = arcpy.GetParameterAsText(7)
+    username = arcpy.GetParameterAsText(8)
+    mtoprodpassword = arcpy.GetParameter(9)
+    bcgwpassword = arcpy.GetParameter(10)
+    createGeomark = arcpy.GetParameter(11)
+    batchField = arcpy.GetParameterAsText(12) if arcpy.GetArgumentCount() > 12 else ''
+    workers = int(arcpy.GetParameterAsText(13) or 1) if arcpy.GetArgumentCount() > 13 else 1
+    useLiveData = arcpy.GetParameter(14) if arcpy.GetArgumentCount() > 14 else False
+    reuseBuffers = arcpy.GetParameter(15) if arcpy.GetArgumentCount() > 15 else False
+    reuseResults = arcpy.GetParameter(16) if arcpy.GetArgumentCount() > 16 else False
+    incremental = arcpy.GetParameter(17) if arcpy.GetArgumentCount() > 17 else False
+    resume = arcpy.GetParameter(18) if arcpy.GetArgumentCount() > 18 else False
+    tileVertices = int(arcpy.GetParameterAsText(19) or 0) if arcpy.GetArgumentCount() > 19 else 0
+    quickScreen = arcpy.GetParameter(20) if arcpy.GetArgumentCount() > 20 else False
+    stopAtFirstHit = arcpy.GetParameter(21) if arcpy.GetArgumentCount() > 21 else False
+    scratchInMemory = arcpy.GetParameter(22) if arcpy.GetArgumentCount() > 22 else False
+    useReportService = arcpy.GetParameter(23) if arcpy.GetArgumentCount() > 23 else False
+else:
+    AOI = sqlQuery = pre_defined_layer_list_choice = output_GDB = output_excel = output_name = username = ''
+    shFieldList = []
+    layerList = []
+    mtoprodpassword = bcgwpassword = ''
+    createGeomark = False
+    batchField = ''
+    workers = 1
+    useLiveData = False
+    reuseBuffers = False
+    reuseResults = False
+    incremental = False
+    resume = False
+    tileVertices = 0
+    quickScreen = False
+    stopAtFirstHit = False
+    scratchInMemory = False
+    useReportService = False
+
+## Tool parameters of a report, less the login, so a report can be handed to the report service, with the
+## values used for the ones a submitted report leaves out
+defaultReportParameters = OrderedDict([
+    ('AOI', ''),
+    ('sqlQuery', ''),
+    ('shFieldList', []),
+    ('pre_defined_layer_list_choice', ''),
+    ('layerList', []),
+    ('output_GDB', ''),
+    ('output_excel', ''),
+    ('output_name', ''),
+    ('createGeomark', False),
+    ('batchField', ''),
+    ('workers', 1),
+    ('useLiveData', False),
+    ('reuseBuffers', False),
+    ('reuseResults', False),
+    ('incremental', False),
+    ('resume', False),
+    ('tileVertices', 0),
+    ('quickScreen', False),
+    ('stopAtFirstHit', False),
+    ('scratchInMemory', False),
+])
+
+
+
+def reportParameters():
+    '''
+    A function to return the tool parameters of this run as plain values that can be sent to the report service
+    '''
+    parameters = dict((name, globals()[name]) for name in defaultReportParameters)
+    parameters['shFieldList'] = [str(shField) for shField in shFieldList]
+
+    # The service cannot see the layers of the map document, so it is given the AOI's data source
+    if arcpy is not None and AOI and arcpy.Exists(AOI):
+        parameters['AOI'] = arcpy.Describe(AOI).catalogPath
 
+    return parameters
+
+
+def checkReportParameters(parameters):
+    '''
+    A function to check the tool parameters of a report submitted to the report service before it is queued
+    '''
+    unknown = [name for name in parameters if name not in defaultReportParameters]
+    if unknown:
+        raise ValueError("Unknown report parameters: " + ", ".join(sorted(unknown)))
+
+    for name in ('AOI', 'layerList'):
+        if not parameters.get(name):
+            raise ValueError("The '" + name + "' report parameter is required")
+
+    for name in ('shFieldList', 'layerList'):
+        if name in parameters and not isinstance(parameters[name], list):
+            raise ValueError("The '" + name + "' report parameter must be a list")
+
+
+def setReportParameters(parameters):
+    '''
+    A function to set the tool parameters of a report submitted to the report service. Parameters left out
+    take their default, not the value of the report run before.
+    '''
+    for name, default in defaultReportParameters.items():
+        globals()[name] = parameters.get(name, default)
 
 
 def login(username, mtoprodpassword, bcgwpassword):
@@ -110,31 +235,46 @@ def delFeatLayer(featLayer):
         pass
     
 
-def createScratchGDB(output_folder):
+def createScratchGDB(output_folder, engine, incremental=False, resume=False):
     '''
-    A function that creates a scratch geodatabase
+    A function that creates a scratch geodatabase, on local disk, for the AOI and clipped layers of the report.
+    With an output folder, the geodatabase is named after the report and copied to the output folder once the
+    report is written. A resumed run keeps the latest geodatabase that has a run checkpoint, and an incremental
+    run into an output folder keeps the latest geodatabase of the report that has a run manifest, instead.
+    Returns the local folder and the name of the geodatabase.
     '''
     
-    arcpy.AddMessage("Setting Output Geodatabase Location...")
+    addMessage("Setting Output Geodatabase Location...")
     
-    arcpy.env.overwriteOutput = True
+    if arcpy is not None:
+        arcpy.env.overwriteOutput = True
     
     if output_folder == '':
     
-        output_folder = os.path.join(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Interim_Files", getuser())
+        # The clipped layers of a report with no output folder are never copied to the network share
+        output_folder = localFolder()
+
+        previous = latestWorkspace(engine, output_folder, r"scratch_\d+\.\w+$", checkpointPath) if resume else None
         lockedGDBs=[]
         
-        env.workspace = output_folder
-        
-        for gdb in arcpy.ListWorkspaces("*", "FileGDB"):
+        for gdb in engine.listWorkspaces(output_folder):
 
             basename = os.path.basename(gdb)
-            inFeatures, file_extension = os.path.splitext(os.path.basename(gdb))
+
+            # Keep the geodatabase being resumed, and those of its pool workers that hold some of its clips
+            if previous is not None and (gdb == previous or basename.startswith(os.path.splitext(os.path.basename(previous))[0] + "_worker_")):
+                continue
 
             try:
-                delFeatLayer(gdb)
+                engine.delete(gdb)
+                if os.path.exists(checkpointPath(gdb)):
+                    os.remove(checkpointPath(gdb))
             except: 
                 lockedGDBs.append(basename)
+
+        if previous is not None:
+            addMessage("    Resuming " + previous)
+            return output_folder, os.path.basename(previous)
         
         gdbIndex = 1
         scratchGDB = "scratch_1.gdb"
@@ -142,138 +282,193 @@ def createScratchGDB(output_folder):
         while gdbIndex:
 
             if scratchGDB not in lockedGDBs:
-                arcpy.CreateFileGDB_management(output_folder, scratchGDB)
+                scratchGDB = engine.createWorkspace(output_folder, scratchGDB)
                 break
             else:
                 gdbIndex+=1
                 scratchGDB = "scratch_" + str(gdbIndex) + ".gdb"
         
     else:
+
+        output_folder = localFolder(output_folder)
+
+        namePattern = r"IOR_Clipped_FeatureClasses_" + re.escape(output_name) + r"_\d{2}[A-Za-z]{3}\d{4}\.\w+$"
+
+        if resume:
+            previous = latestWorkspace(engine, output_folder, namePattern, checkpointPath)
+            if previous is not None:
+                addMessage("    Resuming " + previous)
+                return output_folder, os.path.basename(previous)
                 
+        if incremental:
+            previous = latestWorkspace(engine, output_folder, namePattern, lambda gdb: RunManifest(gdb).path())
+            if previous is not None:
+                addMessage("    Updating " + previous)
+                return output_folder, os.path.basename(previous)
+
         scratchGDB = "IOR_Clipped_FeatureClasses_" + output_name + "_" + time.strftime('%d%b%Y') + ".gdb"
-        scratchLoc = output_folder + "\\" + scratchGDB
-        
-        delFeatLayer(scratchLoc)
+
+        # Earlier geodatabases of the report (and of its pool workers) are only kept locally for a resumed or
+        # incremental run, so they are replaced
+        workerPattern = re.compile(r"IOR_Clipped_FeatureClasses_" + re.escape(output_name) + r"_\d{2}[A-Za-z]{3}\d{4}_worker_\w+\.\w+$")
+        for gdb in engine.listWorkspaces(output_folder):
+            if re.match(namePattern, os.path.basename(gdb)) or workerPattern.match(os.path.basename(gdb)):
+                engine.delete(gdb)
+
+                # The manifest and checkpoint of a rebuilt geodatabase no longer describe its clips
+                for path in (RunManifest(gdb).path(), checkpointPath(gdb)):
+                    if os.path.exists(path):
+                        os.remove(path)
         
-        arcpy.CreateFileGDB_management(output_folder, scratchGDB)       
+        scratchGDB = engine.createWorkspace(output_folder, scratchGDB)       
 
     return output_folder, scratchGDB
 
 
-def getXLSData():
+def latestWorkspace(engine, folder, namePattern, sidecarPath):
     '''
-    A function to set which Database to pull Mineral Titles data from and
-    to create a python dictionary to store the dataset name and buffer distance for
-    layers in the MASTER spreadsheet that ask for buffering
+    A function to return the most recently updated workspace of folder whose name matches namePattern and that
+    has the file sidecarPath(workspace) (a run manifest or checkpoint) next to it, or None
     '''
-    arcpy.AddMessage("Getting XLS Data...")
+    namePattern = re.compile(namePattern)
+    previous = [(sidecarPath(gdb), gdb) for gdb in engine.listWorkspaces(folder) if namePattern.match(os.path.basename(gdb))]
+    previous = sorted((os.path.getmtime(path), gdb) for path, gdb in previous if os.path.exists(path))
+
+    return previous[-1][1] if previous else None
+
+
+def getXLSData(engine):
+    '''
+    A function to load the layer catalog compiled from the MASTER spreadsheet (IOR_Data and Apps sheets).
+    The spreadsheet is only read again when it has changed since the catalog was compiled.
+    '''
+    addMessage("Getting XLS Data...")
 
     xls = r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Excel_Spreadsheets\InterestReport_Layer_List_MASTER.xlsx"
-    
-    IOR_Data = os.path.join(xls, 'IOR_Data$')
-    apps_Data = os.path.join(xls, 'Apps$')
 
-    IORData_Fields = [field.name for field in arcpy.ListFields(IOR_Data)]
-    
-    appDict={}
-    for row in arcpy.da.SearchCursor(apps_Data,['App', 'URL']):
-        if row[0] is not None:
-            appDict[str(row[0])] = row[1]  
+    catalog = loadCatalog(xls, engine)
 
-    return IOR_Data, IORData_Fields, appDict
+    return catalog, catalog.apps
 
 
-def processAOI(AOI, output_folder, scratchGDB):
+def processAOI(AOI, sqlQuery, output_folder, scratchGDB, engine):
     '''
     A function to determine the number of features in the AOI, set an exception if it's not only one feature
     and to compute the area of the AOI from its spatial file
     '''
 
-    arcpy.AddMessage("Processing AOI...")
-    delFeatLayer("AOIFeat")
+    addMessage("Processing AOI...")
     
     if sqlQuery:
         
-        AOIFeats = arcpy.GetCount_management(arcpy.MakeFeatureLayer_management(AOI,"AOIFeat",sqlQuery))
-        AOICount = int(AOIFeats.getOutput(0))
+        AOICount = engine.getCount(AOI, sqlQuery)
         
-        arcpy.AddMessage("Count of AOI features = " + str(AOICount))
+        addMessage("Count of AOI features = " + str(AOICount))
         
         if AOICount != 1:
             if AOICount == 0:
                 raise Exception("SQL Query returns empty result. Please redefine query, validate to see one record returns and rerun IOR.")
             elif AOICount > 1:
                 raise Exception("SQL Query returns more than one feature. Please redefine query, validate to see one record returns and rerun IOR.")
-        else:
-            arcpy.FeatureClassToFeatureClass_conversion("AOIFeat", output_folder + "\\" + scratchGDB, "AOI")
-            processedAOI = output_folder + "\\" + scratchGDB + "\\" + "AOI"
             
-    else:
-        arcpy.MakeFeatureLayer_management(AOI,"AOIFeat")
-        arcpy.FeatureClassToFeatureClass_conversion("AOIFeat", output_folder + "\\" + scratchGDB, "AOI")
-        processedAOI = output_folder + "\\" + scratchGDB + "\\" + "AOI"
+    processedAOI = engine.copyFeatures(AOI, os.path.join(output_folder, scratchGDB, "AOI"), sqlQuery)
 
-    AOI_Area = 0
-    for row in arcpy.da.SearchCursor(processedAOI, ["SHAPE@AREA"]):
-        AOI_Area += row[0]
+    AOI_Area = engine.area(processedAOI)
         
     processedAOI_Hectares = round(AOI_Area/10000, 2)
     
-    if arcpy.Describe(processedAOI).spatialReference.factoryCode != 3005:
+    if engine.spatialReference(processedAOI) != 3005:
         
-        arcpy.AddMessage("Re-projecting to BC Albers (WKID: 3005)...")
+        addMessage("Re-projecting to BC Albers (WKID: 3005)...")
         
-        out_coordinate_system = arcpy.SpatialReference(3005)
-        projected_AOI = output_folder + "\\" + scratchGDB + "\\" + "AOI_projected"
-        arcpy.Project_management(processedAOI, projected_AOI, out_coordinate_system)
-        processedAOI = projected_AOI
+        projected_AOI = os.path.join(output_folder, scratchGDB, "AOI_projected")
+        processedAOI = engine.project(processedAOI, projected_AOI, 3005)
 
     else:
         pass
     
-    for row in arcpy.da.SearchCursor(processedAOI, ["SHAPE@TRUECENTROID"]):
-        urlX, urlY = row[0]
-        coords = str(urlX) + ',' + str(urlY)
+    iMapBCBaseURL = getiMapBCURL(processedAOI, engine)
     
-    arcpy.MakeFeatureLayer_management(processedAOI, 'processedAOI')
-    layer = arcpy.mapping.Layer('processedAOI')
-    
-    mxd = arcpy.mapping.MapDocument(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\templates\getScale_template.mxd")
-    df = arcpy.mapping.ListDataFrames(mxd)[0]    
-    
-    arcpy.mapping.AddLayer(df, layer)
+    return processedAOI, processedAOI_Hectares, iMapBCBaseURL
 
-    df.scale = int(math.ceil(df.scale/500)*500)
 
-    iMapBCBaseURL = 'https://arcmaps.gov.bc.ca/ess/hm/imap4m/?scale={0}&center={1}'.format(df.scale, coords + ',' + '3005')
-    
-    return processedAOI, processedAOI_Hectares, iMapBCBaseURL
+def processAOIBatch(AOI, sqlQuery, batchField, output_folder, scratchGDB, engine):
+    '''
+    A function to split a multi-feature AOI into one AOI per value of the batch field. All the AOIs are kept
+    together in a single feature class so each layer can be selected against the whole batch at once.
+    '''
 
+    addMessage("Processing AOI batch...")
 
-def mappingFields(lyr, fieldList):
-    ''' 
-    A function to map the fields of the output (clipped) feature class. This will limit the output 
-    fields to the fields chosen in the configuration spreadsheet.
-    '''    
+    batchAOI = engine.copyFeatures(AOI, os.path.join(output_folder, scratchGDB, "AOI"), sqlQuery)
+
+    if engine.spatialReference(batchAOI) != 3005:
+        
+        addMessage("Re-projecting to BC Albers (WKID: 3005)...")
+        
+        batchAOI = engine.project(batchAOI, os.path.join(output_folder, scratchGDB, "AOI_projected"), 3005)
+
+    aoiIds = sorted(set(row[0] for row in engine.readTable(batchAOI, [batchField]) if row[0] is not None))
+
+    if len(aoiIds) == 0:
+        raise Exception("AOI batch is empty. Please check the SQL Query and the '" + batchField + "' field and rerun IOR.")
+
+    addMessage("Count of AOIs in batch = " + str(len(aoiIds)))
+
+    aoiDict = OrderedDict()
+    suffixes = set()
+
+    for index, aoiId in enumerate(aoiIds, 1):
+
+        if isinstance(aoiId, (int, float)):
+            where = "{0} = {1}".format(batchField, aoiId)
+        else:
+            where = "{0} = '{1}'".format(batchField, str(aoiId).replace("'", "''"))
+
+        # AOI and clip names come from the AOI ID (as the report names do, but without the hyphens a geodatabase
+        # name cannot have), so they stay with the same AOI when AOIs are added to or dropped from the batch. IDs
+        # that sanitise to the same name also get their position in the batch.
+        suffix = "_" + re.sub(r'[^A-Za-z0-9_]+', '_', str(aoiId))
+        if suffix in suffixes:
+            suffix += "_" + str(index)
+        suffixes.add(suffix)
+
+        processedAOI = engine.copyFeatures(batchAOI, os.path.join(output_folder, scratchGDB, "AOI" + suffix), where)
+
+        aoiDict[aoiId] = {'processedAOI': processedAOI,
+                          'hectares': round(engine.area(processedAOI)/10000, 2),
+                          'iMapBCBaseURL': getiMapBCURL(processedAOI, engine),
+                          'suffix': suffix}
+
+        addMessage("    AOI " + str(aoiId) + ": " + format(aoiDict[aoiId]['hectares'], ",") + " ha")
+
+    return batchAOI, aoiDict
+
+
+def getiMapBCURL(processedAOI, engine):
+    '''
+    A function to build the iMapBC link centred on, and scaled to, the AOI
+    '''
     
-    fms = arcpy.FieldMappings()         
-    for field in arcpy.ListFields(lyr):
-        if field.name in fieldList:
-            fm = arcpy.FieldMap()
-            fm.addInputField(lyr, field.name)
-            fms.addFieldMap(fm)
-                
-    return fms
+    urlX, urlY = engine.centroid(processedAOI)
+    coords = str(urlX) + ',' + str(urlY)
+    
+    scale = int(math.ceil(engine.mapScale(processedAOI)/500)*500)
 
+    return 'https://arcmaps.gov.bc.ca/ess/hm/imap4m/?scale={0}&center={1}'.format(scale, coords + ',' + '3005')
 
-def getLayerInfo(lyrDict, xlsRow, overlap):
+
+def getLayerInfo(lyrDict, xlsRow, overlap, clipName=None):
     
+    if clipName is None:
+        clipName = xlsRow[0] + "_clip"
+
     if overlap == True:
         if xlsRow[1] in lyrDict:
-            lyrDict[xlsRow[1]].update({xlsRow[2]: [str(xlsRow[0] + "_clip"), str(xlsRow[28]), str(xlsRow[36]), str(xlsRow[37])]})
+            lyrDict[xlsRow[1]].update({xlsRow[2]: [str(clipName), str(xlsRow[28]), str(xlsRow[36]), str(xlsRow[37])]})
         else:
             lyrDict[xlsRow[1]] = {}
-            lyrDict[xlsRow[1]].update({xlsRow[2]: [str(xlsRow[0] + "_clip"), str(xlsRow[28]), str(xlsRow[36]), str(xlsRow[37])]})
+            lyrDict[xlsRow[1]].update({xlsRow[2]: [str(clipName), str(xlsRow[28]), str(xlsRow[36]), str(xlsRow[37])]})
         
     else:
         if xlsRow[1] in lyrDict:
@@ -285,263 +480,583 @@ def getLayerInfo(lyrDict, xlsRow, overlap):
     return lyrDict
 
 
-def chunks(lst, n):
-    """
-    Yield successive n-sized chunks from a list of items to be used to split up lists that have more than 1000 items into individual lsists of 1000 itmes.
-    This will be used to aid query layers where there ar emore than 1000 overlapping items.
-    """
-    for i in xrange(0, len(lst), n):
-        yield lst[i:i + n]
-        
-
-def processData(processedAOI, processedAOI_Hectares, IOR_Data, IORData_Fields, output_folder):
+def processData(processedAOI, processedAOI_Hectares, catalog, output_folder, scratchGDB, layerList, engine, workers=1, poolType='process', snapshots=None, bufferFolder=None,
+                resultFolder=None, runManifest=None, checkpoint=None, schemas=None, scratch=None):
     ''' 
     A function to process layers to determine if there is an overlap and subsequently clips and overlaps.
     The process data is used further on in the script to report on a spreadsheet.
     '''    
-    arcpy.AddMessage("    ")
-    arcpy.AddMessage("Processing Layers...")
+    aoiDict = OrderedDict([(None, {'processedAOI': processedAOI, 'hectares': processedAOI_Hectares, 'suffix': ''})])
 
-    layerListDict = {}
-    collectFeatsCountDict = OrderedDict()
-    originalprocessAOI = processedAOI
-    mineral_coal = u'Mineral/Coal'
-    
-#     catList = list(sorted(set([row[1] for row in arcpy.da.SearchCursor(IOR_Data, IORData_Fields) if row[1] not in [u'District', u'Location']])))
-#     catList.insert(0, catList.pop(catList.index(mineral_coal)))
-    
-    for row in arcpy.da.SearchCursor(IOR_Data, IORData_Fields):
+    return processDataBatch(processedAOI, aoiDict, catalog, output_folder, scratchGDB, layerList, engine, workers, poolType, snapshots, bufferFolder, resultFolder, runManifest,
+                            checkpoint, schemas, scratch)[None]
 
-        if row[2] in layerList:        
-        
-            fcName = row[2].replace(' ', '_')
-            if row[4] == 'BCGW':
-                fc = os.path.join(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Interim_Files", getuser(), "BCGW.sde", row[5])
-            elif row[4] == 'MTOPROD':
-                fc = os.path.join(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Interim_Files", getuser(), "MTOPROD.sde", row[5])
-            else:
-                fc = os.path.join(row[4], row[5])
-                
-            arcpy.AddMessage("  Processing Layer: " + row[2])
 
+def processDataBatch(batchAOI, aoiDict, catalog, output_folder, scratchGDB, layerList, engine, workers=1, poolType='process', snapshots=None, bufferFolder=None,
+                     resultFolder=None, runManifest=None, checkpoint=None, schemas=None, scratch=None):
+    ''' 
+    A function to process layers against one or more AOIs. Each layer is opened, queried, selected and exported
+    once against the whole batch; only the clip and overlap fields are done per AOI. With more than one worker
+    the layers are spread over a process (or thread) pool and merged back in spreadsheet order. When a
+    SnapshotStore is given, layers are read from their local snapshot while it is fresh. Buffered layers are
+    selected by distance from the AOI; each AOI buffer is computed once per Buffer_Distance (when a layer needs it
+    for a clip, or before a pool is started), and kept in bufferFolder for later runs if given. When a resultFolder is given, layers read
+    from an unchanged snapshot reuse their results from an earlier run against the same AOI. When a RunManifest
+    is given, layers whose inputs have not changed since they were clipped into the geodatabase are kept as they are.
+    When a RunCheckpoint is given, each layer is recorded in it as soon as it finishes, and the layers that finished
+    before a resumed run was interrupted are skipped. The fields and shape type of each layer are read once, through
+    the SchemaCache schemas when one is given. The selected features of each layer are exported to the
+    ScratchWorkspace scratch (a local one by default), and only the clips are written to scratchGDB. Returns a dictionary of (layerListDict, collectFeatsCountDict) keyed by AOI.
+    '''    
+    addMessage("    ")
+    addMessage("Processing Layers...")
+
+    results = OrderedDict((aoiKey, ({}, OrderedDict())) for aoiKey in aoiDict)
+    scratchLoc = os.path.join(output_folder, scratchGDB)
+
+    rows = catalog.layers(layerList)
+
+    if schemas is None:
+        schemas = SchemaCache(snapshots=snapshots)
+
+    ownScratch = scratch is None
+    if ownScratch:
+        scratch = ScratchWorkspace()
+
+    # Clips of an earlier run are kept, or copied into the scratch workspace from the result cache, and each layer
+    # is only processed against the AOIs it has no earlier result for
+    resultCache = ResultCache(resultFolder) if resultFolder is not None else None
+    cachedResults, resultKeys, layerInputs = fetchCachedResults(resultCache, runManifest, rows, aoiDict, scratchLoc, engine, snapshots, checkpoint)
+
+    if checkpoint is not None:
+        for i, row in enumerate(rows):
+            if cachedResults[i]:
+                checkpoint.record(engine, row, aoiDict, cachedResults[i])
+
+    pending = []
+    for i, row in enumerate(rows):
+        pendingAOIs = OrderedDict((aoiKey, aoi) for aoiKey, aoi in aoiDict.items() if aoiKey not in cachedResults[i])
+        if pendingAOIs:
+            pending.append((i, row, pendingAOIs))
+
+    computedResults = {}
+
+    # The MTOPROD and BCGW connection files are written without the login (DO_NOT_SAVE_USERNAME), so only the
+    # process that logged in can open them, and arcpy is not thread safe. arcpy runs process one layer at a time.
+    if workers > 1 and engine.name == 'arcpy':
+        addMessage("    Parallel Workers are not used with the arcpy engine, as the database connections only work in the process that logged in")
+        workers = 1
+
+    # AOI buffers are made in memory when a clip first needs them, or kept in bufferFolder between runs. Pool
+    # workers cannot read the run's memory workspace, so their buffers are written to the scratch geodatabase.
+    pooled = workers > 1 and len(pending) > 1
+    bufferCache = BufferCache(workspace=scratchLoc if pooled else None, persistFolder=bufferFolder)
+
+    if pooled:
+
+        # Every buffer the layers need is made here, once, before the layers are handed out, rather than by each
+        # worker in its own cache (and with workers writing to Buffers.gdb at the same time)
+        for i, row, pendingAOIs in pending:
             if row[12] is not None:
-                
-                arcpy.AddMessage("    " + "Buffering AOI for " + "'" + str(row[2]) + "' layer by " + str(int(float(row[12]))))
-                
-                processedAOI = originalprocessAOI
-                outBuffer = os.path.join(os.path.dirname(processedAOI), str(row[0]) + "_" + str(row[12]).replace('.','_') + "m_buffer")
-                arcpy.Buffer_analysis(processedAOI, outBuffer, row[12])
-                processedAOI = outBuffer
+                for aoi in pendingAOIs.values():
+                    bufferCache.get(engine, aoi['processedAOI'], row[12])
+
+        addMessage("    Processing " + str(len(pending)) + " layers with " + str(workers) + " " + poolType + " workers")
+
+        if poolType == 'thread':
+            pool = multiprocessing.pool.ThreadPool(workers, initLayerWorker, (engine.name, engine.dataFolder, output_folder, scratchGDB, bufferCache.shared(), engine.tileVertices, scratch.backend))
+        else:
+            # Inside ArcMap sys.executable is ArcMap.exe, so point the workers at the python interpreter
+            if sys.platform == 'win32' and not os.path.basename(sys.executable).lower().startswith('python'):
+                multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'python.exe'))
+            pool = multiprocessing.Pool(workers, initLayerWorker, (engine.name, engine.dataFolder, output_folder, scratchGDB, bufferCache.shared(), engine.tileVertices, scratch.backend))
+
+        finished = False
+        try:
+            # Start the largest layers (by their cached row counts) first so the run does not wait on one long
+            # layer started last. Each layer is taken back, and recorded in the checkpoint, as soon as it finishes.
+            jobs = [(i, row, batchAOI, pendingAOIs, output_folder, snapshots, schemas) for i, row, pendingAOIs in sorted(pending, key=lambda layer: -layerSize(layer[1]))]
+            for i, layerResult, messages, records, layerSchemas, error in pool.imap_unordered(processLayerWorker, jobs):
+                for message in messages:
+                    addMessage(message)
+                runTrace.extend(records)
+                schemas.merge(layerSchemas)
+
+                if error is not None:
+                    # The worker hands back the traceback of the layer's error, since its exception may not pickle
+                    error = RuntimeError("Layer '" + str(rows[i][2]) + "' failed in a pool worker:\n" + error)
+                    if checkpoint is not None:
+                        checkpoint.fail(rows[i], error)
+                    raise error
+                computedResults[i] = layerResult
+
+                if checkpoint is not None:
+                    checkpoint.record(engine, rows[i], aoiDict, layerResult)
+            finished = True
+        finally:
+            # A failed run stops the layers still running rather than waiting on them
+            if finished:
+                pool.close()
             else:
-                processedAOI = originalprocessAOI
-                
-            delFeatLayer("lyr")
-            
-            arcpy.MakeFeatureLayer_management(fc, "lyr")
+                pool.terminate()
+            pool.join()
+
+    else:
+        for i, row, pendingAOIs in pending:
+            try:
+                computedResults[i] = processLayer(row, batchAOI, pendingAOIs, scratchLoc, output_folder, engine, snapshots=snapshots, bufferCache=bufferCache, schemas=schemas, scratch=scratch)
+            except Exception as e:
+                if checkpoint is not None:
+                    checkpoint.fail(row, e)
+                raise
+
+            if checkpoint is not None:
+                checkpoint.record(engine, row, aoiDict, computedResults[i])
+
+        if ownScratch:
+            scratch.clear(engine)
+
+    bufferCache.clear(engine)
+
+    for i, row in enumerate(rows):
+        layerResult = OrderedDict((aoiKey, cachedResults[i][aoiKey] if aoiKey in cachedResults[i] else computedResults[i][aoiKey]) for aoiKey in aoiDict)
+        mergeLayerResult(results, row, layerResult)
+
+        if runManifest is not None and layerInputs[i] is not None:
+            for aoiKey, (clipFC, count) in layerResult.items():
+                runManifest.record(row, aoiKey, layerInputs[i][aoiKey], clipFC, count)
+
+    if runManifest is not None:
+        runManifest.save()
+
+    if resultCache is not None:
+        for i, layerResult in computedResults.items():
+            if resultKeys[i] is not None:
+                for aoiKey, (clipFC, count) in layerResult.items():
+                    resultCache.store(engine, resultKeys[i][aoiKey], clipFC, count)
+        resultCache.save(engine)
+
+    for layerListDict, collectFeatsCountDict in results.values():
+        sortFeatsCountDict(collectFeatsCountDict)
+              
+    addMessage('    ')
+    addMessage('Data Processed...')
+    addMessage('===============================================================================')
+    
+    return results
+
+
+def layerSize(row):
+    '''
+    A function to return the cached row count of a layer's source, or 0 when it has no statistics yet
+    '''
+    statistics = loadStatistics().get(row)
+    return statistics['count'] if statistics is not None and statistics['count'] is not None else 0
+
+
+def fetchCachedResults(resultCache, runManifest, rows, aoiDict, workspace, engine, snapshots, checkpoint=None):
+    '''
+    A function to look up the earlier results of each layer: first the layers that finished before a resumed run
+    was interrupted, then the clips the run manifest says are still good, then the result cache, whose clips are
+    copied to workspace. Returns, for each row, the earlier (clip feature class, count) keyed by AOI, the result
+    cache keys of the layer and its run manifest inputs (None when the layer is not cached or versioned).
+    '''
+    cachedResults = [{} for row in rows]
+    resultKeys = [None] * len(rows)
+    layerInputs = [None] * len(rows)
+
+    for i, row in enumerate(rows):
+
+        if checkpoint is not None and checkpoint.resumed:
+            for aoiKey, aoi in aoiDict.items():
+                result = checkpoint.fetch(engine, row, aoiKey, aoi)
+                if result is not None:
+                    cachedResults[i][aoiKey] = result
+
+        resumed = len(cachedResults[i])
+
+        if runManifest is not None:
+            layerInputs[i] = runManifest.layerInputs(engine, row, aoiDict, snapshots)
+            if layerInputs[i] is not None:
+                for aoiKey in aoiDict:
+                    if aoiKey in cachedResults[i]:
+                        continue
+                    result = runManifest.fetch(engine, row, aoiKey, layerInputs[i][aoiKey])
+                    if result is not None:
+                        cachedResults[i][aoiKey] = result
+
+        if resultCache is not None and len(cachedResults[i]) < len(aoiDict):
+            resultKeys[i] = resultCache.layerKeys(engine, row, aoiDict, snapshots)
+            if resultKeys[i] is not None:
+                for aoiKey, aoi in aoiDict.items():
+                    if aoiKey in cachedResults[i]:
+                        continue
+                    result = resultCache.fetch(engine, resultKeys[i][aoiKey], os.path.join(workspace, row[0] + "_clip" + aoi['suffix']))
+                    if result is not None:
+                        cachedResults[i][aoiKey] = result
+
+        if resumed == len(aoiDict):
+            addMessage("  '" + str(row[2]) + "' finished before the run was interrupted")
+        elif len(cachedResults[i]) == len(aoiDict):
+            addMessage("  Reusing the results of '" + str(row[2]) + "' from a previous run")
+        elif cachedResults[i]:
+            addMessage("  Reusing the results of '" + str(row[2]) + "' for " + str(len(cachedResults[i])) + " of " + str(len(aoiDict)) + " AOIs from a previous run")
+
+    return cachedResults, resultKeys, layerInputs
+
+
+def mergeLayerResult(results, row, layerResult):
+    '''
+    A function to add one layer's result for each AOI to that AOI's layerListDict and collectFeatsCountDict
+    '''
+
+    for aoiKey, (clipFC, count) in layerResult.items():
+
+        layerListDict, collectFeatsCountDict = results[aoiKey]
+
+        if clipFC is None:
+            getLayerInfo(layerListDict, row, False)
+
+        else:
+            getLayerInfo(layerListDict, row, True, clipFC)
+
+            newDict = {}
+            newDict[row[2]] = [count, row[29]]
             
-            # Test for table joins
-            if row[9] is not None:
-                arcpy.AddJoin_management("lyr", str(row[10]), str(row[9]), str(row[11]))
-                arcpy.AddMessage("    " + row[5] + " joined with " + os.path.basename(row[9]))
+            if row[1] not in collectFeatsCountDict.keys():
+                collectFeatsCountDict[row[1]] = {}
+                collectFeatsCountDict[row[1]].update(newDict)
             else:
-                pass
-            
-            lyr = arcpy.mapping.Layer("lyr")
+                collectFeatsCountDict[row[1]].update(newDict)
+
+    return results
+
+
+def screenData(aoiDict, catalog, layerList, engine, snapshots=None, firstHit=False):
+    '''
+    A function to screen layers for overlaps with each AOI (quick screen). Each layer is only selected against the
+    AOIs: nothing is exported, clipped or sorted. Returns a dictionary of (layerListDict, collectFeatsCountDict)
+    keyed by AOI, as processDataBatch does, except that collectFeatsCountDict holds every layer, with a count
+    of 0 for the layers that do not overlap. With firstHit, each layer stops at its first overlapping feature
+    and its count is None.
+    '''
+    addMessage("    ")
+    addMessage("Screening Layers...")
+
+    results = OrderedDict((aoiKey, ({}, OrderedDict())) for aoiKey in aoiDict)
 
-            # Test to see if a Definition Query is needed
-            if row[7] is not None:
-                if lyr.supports("DEFINITIONQUERY"):
-                    lyr.definitionQuery = row[7]
-                    arcpy.AddMessage("    Definition Query applied")
+    for row in catalog.layers(layerList):
+        counts = screenLayer(row, aoiDict, engine, snapshots, firstHit)
+
+        for aoiKey, count in counts.items():
+            layerListDict, collectFeatsCountDict = results[aoiKey]
+            getLayerInfo(layerListDict, row, count != 0, "Not clipped in a quick screen")
+            collectFeatsCountDict.setdefault(row[1], {})[row[2]] = [count, row[29]]
+
+    for layerListDict, collectFeatsCountDict in results.values():
+        sortFeatsCountDict(collectFeatsCountDict)
+
+    addMessage('    ')
+    addMessage('Data Screened...')
+    addMessage('===============================================================================')
+
+    return results
+
+
+def screenLayer(row, aoiDict, engine, snapshots=None, firstHit=False):
+    '''
+    A function to count the features of one layer that overlap each AOI (or are within its Buffer_Distance of it),
+    without exporting or clipping them. With firstHit, the count is None when the layer overlaps the AOI. Returns
+    a dictionary of counts keyed by AOI.
+    '''
+
+    with runTrace.stage('layer', layer=row[2]) as record:
+
+        addMessage("  Screening Layer: " + row[2])
+
+        # Read from the local snapshot of the layer when there is a fresh one
+        if snapshots is not None:
+            fc, defQuery, status = snapshots.resolve(row, engine)
+            if status == 'snapshot':
+                addMessage("    Reading from local snapshot")
+        else:
+            fc, defQuery = engine.sourcePath(row[4], row[5]), row[7]
+
+        join = (row[9], row[10], row[11]) if row[9] is not None else None
+
+        with runTrace.stage('makeLayer'):
+            lyr = engine.makeLayer(fc, "lyr", defQuery, join)
+
+        counts = OrderedDict()
+        for aoiKey, aoi in aoiDict.items():
+
+            with runTrace.stage('select', aoi=str(aoiKey) if aoiKey is not None else None) as selectRecord:
+                if firstHit:
+                    counts[aoiKey] = None if engine.overlapsAny(lyr, aoi['processedAOI'], row[12]) else 0
+                elif row[12] is not None:
+                    counts[aoiKey] = engine.selectWithinDistance(lyr, aoi['processedAOI'], row[12])
                 else:
-                    arcpy.AddMessage("    Does not Support Definition Queries")
-            else:
-                arcpy.AddMessage("    No Definition Query")
-                pass
-            
-            if row[8] is None:
-                fieldList = [field.name for field in arcpy.ListFields(lyr) if field.name in [str(row[i]) for i in range (14, 27) if row[i] is not None]]
-                fms = mappingFields(lyr, fieldList)
+                    counts[aoiKey] = engine.selectByIntersect(lyr, aoi['processedAOI'])
+                selectRecord['features'] = counts[aoiKey]
+
+            suffix = " for AOI " + str(aoiKey) if aoiKey is not None else ""
+            if counts[aoiKey] is None:
+                addMessage("    Overlap found" + suffix)
+            elif counts[aoiKey] == 0:
+                addMessage("    No Overlap Found" + suffix)
             else:
-                pass              
-        
-            selectresult = arcpy.GetCount_management(lyr)
-             
-            selectcount = int(selectresult.getOutput(0))
-            arcpy.AddMessage("    Count before select: " + str(selectcount))
-            
-            arcpy.AddMessage("    Processing Select by Location")
+                addMessage("    Overlapping features" + suffix + ": " + str(counts[aoiKey]))
 
-            arcpy.SelectLayerByLocation_management(lyr, "intersect", processedAOI)
+        record['features'] = sum(count or 0 for count in counts.values())
 
-            selectresult = arcpy.GetCount_management(lyr)
-            selectcount = int(selectresult.getOutput(0))
- 
-            arcpy.AddMessage("    Count after selection: " + str(selectcount))          
+    return counts
 
-            # Test to see if records were selected during select by location
-            if selectcount != 0:
 
-                arcpy.AddMessage("    Exporting Selected Features")
-                
-                # Process: Make Query Layer
-                if row[8] is not None:
-                    
-                    toolPath = r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report"
-                    
-                    sql, whereColumn = row[8].split(';')
+## Per worker state for processDataBatch pools (one engine and scratch workspace per worker)
+workerState = threading.local()
 
-                    whereColumnAlias = 't.' + whereColumn
-                    
-                    whereList = [whereRow[0] for whereRow in arcpy.da.SearchCursor(lyr,whereColumn)]
-                    
-                    if len(whereList) == 1:
-                        whereList = whereColumnAlias + ' in ' + str(tuple(whereList)).replace(",)", ")")
 
-                    elif len(whereList) > 1000:
-                        where_conditions = []
-                        for chunk in chunks(whereList, 1000):
-                            where_conditions.append(whereColumnAlias + " IN " + str(tuple(chunk)))
+def initLayerWorker(engineName, dataFolder, output_folder, scratchGDB, bufferCache=None, tileVertices=0, scratchBackend='local'):
+    '''
+    A function to set up a pool worker with its own geometry engine and its own clip and intermediate workspaces
+    so workers never write to the same geodatabase. The AOI buffers come from bufferCache, the buffers the run
+    made before handing out the layers.
+    '''
 
-                        # Combine conditions using OR
-                        whereList = " OR\n".join(where_conditions)
-                        
-                    else:
-                        whereList = whereColumnAlias + ' in '  + str(tuple(whereList))
+    if arcpy is not None:
+        arcpy.env.overwriteOutput = True
 
-                    
-                    for filename in os.listdir(os.path.join(toolPath, "sqls")):
-                        
-                        if filename.endswith('.sql'):
-                            
-                            if filename == sql:
-                                
-                                filepath = os.path.join(os.path.join(toolPath, "sqls"), filename)
-                                
-                                fd = open(filepath, 'r')
-                                sqlFile = fd.read()
-                                fd.close()
-
-                    sqlFile = sqlFile.replace("update_query", whereList)
-                    
-                    arcpy.MakeQueryLayer_management(os.path.join(output_folder, row[4] + '.sde'), "queryOutput", sqlFile, "OBJECTID")
-                
-                    # Process: Feature Class to Feature Class
-                    arcpy.FeatureClassToFeatureClass_conversion("queryOutput", output_folder + "\\" + scratchGDB, row[0])
-                
-                else:
-                                      
-                    arcpy.FeatureClassToFeatureClass_conversion(lyr, output_folder + "\\" + scratchGDB, row[0], '', field_mapping=fms)
-                
-                # Describe the shapetype of each layer
-                desc = arcpy.Describe(lyr)
-                if desc.shapeType == "Polygon":
+    workerState.engine = getEngine(engineName, dataFolder)
+    workerState.engine.tileVertices = tileVertices
+    workerGDB = os.path.splitext(scratchGDB)[0] + "_worker_" + uuid.uuid4().hex[:8] + ".gdb"
+    workerState.workspace = os.path.join(output_folder, workerState.engine.createWorkspace(output_folder, workerGDB))
+    workerState.bufferCache = bufferCache.shared() if bufferCache is not None else BufferCache()
+    workerState.scratch = ScratchWorkspace(scratchBackend)
 
-                    arcpy.AddField_management(output_folder + "\\" + scratchGDB + "\\" + row[0], "ORIGINAL_HECTARES", "DOUBLE", "", "", "", "Original Area (Ha)")
 
-                    arcpy.CalculateField_management(output_folder + "\\" + scratchGDB + "\\" + row[0], "ORIGINAL_HECTARES", "round(!shape.area!/10000,6)", "PYTHON_9.3") 
-                    
-                    arcpy.AddMessage("    Clipping Select Features with AOI")
-                    arcpy.Clip_analysis(output_folder + "\\" + scratchGDB + "\\" + row[0], processedAOI, output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip")
-                    
-                    arcpy.Delete_management(output_folder + "\\" + scratchGDB + "\\" + row[0])
-                    
-                    layerListDict = getLayerInfo(layerListDict, row, True)
-                    
-                    arcpy.AddField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "OVERLAPPING_HECTARES", "DOUBLE", "", "", "", "Overlapping Area (Ha)")
-                                                       
-                    arcpy.CalculateField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "OVERLAPPING_HECTARES", "round(!shape.area!/10000,6)", "PYTHON_9.3")
+def processLayerWorker(args):
+    '''
+    A function to process one layer in a pool worker. The layer's index is handed back with its result (or the
+    traceback of the error it failed with), messages, timed stages and the schemas read, to be written by the run.
+    '''
 
-                    arcpy.AddField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "PERCENT_OF_LAYER_BEING_OVERLAPPED_BY_AOI", "DOUBLE", "", "", "", "% Layer being Overlapped by AOI")
+    i, row, batchAOI, aoiDict, output_folder, snapshots, schemas = args
+    messages = []
 
-                    arcpy.CalculateField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "PERCENT_OF_LAYER_BEING_OVERLAPPED_BY_AOI", "round(!OVERLAPPING_HECTARES!/!ORIGINAL_HECTARES!*100,6)", "PYTHON_9.3")
+    # The layer's stages are timed in the worker and added to the run's trace with its result
+    trace = RunTrace()
+    workerState.engine.trace = trace
 
-                    arcpy.AddField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "PERCENT_OF_AOI_BEING_OVERLAPPED_BY_LAYER", "DOUBLE", "", "", "", "% AOI being Overlapped by Layer")
+    try:
+        layerResult = processLayer(row, batchAOI, aoiDict, workerState.workspace, output_folder, workerState.engine, messages, snapshots, workerState.bufferCache, trace, schemas, workerState.scratch)
+    except Exception:
+        return i, None, messages, trace.records, schemas.changes(), traceback.format_exc()
 
-                    arcpy.CalculateField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "PERCENT_OF_AOI_BEING_OVERLAPPED_BY_LAYER", "round(!OVERLAPPING_HECTARES!/{0}*100, 12)".format(processedAOI_Hectares), "PYTHON_9.3")
+    return i, layerResult, messages, trace.records, schemas.changes(), None
 
-                                                   
-                elif desc.shapeType == "Polyline":
-                    
-                    arcpy.AddField_management(output_folder + "\\" + scratchGDB + "\\" + row[0], "ORIGINAL_LENGTH", "FLOAT", "", "", "", "Original Length")
 
-                    arcpy.CalculateField_management(output_folder + "\\" + scratchGDB + "\\" + row[0], "ORIGINAL_LENGTH", "round(!shape.length!/1000,6)", "PYTHON_9.3") 
+def processLayer(row, batchAOI, aoiDict, workspace, output_folder, engine, messages=None, snapshots=None, bufferCache=None, trace=None, schemas=None, scratch=None):
+    '''
+    A function to process one layer from the configuration spreadsheet against every AOI. Clipped feature classes
+    are written to workspace, and intermediate ones to the ScratchWorkspace scratch (workspace as well when none is
+    given). The AOI buffers used to clip buffered layers come from bufferCache, and the layer's fields and shape
+    type from schemas. Each step is timed in trace (the run's trace by default). Returns a dictionary of (clip
+    feature class, feature count) keyed by AOI, with (None, 0) for AOIs the layer does not overlap.
+    '''
+    if trace is None:
+        trace = runTrace
 
-                    arcpy.AddMessage("    Clipping Select Features with AOI")
-                    arcpy.Clip_analysis(output_folder + "\\" + scratchGDB + "\\" + row[0], processedAOI, output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip")
-                    
-                    arcpy.Delete_management(output_folder + "\\" + scratchGDB + "\\" + row[0])
-                        
-                    layerListDict = getLayerInfo(layerListDict, row, True)                   
-                          
-                    arcpy.AddField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "OVERLAPPING_LENGTH", "FLOAT", "", "", "", "Overlapping Length")
+    with trace.stage('layer', layer=row[2]) as record:
+        layerResult = processLayerSteps(row, batchAOI, aoiDict, workspace, output_folder, engine, messages, snapshots, bufferCache, trace, schemas, scratch)
+        record['features'] = sum(count for clipFC, count in layerResult.values())
 
-                    arcpy.CalculateField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "OVERLAPPING_LENGTH", "round(!shape.length!/1000,6)", "PYTHON_9.3") 
+    return layerResult
 
-                elif desc.shapeType == "Point":
-                    
-                    arcpy.AddMessage("    Clipping Select Features with AOI")
-                    arcpy.Clip_analysis(output_folder + "\\" + scratchGDB + "\\" + row[0], processedAOI, output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip")
-                    
-                    arcpy.Delete_management(output_folder + "\\" + scratchGDB + "\\" + row[0])
 
-                    layerListDict = getLayerInfo(layerListDict, row, True)
+def processLayerSteps(row, batchAOI, aoiDict, workspace, output_folder, engine, messages, snapshots, bufferCache, trace, schemas=None, scratch=None):
+    '''
+    A function to run the steps of processLayer, each in its own stage of trace
+    '''
 
-                    arcpy.management.AddXY(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip")
+    # Messages either go straight to the geoprocessing window or are collected for a pool worker
+    if messages is None:
+        log = addMessage
+    else:
+        log = messages.append
 
-                    arcpy.AddField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "EASTING", "DOUBLE", "", 2)
-                    arcpy.AddField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "NORTHING", "DOUBLE", "", 2)
+    layerResult = OrderedDict((aoiKey, (None, 0)) for aoiKey in aoiDict)
 
-                    arcpy.CalculateField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "EASTING", "[POINT_X]")
-                    arcpy.CalculateField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "NORTHING", "[POINT_Y]")
+    # In a batch the layer is selected against every AOI at once (batchAOI) and then checked against each one
+    isBatch = any(aoi['processedAOI'] != batchAOI for aoi in aoiDict.values())
 
-                    arcpy.DeleteField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", ["POINT_X", "POINT_Y"])
-                    
-                elif desc.shapeType == "Multipoint":
-                    
-                    arcpy.AddMessage("    Clipping selected features with AOI")
-                    
-                    arcpy.Clip_analysis(output_folder + "\\" + scratchGDB + "\\" + row[0], processedAOI, output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip")
+    log("  Processing Layer: " + row[2])
 
-                    arcpy.Delete_management(output_folder + "\\" + scratchGDB + "\\" + row[0])
-                    
-                    layerListDict = getLayerInfo(layerListDict, row, True)
+    # Read from the local snapshot of the layer when there is a fresh one
+    if snapshots is not None:
+        fc, defQuery, status = snapshots.resolve(row, engine)
+        if status == 'snapshot':
+            log("    Reading from local snapshot")
+        elif status == 'stale':
+            log("    Local snapshot is out of date, reading from " + row[4])
+    else:
+        fc, defQuery = engine.sourcePath(row[4], row[5]), row[7]
 
-                    arcpy.AddField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "POINT_LOCATION", "TEXT", "", "", 20, "Point Location")
+    if bufferCache is None:
+        bufferCache = BufferCache()
 
-                    arcpy.CalculateField_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", "POINT_LOCATION", '"Point Location"', "PYTHON_9.3")
-                    
-                if row[13] is not None:
-                    arcpy.AddMessage("    Sorting rows...")
-                    
-                    fieldsorted = [str(pair).split(',') for pair in row[13].split(';')]
+    if schemas is None:
+        schemas = SchemaCache(snapshots=snapshots)
 
-                    arcpy.Sort_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip", output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip_sorted", fieldsorted)
-                    arcpy.Delete_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip")
-                    arcpy.Rename_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip_sorted", output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip")   
-                  
-            else:
-                layerListDict = getLayerInfo(layerListDict, row, False)
+    # Test for table joins
+    if row[9] is not None:
+        join = (row[9], row[10], row[11])
+    else:
+        join = None
+    
+    with trace.stage('makeLayer'):
+        lyr = engine.makeLayer(fc, "lyr", defQuery, join)
 
-                arcpy.AddMessage("    No Overlap Found")
-       
-            if arcpy.Exists(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip"):
-                newDict = {}
-                newDict[row[2]] = [int(arcpy.GetCount_management(output_folder + "\\" + scratchGDB + "\\" + row[0] + "_clip").getOutput(0)), row[29]]
+    if row[7] is None:
+        log("    No Definition Query")
+    
+    if row[8] is None:
+        with trace.stage('listFields'):
+            fieldList = [field.name for field in schemas.fields(engine, row, lyr) if field.name in [str(row[i]) for i in range (14, 27) if row[i] is not None]]
+    else:
+        pass              
+
+    # The size of the layer comes from the statistics of the snapshot refresh job, not from counting the source
+    statistics = loadStatistics().get(row)
+    if statistics is not None:
+        log("    Count before select: " + str(statistics['count']) + " (as of " + time.strftime('%b %d, %Y', time.localtime(statistics['updated'])) + ")")
+    
+    log("    Processing Select by Location")
+
+    # Buffered layers are selected by their distance from the whole batch, without buffering it
+    with trace.stage('select') as record:
+        if row[12] is not None:
+            log("    " + "Selecting features within " + str(int(float(row[12]))) + " m of the AOI for " + "'" + str(row[2]) + "' layer")
+            selectcount = engine.selectWithinDistance(lyr, batchAOI, row[12])
+        else:
+            selectcount = engine.selectByIntersect(lyr, batchAOI)
+        record['features'] = selectcount
+
+    log("    Count after selection: " + str(selectcount))          
+
+    # Test to see if records were selected during select by location
+    if selectcount != 0:
+
+        log("    Exporting Selected Features")
+        
+        # The selected features are only kept until they are clipped
+        if scratch is not None:
+            selectedFC = scratch.path(engine, row[0])
+        else:
+            selectedFC = os.path.join(workspace, row[0])
+
+        with trace.stage('export', features=selectcount) as record:
+            workspaceBytes = workspaceSize(workspace)
+
+            # Process: Make Query Layer
+            if row[8] is not None:
                 
-                if row[1] not in collectFeatsCountDict.keys():
-                    collectFeatsCountDict[row[1]] = {}
-                    collectFeatsCountDict[row[1]].update(newDict)
+                sql, whereColumn = row[8].split(';')
+
+                # The selected IDs fill the template's :ids parameter as one set rather than IN lists of 1000
+                whereList = [whereRow[0] for whereRow in engine.readTable(lyr, [whereColumn])]
+
+                # SQL templates are read and checked once per session
+                sqlTemplate = loadTemplates(sqlFolder).template(sql)
+
+                queryOutput = engine.makeQueryLayer(engine.connectionPath(row[4]), "queryOutput", sqlTemplate, "OBJECTID", {'ids': whereList})
+            
+                # Process: Feature Class to Feature Class
+                engine.copyFeatures(queryOutput, selectedFC)
+            
+            else:
+                                  
+                engine.copyFeatures(lyr, selectedFC, fieldList=fieldList)
+
+            record['bytes'] = workspaceSize(workspace) - workspaceBytes
+        
+        # Describe the shapetype of each layer
+        shapeType = schemas.shapeType(engine, row, lyr)
+
+        if row[13] is not None:
+            fieldsorted = [str(pair).split(',') for pair in row[13].split(';')]
+        else:
+            fieldsorted = None
+
+        # In a batch, the exported features are the union of every AOI's overlaps
+        if isBatch:
+            selectedLyr = engine.makeLayer(selectedFC, "selectedLyr")
+
+        for aoiKey, aoi in aoiDict.items():
+
+            clipFC = os.path.join(workspace, row[0] + "_clip" + aoi['suffix'])
+
+            if isBatch:
+                if row[12] is not None:
+                    aoiCount = engine.selectWithinDistance(selectedLyr, aoi['processedAOI'], row[12])
                 else:
-                    collectFeatsCountDict[row[1]].update(newDict)
-      
+                    aoiCount = engine.selectByIntersect(selectedLyr, aoi['processedAOI'])
+                if aoiCount == 0:
+                    continue
+
+                # Each AOI is clipped from its own part of the batch selection, not from every selected feature
+                clipInput = selectedFC + "_aoi"
+                with trace.stage('exportAOI', aoi=str(aoiKey), features=aoiCount):
+                    engine.copyFeatures(selectedLyr, clipInput)
+                log("    Clipping Select Features with AOI " + str(aoiKey))
+            elif shapeType == "Multipoint":
+                clipInput = selectedFC
+                log("    Clipping selected features with AOI")
+            else:
+                clipInput = selectedFC
+                log("    Clipping Select Features with AOI")
+
+            # Buffered layers are clipped against a buffer of the AOI, made the first time a clip needs it
+            if row[12] is not None:
+                clipAOI = bufferCache.get(engine, aoi['processedAOI'], row[12], log)
+            else:
+                clipAOI = aoi['processedAOI']
+
+            if fieldsorted is not None:
+                log("    Sorting rows...")
+
+            # The clipped layer is written once, with its overlap measures and in its sort order
+            with trace.stage('clipWithMeasures', aoi=str(aoiKey) if aoiKey is not None else None) as record:
+                workspaceBytes = workspaceSize(workspace)
+                engine.clipWithMeasures(clipInput, clipAOI, clipFC, shapeType, aoi['hectares'], fieldsorted)
+                layerResult[aoiKey] = (clipFC, engine.getCount(clipFC))
+                record['features'] = layerResult[aoiKey][1]
+                record['bytes'] = workspaceSize(workspace) - workspaceBytes
+
+            if clipInput != selectedFC:
+                engine.delete(clipInput)
+
+        if isBatch:
+            engine.delete("selectedLyr")
+
+        engine.delete(selectedFC)
+          
+    else:
+        log("    No Overlap Found")
+
+    return layerResult
+
+
+def sortFeatsCountDict(collectFeatsCountDict):
+    '''
+    A function to put the layer counts in report order: Mineral/Coal tenures, then reserves, then other
+    mining layers, followed by every other category sorted by layer name
+    '''
 
     tenureDict = {}
     reserveDict = {}
     remainingMiningDict = {}
-    remaningLayers = {}
     
-    for category, values in sorted(collectFeatsCountDict.iteritems()):
+    for category, values in sorted(collectFeatsCountDict.items()):
         if category == 'Mineral/Coal':
             for fClass, fItems in values.items():
                 if 'Tenure - ' in fClass:
@@ -553,17 +1068,13 @@ def processData(processedAOI, processedAOI_Hectares, IOR_Data, IORData_Fields, o
 
     featsCountDict = OrderedDict(itertools.chain(sorted(tenureDict.items()), sorted(reserveDict.items()), sorted(remainingMiningDict.items())))
     
-    for key, value in collectFeatsCountDict.iteritems():
+    for key, value in collectFeatsCountDict.items():
         if key == 'Mineral/Coal':
             collectFeatsCountDict[key] = featsCountDict
         else:
             collectFeatsCountDict[key] = OrderedDict(sorted(value.items())) 
-              
-    arcpy.AddMessage('    ')
-    arcpy.AddMessage('Data Processed...')
-    arcpy.AddMessage('===============================================================================')
     
-    return layerListDict, collectFeatsCountDict
+    return collectFeatsCountDict
 
 
 def sheetCells(sheet, excelrow, excelcol, value="", size=10, bold=False, italic=False, underline=False, fontcolor=0, fillcolor=0, wrap=False, numFormat=None):
@@ -571,79 +1082,34 @@ def sheetCells(sheet, excelrow, excelcol, value="", size=10, bold=False, italic=
     A function to format cells in each sheet
     '''
 
-    if isinstance(value, int):
-        value = int(value)
-        numFormat = 0
-    elif isinstance(value, float):
-        value = float(value)
-        numFormat = '0.' + '0' * 3
-    elif isinstance(value, (str, unicode)):
-        if value.isdigit():
-            value = int(value)
-            numFormat = 0
-        else:
-            try:
-                float(value)
-                value = float(value)
-            except:
-                value = value.encode('utf-8')
-    elif isinstance(value, datetime.datetime):
-        if value < datetime.datetime.strptime('01 01 1900', '%m %d %Y'):
-            dateSplit = str(datetime.datetime.strptime(str(value.date()), '%Y-%m-%d').date()).split('-')
-            value  = dateSplit[0] + '-' + datetime.date(1900, datetime.datetime.strptime(dateSplit[1], '%m').date().month, 1).strftime('%b') + '-' + dateSplit[2]
-        else:
-            numFormat = "yyyy-mmm-dd"
-
-    sheet.Cells(excelrow, excelcol).Value = value
-    sheet.Cells(excelrow, excelcol).Font.Name = 'BC Sans'
-    sheet.Cells(excelrow, excelcol).Font.Size = size
-    sheet.Cells(excelrow, excelcol).Font.Bold = bold
-    sheet.Cells(excelrow, excelcol).Font.Italic = italic
-    sheet.Cells(excelrow, excelcol).Font.Underline = underline
-    sheet.Cells(excelrow, excelcol).Font.ColorIndex = fontcolor
-    sheet.Cells(excelrow, excelcol).Interior.ColorIndex = fillcolor
-    sheet.Cells(excelrow, excelcol).WrapText = wrap
-    sheet.Cells(excelrow, excelcol).NumberFormat = numFormat
-    sheet.Cells(excelrow, excelcol).HorizontalAlignment = win32com.client.constants.xlRight
-
-##    numFormat=None
+    sheet.cell(excelrow, excelcol, value, size, bold, italic, underline, fontcolor, fillcolor, wrap, numFormat)
     
     
-def initializeSpreadsheet():
+def initializeSpreadsheet(writerName=None, sheetNames=('Summary', 'Interest_Report', 'Districts_and_BCGS-NTS_Location', 'Input_Information')):
     '''
-    A function to create an empty spreadsheet, add 4 required sheets and name them
+    A function to create an empty spreadsheet, add the required sheets (4 for a full report) and name them
     '''
-    arcpy.AddMessage("Initializing spreadsheet...")
-    
-    excel = win32com.client.gencache.EnsureDispatch("Excel.Application")
-    excel.Visible = True
-    
-    # Initialize a workbook within excel
-    book = excel.Workbooks.Add()
+    addMessage("Initializing spreadsheet...")
     
-    if book.Sheets.Count != 4:
-        for i in range(book.Sheets.Count, 4):
-            arcpy.AddMessage(i)
-            book.Sheets.Add()
+    # Initialize a workbook through the report writer (xlsx file or Excel)
+    book = getReportWriter(writerName)
     
-    # Set first sheet in book and rename it for the report
-    book.Worksheets(1).Name = 'Summary'
-    book.Worksheets(2).Name = 'Interest_Report'
-    book.Worksheets(3).Name = 'Districts_and_BCGS-NTS_Location'
-    book.Worksheets(4).Name = 'Input_Information'
+    for name in sheetNames:
+        book.addSheet(name)
 
-    return book, excel    
+    return book
 
-def createInterestReportSheet(book, layerListDict, appsDict, output_folder):
+def createInterestReportSheet(book, layerListDict, appsDict, output_folder, engine, catalog=None, schemas=None):
     '''
     A function to process data and populate an interest report sheet that provides details of each feature
-    in each overlapping layer
+    in each overlapping layer. With a catalog and SchemaCache, the fields of each layer's clips are only
+    listed the first time they are needed.
     '''    
 
-    arcpy.AddMessage("Creating Interest Report Detail sheet...")
+    addMessage("Creating Interest Report Detail sheet...")
     
-    sheet = book.Worksheets("Interest_Report")
-    sheet.Activate()
+    sheet = book.sheet("Interest_Report")
+    sheet.activate()
     
     excelrow = 1
     excelcol = 1
@@ -664,7 +1130,7 @@ def createInterestReportSheet(book, layerListDict, appsDict, output_folder):
     sheetCells(sheet, excelrow, excelcol, "", None, False, False, False, None, 37)
     sheetCells(sheet, excelrow, excelcol + 1, "Overlapping Layer", 10, True)
     
-    sheet.Range(sheet.Cells(excelrow - 1, excelcol),sheet.Cells(excelrow,excelcol + 1)).BorderAround() 
+    sheet.borderAround(excelrow - 1, excelcol, excelrow, excelcol + 1)
     
     excelrow += 2
     
@@ -707,13 +1173,11 @@ def createInterestReportSheet(book, layerListDict, appsDict, output_folder):
          
     processedlayerListDict = itertools.chain(mineralcoal.items(), sorted(otherLayersDict.items()))
     
-    env.workspace = output_folder + "\\" + scratchGDB
-        
     catList = []
 
     for category, values in processedlayerListDict:
         
-        arcpy.AddMessage("    Writing detail information from " + str(category) + " category...")
+        addMessage("    Writing detail information from " + str(category) + " category...")
 
         catList.append(category)
         
@@ -723,7 +1187,7 @@ def createInterestReportSheet(book, layerListDict, appsDict, output_folder):
 
         for Fclass, listItems in values:
             
-            arcpy.AddMessage("      Writing detail information from " + str(Fclass) + " layer...")
+            addMessage("      Writing detail information from " + str(Fclass) + " layer...")
             
             if listItems[1] != 'None':
                 sheetCells(sheet, excelrow, excelcol, '=HYPERLINK("{0}","{1}")'.format(listItems[1], Fclass), 10, False, False, True, None)
@@ -736,41 +1200,43 @@ def createInterestReportSheet(book, layerListDict, appsDict, output_folder):
             
             if listItems[0] != 'No Overlap Found':
 
-                for fc in arcpy.ListFeatureClasses():
+                # Clipped layers are referenced by their full path, as pool workers each write to their own workspace
+                fc = listItems[0]
 
-                    if fc == listItems[0]:
-                        fields = [field for field in arcpy.ListFields(fc) if not field.required]
-                        excelcol = 2
+                if engine.exists(fc):
+                    if schemas is not None and catalog is not None:
+                        fields = [field for field in schemas.clipFields(engine, catalog.layer(Fclass), fc) if not field.required]
+                    else:
+                        fields = [field for field in engine.listFields(fc) if not field.required]
+                    excelcol = 2
 
-                        for field in fields:
-                            sheetCells(sheet, excelrow, excelcol, field.aliasName, 8, True, False, False, None, 37)
-                            excelcol += 1
-                            
-                        excelrow += 1
-                        excelcol = 2
-                        grouprow = excelrow
-                        fieldNames = [str(field.name) for field in fields]
-
-                        for row in arcpy.da.SearchCursor(fc, fieldNames):
-
-                            for index, item in enumerate(row):
-                                if listItems[3] != 'None':
-                                    ind = fieldNames.index(listItems[3])
-                                    appURL = [v for k,v in appDict.iteritems() if k == listItems[2]][0]
-                                    if index == ind:                                 
-                                        sheetCells(sheet, excelrow, excelcol, '=HYPERLINK("{0}","{1}")'.format(appURL.format(str(item)), item), 8, False, False, False, None, numFormat=0)
-                                    else:
-                                        sheetCells(sheet, excelrow, excelcol, item, 8, False, False, False, None, numFormat=0)
+                    for field in fields:
+                        sheetCells(sheet, excelrow, excelcol, field.aliasName, 8, True, False, False, None, 37)
+                        excelcol += 1
+                        
+                    excelrow += 1
+                    excelcol = 2
+                    grouprow = excelrow
+                    fieldNames = [str(field.name) for field in fields]
+
+                    for row in engine.readTable(fc, fieldNames):
+
+                        for index, item in enumerate(row):
+                            if listItems[3] != 'None':
+                                ind = fieldNames.index(listItems[3])
+                                appURL = [v for k,v in appsDict.items() if k == listItems[2]][0]
+                                if index == ind:                                 
+                                    sheetCells(sheet, excelrow, excelcol, '=HYPERLINK("{0}","{1}")'.format(appURL.format(str(item)), item), 8, False, False, False, None, numFormat=0)
                                 else:
                                     sheetCells(sheet, excelrow, excelcol, item, 8, False, False, False, None, numFormat=0)
-                                excelcol += 1                               
-                                
-                            excelcol = 2
-                            excelrow += 1
+                            else:
+                                sheetCells(sheet, excelrow, excelcol, item, 8, False, False, False, None, numFormat=0)
+                            excelcol += 1                               
                             
-                        sheet.Range(sheet.Rows(grouprow), sheet.Rows(excelrow-1)).Rows.Group()
-                        sheet.Outline.SummaryRow = win32com.client.constants.xlAbove
-                        sheet.Outline.ShowLevels(RowLevels=2)  
+                        excelcol = 2
+                        excelrow += 1
+                        
+                    sheet.groupRows(grouprow, excelrow-1)
 
 
             else:
@@ -793,28 +1259,30 @@ def createInterestReportSheet(book, layerListDict, appsDict, output_folder):
         sheetCells(sheet, legendrow, excelcol, '=HYPERLINK("#"&CELL("address",INDEX(A{0}:A{1},MATCH("{2}",A{0}:A{1},0),1)), "{3}")'.format(legendsearchrow, excelrow, category, "Go to " + category + " category"), 10, False, False, True, None)
         legendrow += 1
 
-    sheet.Columns.AutoFit()
-    sheet.Cells(1, 1).Select()
+    sheet.autoFitColumns()
+    sheet.select(1, 1)
     
     return crossReferenceDict
 
 
-def createSummarySheet(book, excel, processedAOI, processedAOI_Hectares, collectFeatsCountDict, iMapBCBaseURL, crossReferenceDict, geoMark_URL):
+def createSummarySheet(book, processedAOI, processedAOI_Hectares, collectFeatsCountDict, iMapBCBaseURL, crossReferenceDict, geoMark_URL, engine):
     ''' 
-    A function to process data and create a count summary of the mining layer overlaps
+    A function to process data and create a count summary of the mining layer overlaps. Without a
+    crossReferenceDict (a quick screen, with no Interest Report sheet) the layers are not linked to their
+    details, and each category is marked as overlapping the AOI or not.
     '''
     
-    arcpy.AddMessage("Creating summary sheet...")
+    addMessage("Creating summary sheet...")
     
-    sheet = book.Worksheets('Summary')
-    sheet.Activate()
+    sheet = book.sheet('Summary')
+    sheet.activate()
     
-    excel.ActiveWindow.DisplayGridlines = False
+    sheet.hideGridlines()
     
     excelrow = 1
     excelcol = 1
     
-    arcpy.AddMessage("  Adding summary sheet headers and inserting imagery...")
+    addMessage("  Adding summary sheet headers and inserting imagery...")
     
     #Set Report Header Title   
     sheetCells(sheet, excelrow, excelcol, "INTEREST OVERLAP REPORT - SUMMARY", 16, True)
@@ -825,35 +1293,17 @@ def createSummarySheet(book, excel, processedAOI, processedAOI_Hectares, collect
     # Set a comment to indicate when the report was run and do some formatting    
     sheetCells(sheet, excelrow + 2, excelcol, "Report run on and data current as of: " + time.strftime('%b %d, %Y') + " @ " + time.strftime('%I:%M:%S'), 10)   
         
-    # Add BC Government logo
-    pic = sheet.Pictures().Insert(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Image\BC_MCM_H_RGB_pos.png")
-    
-    # Format size of the logo    
-    pic.Height = 65
-    pic.Width = 130
-    
-    # Format location of the logo
-    cell = sheet.Cells(excelrow, excelcol + 1)
-    pic.Left = cell.Left
-    pic.Top = cell.Top
+    # Add BC Government logo, sized 130 x 65 and placed at the top of the second column
+    sheet.insertPicture(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Image\BC_MCM_H_RGB_pos.png", excelrow, excelcol + 1, 65, 130)
        
     excelrow = 1
 
-    # Add overlap example image to the report and set size and location
-    pic = sheet.Pictures().Insert(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Image\Overlap_Example.JPG")
-    
-    # Format size of the logo
-    pic.Height = 390
-    pic.Width = 190
-    
-    # Format location of the logo
-    cell = sheet.Cells(excelrow,3)
-    pic.Left = cell.Left + 40
-    pic.Top = cell.Top
+    # Add overlap example image to the report and set size and location (40 points right of the third column)
+    sheet.insertPicture(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Image\Overlap_Example.JPG", excelrow, 3, 390, 190, 40)
     
     excelrow = 5
     
-    arcpy.AddMessage("  Writing Area of Interest (AOI) Details...")
+    addMessage("  Writing Area of Interest (AOI) Details...")
         
     sheetCells(sheet, excelrow, excelcol, "AREA OF INTEREST INFORMATION", 10, bold=True, underline=True)
     
@@ -877,10 +1327,9 @@ def createSummarySheet(book, excel, processedAOI, processedAOI_Hectares, collect
         sheetCells(sheet, excelrow, excelcol + 1, format(processedAOI_Hectares, ","))
 
         # Do some formatting on the area of interest header information. Set the font size, border, fill color and alignment
-        sheet.Range(sheet.Cells(staticexcelrow, excelcol),sheet.Cells(excelrow, excelcol + 1)).Font.Size = 10
-        sheet.Range(sheet.Cells(staticexcelrow, excelcol),sheet.Cells(excelrow, excelcol + 1)).BorderAround()
-        sheet.Range(sheet.Cells(staticexcelrow, excelcol),sheet.Cells(excelrow, excelcol + 1)).Interior.ColorIndex = 36
-        sheet.Range(sheet.Cells(staticexcelrow, excelcol + 1),sheet.Cells(excelrow, excelcol + 1)).HorizontalAlignment = win32com.client.constants.xlRight                            
+        sheet.formatRange(staticexcelrow, excelcol, excelrow, excelcol + 1, size=10, fillcolor=36)
+        sheet.borderAround(staticexcelrow, excelcol, excelrow, excelcol + 1)
+        sheet.formatRange(staticexcelrow, excelcol + 1, excelrow, excelcol + 1, alignRight=True)
         
         # Increment the row count by 2 for the position of the first overlapping layer
         excelrow += 1
@@ -898,7 +1347,7 @@ def createSummarySheet(book, excel, processedAOI, processedAOI_Hectares, collect
             
             # Loop through the area of interest file and add the value that corresponds to the field name
 
-            for shrow in arcpy.da.SearchCursor(processedAOI, [shField], sqlQuery):
+            for shrow in engine.readTable(processedAOI, [shField], sqlQuery):
                 sheetCells(sheet, excelrow, excelcol + 1, shrow[0], 10)
         
         excelrow += 1  
@@ -908,10 +1357,9 @@ def createSummarySheet(book, excel, processedAOI, processedAOI_Hectares, collect
         sheetCells(sheet, excelrow, excelcol + 1, format(processedAOI_Hectares, ","))
 
         # Do some formatting on the area of interest header information. Set the font size, border, fill color and alignment
-        sheet.Range(sheet.Cells(staticexcelrow, excelcol),sheet.Cells(excelrow, excelcol + 1)).Font.Size = 10
-        sheet.Range(sheet.Cells(staticexcelrow, excelcol),sheet.Cells(excelrow, excelcol + 1)).BorderAround()
-        sheet.Range(sheet.Cells(staticexcelrow, excelcol),sheet.Cells(excelrow, excelcol + 1)).Interior.ColorIndex = 36
-        sheet.Range(sheet.Cells(staticexcelrow, excelcol + 1),sheet.Cells(excelrow, excelcol + 1)).HorizontalAlignment = win32com.client.constants.xlRight                            
+        sheet.formatRange(staticexcelrow, excelcol, excelrow, excelcol + 1, size=10, fillcolor=36)
+        sheet.borderAround(staticexcelrow, excelcol, excelrow, excelcol + 1)
+        sheet.formatRange(staticexcelrow, excelcol + 1, excelrow, excelcol + 1, alignRight=True)
                 
         # Increment the row count by 2 for the position of the first overlapping layer
         excelrow += 1
@@ -919,54 +1367,68 @@ def createSummarySheet(book, excel, processedAOI, processedAOI_Hectares, collect
     
     excelrow += 1
     
-    sheetCells(sheet, excelrow, excelcol, '="Counts of Interest Overlaps" & CHAR(10) & "(See Interest Report Sheet for Details)"', 12, True, wrap=True)
+    if crossReferenceDict is not None:
+        sheetCells(sheet, excelrow, excelcol, '="Counts of Interest Overlaps" & CHAR(10) & "(See Interest Report Sheet for Details)"', 12, True, wrap=True)
+    else:
+        sheetCells(sheet, excelrow, excelcol, '="Counts of Interest Overlaps" & CHAR(10) & "(Quick Screen: features were not clipped)"', 12, True, wrap=True)
 
     excelrow += 2
     
     sheetCells(sheet, excelrow, excelcol, "Category", 11, True, fillcolor=15)
-    sheetCells(sheet, excelrow, excelcol + 1, "Layer Name  (click to view Interest Report details)", 11, True, fillcolor=15)
+    if crossReferenceDict is not None:
+        sheetCells(sheet, excelrow, excelcol + 1, "Layer Name  (click to view Interest Report details)", 11, True, fillcolor=15)
+    else:
+        sheetCells(sheet, excelrow, excelcol + 1, "Layer Name", 11, True, fillcolor=15)
     sheetCells(sheet, excelrow, excelcol + 2, "Count of Overlapping Features", 11, True, fillcolor=15)
     sheetCells(sheet, excelrow, excelcol + 3, "iMapBC Link", 11, True, fillcolor=15)
     sheetCells(sheet, excelrow, excelcol + 4, "Reviewer Comments", 11, True, fillcolor=15)
     
     excelrow += 2
 
-    for category, catList in collectFeatsCountDict.iteritems():
+    for category, catList in collectFeatsCountDict.items():
         
-        arcpy.AddMessage("  Writing summary information from " + str(category) + " category...")
+        addMessage("  Writing summary information from " + str(category) + " category...")
         
         sheetCells(sheet, excelrow, excelcol, category, 10, True)
+
+        # A quick screen lists the layers that do not overlap too, so say whether anything in the category does
+        if crossReferenceDict is None:
+            sheetCells(sheet, excelrow, excelcol + 2, "Yes" if any(FclassValues[0] != 0 for FclassValues in catList.values()) else "No", 10, True)
+
         excelrow += 1
         
-        for Fclass, FclassValues in catList.iteritems():
+        for Fclass, FclassValues in catList.items():
             
-            arcpy.AddMessage("    Writing summary information from " + str(Fclass) + " layer...")
+            addMessage("    Writing summary information from " + str(Fclass) + " layer...")
             
-            if FclassValues[1] is not None:
-                sheetCells(sheet, excelrow, excelcol + 1, '=HYPERLINK(CELL("address",Interest_Report!A{0}),"{1}")'.format(crossReferenceDict[Fclass], [k for k in crossReferenceDict.keys() if k == Fclass][0]), 10, False, False, True, None)
-                sheetCells(sheet, excelrow, excelcol + 3, '=HYPERLINK("{0}","{1}")'.format(iMapBCBaseURL + '&catalogLayers=' + FclassValues[1], 'View in iMapBC'), 10, False, False, True, None)
+            if crossReferenceDict is None:
+                sheetCells(sheet, excelrow, excelcol + 1, Fclass, 10)
             else:
                 sheetCells(sheet, excelrow, excelcol + 1, '=HYPERLINK(CELL("address",Interest_Report!A{0}),"{1}")'.format(crossReferenceDict[Fclass], [k for k in crossReferenceDict.keys() if k == Fclass][0]), 10, False, False, True, None)
-            sheetCells(sheet, excelrow, excelcol + 2, FclassValues[0], 10, True)
+            if FclassValues[1] is not None and FclassValues[0] != 0:
+                sheetCells(sheet, excelrow, excelcol + 3, '=HYPERLINK("{0}","{1}")'.format(iMapBCBaseURL + '&catalogLayers=' + FclassValues[1], 'View in iMapBC'), 10, False, False, True, None)
+
+            # A layer screened up to its first overlapping feature has no count
+            sheetCells(sheet, excelrow, excelcol + 2, FclassValues[0] if FclassValues[0] is not None else "Yes", 10, True)
             excelrow += 1
 
         excelrow +=1    
     
-    sheet.Columns.AutoFit()
-    sheet.Rows.AutoFit()
-    sheet.Cells(1, 1).Select()
+    sheet.autoFitColumns()
+    sheet.autoFitRows()
+    sheet.select(1, 1)
 
 
-def createDistrictSheet(book, IOR_Data, IORData_Fields, processedAOI):
+def createDistrictSheet(book, catalog, processedAOI, engine, snapshots=None):
     ''' 
     A function to analyze various district types and maps sheets that overlaps the AOI
     A separate sheet is created and populated with the overlaps.
     '''    
      
-    arcpy.AddMessage("Creating district information...")    
+    addMessage("Creating district information...")    
          
-    sheet = book.Worksheets("Districts_and_BCGS-NTS_Location")
-    sheet.Activate()
+    sheet = book.sheet("Districts_and_BCGS-NTS_Location")
+    sheet.activate()
      
     excelrow = 1
     excelcol = 1
@@ -976,54 +1438,44 @@ def createDistrictSheet(book, IOR_Data, IORData_Fields, processedAOI):
      
     excelrow += 1
      
-    for row in arcpy.da.SearchCursor(IOR_Data, IORData_Fields):
-        if row[1] == 'District':
-                 
-            sheetCells(sheet, excelrow, excelcol, '=HYPERLINK("{0}","{1}")'.format(str(row[28]), str(row[2])), 10, False, False, True, None)
-              
-            excelrow += 1
-
-            # Set a variable to pull out the full path of the shapefile or FC and set a variable to the source name         
-            if row[4] == 'BCGW':
-                dataSourcePath = os.path.join(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Interim_Files", getuser(), "BCGW.sde", row[5])
-            elif row[4] == 'MTOPROD':
-                dataSourcePath = os.path.join(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Interim_Files", getuser(), "MTOPROD.sde", row[5])
-            else:
-                dataSourcePath = os.path.join(row[4], row[5])    
+    for row in catalog.category('District'):
              
-            # Delete feature Layer. Need to do this because it will hang on the next loop.
-            if arcpy.Exists("district"):
-                delFeatLayer("district")
-            else:
-                pass       
+        sheetCells(sheet, excelrow, excelcol, '=HYPERLINK("{0}","{1}")'.format(str(row[28]), str(row[2])), 10, False, False, True, None)
+          
+        excelrow += 1
 
-            # Create feature layer in order to apply a definition query to the dataset
-            arcpy.MakeFeatureLayer_management(dataSourcePath, "district")
-              
-            # Create a select by location to test for overlap.                                
-            selFeats = arcpy.SelectLayerByLocation_management("district", "intersect", processedAOI)
-              
-            # Test to see if there are any records within each selected feature class
-            # If it is zero, then let's output the layer name and a message indicating "No Overlap Found"
-            # We'll also do some formatting on the cells                                
-            if int(arcpy.GetCount_management(selFeats).getOutput(0)) == 0:
-                sheetCells(sheet, excelrow, excelcol, "NA")
-            else:
-                with arcpy.da.SearchCursor("district", row[14]) as cursor:
-                    for rowDistrict in cursor:
-                        sheetCells(sheet, excelrow, excelcol, rowDistrict[0])
-                        excelrow += 1
+        # Set a variable to pull out the full path of the shapefile or FC and set a variable to the source name         
+        if snapshots is not None:
+            dataSourcePath = snapshots.resolve(row, engine)[0]
+        else:
+            dataSourcePath = engine.sourcePath(row[4], row[5])
+
+        # Create feature layer in order to apply a definition query to the dataset
+        district = engine.makeLayer(dataSourcePath, "district")
+          
+        # Create a select by location to test for overlap.                                
+        selectcount = engine.selectByIntersect(district, processedAOI)
+          
+        # Test to see if there are any records within each selected feature class
+        # If it is zero, then let's output the layer name and a message indicating "No Overlap Found"
+        # We'll also do some formatting on the cells                                
+        if selectcount == 0:
+            sheetCells(sheet, excelrow, excelcol, "NA")
+        else:
+            for rowDistrict in engine.readTable(district, [row[14]]):
+                sheetCells(sheet, excelrow, excelcol, rowDistrict[0])
+                excelrow += 1
      
-            if excelrow > excelrowCount:
-                excelrowCount = excelrow
+        if excelrow > excelrowCount:
+            excelrowCount = excelrow
  
-            excelcol += 1
-                        
-            # Delete feature Layer. Need to do this because it will hang on the next loop.
-            delFeatLayer("district")
-                 
-            excelrow = 2
+        excelcol += 1
                     
+        # Delete feature Layer. Need to do this because it will hang on the next loop.
+        engine.delete("district")
+             
+        excelrow = 2
+                
     excelrow = excelrowCount
     excelrow += 2
      
@@ -1031,69 +1483,60 @@ def createDistrictSheet(book, IOR_Data, IORData_Fields, processedAOI):
      
     sheetCells(sheet, excelrow, excelcol, "Location", 13, True, False, True)
      
-    locationList = []
-      
-    for row in arcpy.da.SearchCursor(IOR_Data, IORData_Fields):
-        if row[1] == 'Location':
-            locationList.append(row[2])
-      
     excelrow += 1
       
     staticexcelrow = excelrow
       
-    for row in arcpy.da.SearchCursor(IOR_Data, IORData_Fields):
-        if row[2] in sorted(locationList):
-             
-            excelrow = staticexcelrow
-             
-            sheetCells(sheet, excelrow, excelcol, '=HYPERLINK("{0}","{1}")'.format(str(row[28]), str(row[2])), 10, False, False, True, None)
+    for row in catalog.category('Location'):
+         
+        excelrow = staticexcelrow
+         
+        sheetCells(sheet, excelrow, excelcol, '=HYPERLINK("{0}","{1}")'.format(str(row[28]), str(row[2])), 10, False, False, True, None)
        
-            excelrow += 1
-               
-            # Set a variable to pull out the full path of the shapefile or FC and set a variable to the source name
-            if row[4] == 'BCGW':
-                dataSourcePath = os.path.join(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Interim_Files", getuser(), "BCGW.sde", row[5])
-            elif row[4] == 'MTOPROD':
-                dataSourcePath = os.path.join(r"\\spatialfiles.bcgov\Work\em\vic\mtb\Local\MTB_Scripts\MTB_Tools\Reporting_Tools\Interest_Overlap_Report\Interim_Files", getuser(), "MTOPROD.sde", row[5])
-            else:
-                dataSourcePath = os.path.join(row[4], row[5])            
- 
-            # Delete feature layer
-            delFeatLayer("locale")       
+        excelrow += 1
+           
+        # Set a variable to pull out the full path of the shapefile or FC and set a variable to the source name
+        if snapshots is not None:
+            dataSourcePath = snapshots.resolve(row, engine)[0]
+        else:
+            dataSourcePath = engine.sourcePath(row[4], row[5])
        
-            # Create feature layer in order to apply a definition query to the dataset
-            arcpy.MakeFeatureLayer_management(dataSourcePath, "locale")
-               
-            # Create a select by location to test for overlap.                                
-            selFeats = arcpy.SelectLayerByLocation_management("locale", "intersect", processedAOI)
-
-            with arcpy.da.SearchCursor("locale", row[14]) as cursor:
-                for rowDistrict in cursor:
-                    sheetCells(sheet, excelrow, excelcol, rowDistrict[0])
-                    excelrow += 1
-                   
-            excelcol += 1
+        # Create feature layer in order to apply a definition query to the dataset
+        locale = engine.makeLayer(dataSourcePath, "locale")
+           
+        # Create a select by location to test for overlap.                                
+        engine.selectByIntersect(locale, processedAOI)
+
+        for rowDistrict in engine.readTable(locale, [row[14]]):
+            sheetCells(sheet, excelrow, excelcol, rowDistrict[0])
             excelrow += 1
-             
-    sheet.Columns.AutoFit()
-    sheet.Cells(1, 1).Select()
+               
+        excelcol += 1
+        excelrow += 1
+         
+    sheet.autoFitColumns()
+    sheet.select(1, 1)
         
     
-def createMetadataSheet(book, scratchFolder, scratchGDB):
+def createMetadataSheet(book, scratchFolder, scratchGDB, catalog):
     '''
     A function to update the 'Input Information' sheet with parameter input information as set by the user
     '''
     
-    arcpy.AddMessage("Creating metadata sheet...")
+    addMessage("Creating metadata sheet...")
     
-    sheet = book.Worksheets("Input_Information")
-    sheet.Activate()
+    sheet = book.sheet("Input_Information")
+    sheet.activate()
     
-    arcInstall = arcpy.GetInstallInfo()
+    if arcpy is not None:
+        arcInstall = arcpy.GetInstallInfo()
 
-    for key, value in list(arcInstall.items()):
+        for key, value in list(arcInstall.items()):
+            sheetCells(sheet, 1, 1, "Run on ArcGIS version: ", 10, True)
+            sheetCells(sheet, 1, 2, arcInstall['ProductName'] + ': ' + arcInstall['Version'])
+    else:
         sheetCells(sheet, 1, 1, "Run on ArcGIS version: ", 10, True)
-        sheetCells(sheet, 1, 2, arcInstall['ProductName'] + ': ' + arcInstall['Version'])
+        sheetCells(sheet, 1, 2, "Not installed (run headless)")
 
     sheetCells(sheet, 2, 1, "Input Feature Class for Area of Interest:", 10, True)
     sheetCells(sheet, 2, 2, AOI)
@@ -1108,7 +1551,7 @@ def createMetadataSheet(book, scratchFolder, scratchGDB):
     sheetCells(sheet, 4, 2, output_excel) 
     
     sheetCells(sheet, 5, 1, "Configuration Excel Spreadsheet Location:", 10, True)
-    sheetCells(sheet, 5, 2, IOR_Data)
+    sheetCells(sheet, 5, 2, catalog.xls)
     
     sheetCells(sheet, 6, 1, "Scratch Geodatabase Location:", 10, True)
     sheetCells(sheet, 6, 2, scratchFolder + "\\" + scratchGDB)
@@ -1121,11 +1564,146 @@ def createMetadataSheet(book, scratchFolder, scratchGDB):
     for lyr in layerList:
         sheetCells(sheet, row, 2, lyr)
         row += 1
+
+    # Time taken by each stage of the run so far, from the run trace (IOR_Run_Trace.py)
+    row += 1
+    sheetCells(sheet, row, 1, "Performance:", 10, True)
+    for col, heading in enumerate(["Stage", "Calls", "Seconds", "Features", "Bytes Written"], 2):
+        sheetCells(sheet, row, col, heading, 10, True)
+
+    for stage, total in runTrace.totals().items():
+        row += 1
+        sheetCells(sheet, row, 2, stage)
+        sheetCells(sheet, row, 3, total['calls'])
+        sheetCells(sheet, row, 4, round(total['seconds'], 2))
+        sheetCells(sheet, row, 5, total['features'])
+        sheetCells(sheet, row, 6, total['bytes'])
+
+    row += 2
+    sheetCells(sheet, row, 1, "Slowest Layers:", 10, True)
+    for col, heading in enumerate(["Layer", "Seconds", "Features"], 2):
+        sheetCells(sheet, row, col, heading, 10, True)
+
+    for layer, seconds, features in runTrace.slowestLayers():
+        row += 1
+        sheetCells(sheet, row, 2, layer)
+        sheetCells(sheet, row, 3, round(seconds, 2))
+        sheetCells(sheet, row, 4, features)
     
-    sheet.Columns.AutoFit()
-    sheet.Rows.AutoFit()
-    sheet.Cells(1, 1).Select()
+    sheet.autoFitColumns()
+    sheet.autoFitRows()
+    sheet.select(1, 1)
     
+def createReport(reportName, processedAOI, processedAOI_Hectares, iMapBCBaseURL, geoMark_URL, layerListDict, collectFeatsCountDict, catalog, appDict, output_folder, scratchGDB, engine, snapshots=None, writerName=None,
+                 summaryOnly=False, schemas=None):
+    '''
+    A function to build, save and close the IOR workbook for one AOI. The workbook of a quick screen (summaryOnly)
+    has the Summary sheet alone. Returns the path of the saved workbook.
+    '''
+
+    if summaryOnly:
+        with runTrace.stage('initializeSpreadsheet', report=reportName):
+            book = initializeSpreadsheet(writerName, ['Summary'])
+
+        with runTrace.stage('createSummarySheet', report=reportName):
+            createSummarySheet(book, processedAOI, processedAOI_Hectares, collectFeatsCountDict, iMapBCBaseURL, None, geoMark_URL, engine)
+
+        reportName += "_Quick_Screen"
+
+    else:
+        # Initialize an excel worksheet for the report
+        with runTrace.stage('initializeSpreadsheet', report=reportName):
+            book = initializeSpreadsheet(writerName)
+
+        # Create the detailed Interest Report Sheet
+        with runTrace.stage('createInterestReportSheet', report=reportName):
+            crossReferenceDict = createInterestReportSheet(book, layerListDict, appDict, output_folder, engine, catalog, schemas)
+
+        # Create a summary sheet for the IOR
+        with runTrace.stage('createSummarySheet', report=reportName):
+            createSummarySheet(book, processedAOI, processedAOI_Hectares, collectFeatsCountDict, iMapBCBaseURL, crossReferenceDict, geoMark_URL, engine)
+
+        # Create a sheet that contains information about districts the AOI lies within
+        with runTrace.stage('createDistrictSheet', report=reportName):
+            createDistrictSheet(book, catalog, processedAOI, engine, snapshots)
+
+        # Create a metadata sheet to record user input information
+        with runTrace.stage('createMetadataSheet', report=reportName):
+            createMetadataSheet(book, output_excel, scratchGDB, catalog)
+
+    # Activate the Summary Sheet so when the sheet is initially opened, it opens on the Summary sheet
+    book.sheet("Summary").activate()
+
+    # Save and close the workbook
+    reportPath = os.path.join(output_excel, "Interest_report_" + reportName + "_" + time.strftime('%Y%b%d') + ".xlsx")
+    with runTrace.stage('saveWorkbook', report=reportName) as record:
+        book.save(reportPath)
+        record['bytes'] = os.path.getsize(reportPath) if os.path.exists(reportPath) else 0
+
+    return reportPath
+
+
+def createBatchSummaryWorkbook(batchField, aoiDict, results, reportPaths, writerName=None):
+    '''
+    A function to create one combined workbook for a batch run: a row per AOI with its area, a link to
+    its own report and the count of overlapping features for every layer in the run
+    '''
+
+    addMessage("Creating batch summary workbook...")
+
+    book = getReportWriter(writerName)
+    sheet = book.addSheet('Batch_Summary')
+
+    sheetCells(sheet, 1, 1, "INTEREST OVERLAP REPORT - BATCH SUMMARY", 16, True)
+    sheetCells(sheet, 2, 1, "REPORT FOR INTERNAL USE ONLY", 10, True, False, False, 3)
+    sheetCells(sheet, 3, 1, "Report run on and data current as of: " + time.strftime('%b %d, %Y') + " @ " + time.strftime('%I:%M:%S'), 10)
+
+    # Every layer that was processed, in report order
+    layerColumns = []
+    for layerListDict, collectFeatsCountDict in results.values():
+        for category, values in layerListDict.items():
+            for Fclass in values:
+                if (category, Fclass) not in layerColumns:
+                    layerColumns.append((category, Fclass))
+    layerColumns.sort()
+
+    excelrow = 5
+
+    sheetCells(sheet, excelrow, 1, batchField, 11, True, fillcolor=15)
+    sheetCells(sheet, excelrow, 2, "Area (ha)", 11, True, fillcolor=15)
+    sheetCells(sheet, excelrow, 3, "Report", 11, True, fillcolor=15)
+    sheetCells(sheet, excelrow, 4, "Overlapping Layers", 11, True, fillcolor=15)
+
+    for index, (category, Fclass) in enumerate(layerColumns):
+        sheetCells(sheet, excelrow, 5 + index, category + ": " + Fclass, 11, True, fillcolor=15, wrap=True)
+
+    for aoiKey, aoi in aoiDict.items():
+
+        excelrow += 1
+
+        layerListDict, collectFeatsCountDict = results[aoiKey]
+
+        sheetCells(sheet, excelrow, 1, str(aoiKey), 10, True)
+        sheetCells(sheet, excelrow, 2, format(aoi['hectares'], ","))
+        sheetCells(sheet, excelrow, 3, '=HYPERLINK("{0}","{1}")'.format(reportPaths[aoiKey], 'Open Report'), 10, False, False, True, None)
+        sheetCells(sheet, excelrow, 4, sum(1 for values in collectFeatsCountDict.values() for counts in values.values() if counts[0] != 0), 10, True)
+
+        # A layer screened up to its first overlapping feature has no count
+        for index, (category, Fclass) in enumerate(layerColumns):
+            count = collectFeatsCountDict.get(category, {}).get(Fclass, [0])[0]
+            sheetCells(sheet, excelrow, 5 + index, count if count is not None else "Yes", 10)
+
+    sheet.autoFitColumns()
+    sheet.select(1, 1)
+
+    reportPath = os.path.join(output_excel, "Interest_report_" + output_name + "_Batch_Summary_" + time.strftime('%Y%b%d') + ".xlsx")
+    with runTrace.stage('saveWorkbook', report=output_name + "_Batch_Summary") as record:
+        book.save(reportPath)
+        record['bytes'] = os.path.getsize(reportPath) if os.path.exists(reportPath) else 0
+
+    return reportPath
+
+
 def check_geomark(inFeatures, output_folder):
     '''
     This function takes input feature from a shapefile or
@@ -1294,7 +1872,7 @@ def url_encode(s):
     return str.replace(s2, '-', '%2B')
 
 def sign(message, key):
-    print key
+    print(key)
     key = bytes(key.encode('UTF-8'))
     message = bytes(message.encode('UTF-8'))
     digester = hmac.new(key, message, hashlib.sha1)
@@ -1317,69 +1895,173 @@ def removefromgroup(geomark_id, URL_BASE, GROUP, SECRET_KEY, TIMESTAMP):
     print("response is: ", response.json()) 
 
 
-# Log into BCGW and MTOPROD Oracle databases    
-login(username, mtoprodpassword, bcgwpassword)
+def tracePath():
+    '''
+    A function to return the path of the run trace of the tool parameters' report, next to its workbooks
+    '''
+    return os.path.join(output_excel, "IOR_Trace_" + output_name + "_" + time.strftime('%Y%b%d_%H%M%S') + ".jsonl")
+
 
-# Set scratch geodatabase
-output_folder, scratchGDB = createScratchGDB(output_GDB)
+def reportFeatureClasses(aois, results):
+    '''
+    A function to return the AOI feature classes and the clipped layers of every report of the run, in report
+    order, to be copied to the output folder
+    '''
+    featureClasses = []
+    for layerListDict, collectFeatsCountDict in results.values():
+        for layers in layerListDict.values():
+            featureClasses.extend(listItems[0] for listItems in layers.values() if listItems[0] != 'No Overlap Found')
 
-# Process AOI to determine feature count and area in hectares
-processedAOI, processedAOI_Hectares, iMapBCBaseURL = processAOI(AOI, output_folder, scratchGDB)
+    return list(OrderedDict.fromkeys(aois + featureClasses))
 
-#==================================================================================================================
-'''
-Commented out geomark until we decide how to best utilize this functionality
-'''
-# Run Geomark tool if enabled
-if createGeomark == True:
-    geoMark_URL = check_geomark(processedAOI, output_folder)
-else:
-    geoMark_URL = ''
 
-#===================================================================================================================
+def runReport(engine, trace=None):
+    '''
+    A function to run the report of the tool parameters with engine, once logged into BCGW and MTOPROD. Its stages
+    are timed in trace, or in a new trace next to the workbooks. Returns the paths of the report workbooks.
+    '''
+    global runTrace
+
+    # Time each stage of the report, down to each step of each layer
+    runTrace = trace if trace is not None else RunTrace(tracePath())
+    engine.trace = runTrace
+
+    # Select and clip against tiles of an AOI with more vertices than tileVertices
+    engine.tileVertices = tileVertices
+
+    # Read layers from the local snapshots kept by IOR_Snapshot_Cache.py unless live data was asked for
+    snapshots = SnapshotStore(useLive=useLiveData)
+
+    # Keep AOI buffers locally so a later run against the same AOI does not buffer it again
+    bufferFolder = defaultBufferFolder if reuseBuffers else None
+
+    # Keep layer results locally so a later run against the same AOI only processes the layers that changed
+    resultFolder = defaultResultFolder if reuseResults else None
+
+    # Read the fields and shape type of each layer once, and again only when its source changes
+    schemas = SchemaCache(defaultSchemaFolder, snapshots)
+
+    # Export the selected features of each layer to memory or to local disk, never to the network share
+    scratch = ScratchWorkspace('memory' if scratchInMemory else 'local')
+
+    # Set scratch geodatabase
+    with runTrace.stage('createScratchGDB'):
+        output_folder, scratchGDB = createScratchGDB(output_GDB, engine, incremental, resume)
+
+    # An incremental run only processes the layers whose inputs changed since they were clipped into the geodatabase
+    runManifest = RunManifest(os.path.join(output_folder, scratchGDB)) if incremental and output_GDB else None
+
+    # Record each layer as it finishes so a run that errors out can be resumed from the first unfinished layer
+    checkpoint = RunCheckpoint(os.path.join(output_folder, scratchGDB), {'AOI': AOI, 'sqlQuery': sqlQuery, 'batchField': batchField, 'engine': engine.name}, resume)
+
+    # Set the database option for mineral titles datasets (BCGW or MTOPROD)
+    with runTrace.stage('getXLSData') as record:
+        catalog, appDict = getXLSData(engine)
+        record['features'] = len(catalog.rows)
+
+    # Read and check the SQL templates of the query layers once for the run
+    loadTemplates(sqlFolder)
+
+    if batchField:
+
+        # Split the AOI into one AOI per batch field value
+        with runTrace.stage('processAOIBatch') as record:
+            batchAOI, aoiDict = processAOIBatch(AOI, sqlQuery, batchField, output_folder, scratchGDB, engine)
+            record['features'] = len(aoiDict)
+
+        if createGeomark == True:
+            addMessage("Geomarks are not created when running the IOR in batch mode")
+
+        # Process layers against every AOI in a single pass, or only count their overlaps in a quick screen
+        if quickScreen:
+            with runTrace.stage('screenData') as record:
+                results = screenData(aoiDict, catalog, layerList, engine, snapshots, stopAtFirstHit)
+                record['features'] = sum(counts[0] or 0 for layerListDict, collectFeatsCountDict in results.values() for layers in collectFeatsCountDict.values() for counts in layers.values())
+        else:
+            with runTrace.stage('processData') as record:
+                results = processDataBatch(batchAOI, aoiDict, catalog, output_folder, scratchGDB, layerList, engine, workers, snapshots=snapshots, bufferFolder=bufferFolder, resultFolder=resultFolder, runManifest=runManifest, checkpoint=checkpoint, schemas=schemas, scratch=scratch)
+                record['features'] = sum(counts[0] for layerListDict, collectFeatsCountDict in results.values() for layers in collectFeatsCountDict.values() for counts in layers.values())
+
+        # Create a report for each AOI and a combined summary of the batch
+        reportPaths = OrderedDict()
+        for aoiKey, aoi in aoiDict.items():
+            layerListDict, collectFeatsCountDict = results[aoiKey]
+            reportPaths[aoiKey] = createReport(output_name + "_" + re.sub(r'[^A-Za-z0-9_-]+', '_', str(aoiKey)), aoi['processedAOI'], aoi['hectares'], aoi['iMapBCBaseURL'], '',
+                                               layerListDict, collectFeatsCountDict, catalog, appDict, output_folder, scratchGDB, engine, snapshots, summaryOnly=quickScreen, schemas=schemas)
+
+        with runTrace.stage('createBatchSummaryWorkbook', features=len(aoiDict)):
+            reportPaths = list(reportPaths.values()) + [createBatchSummaryWorkbook(batchField, aoiDict, results, reportPaths)]
+
+        featureClasses = reportFeatureClasses([batchAOI] + [aoi['processedAOI'] for aoi in aoiDict.values()], results)
+
+    else:
+
+        # Process AOI to determine feature count and area in hectares
+        with runTrace.stage('processAOI', features=1):
+            processedAOI, processedAOI_Hectares, iMapBCBaseURL = processAOI(AOI, sqlQuery, output_folder, scratchGDB, engine)
+
+        #==================================================================================================================
+        '''
+        Commented out geomark until we decide how to best utilize this functionality
+        '''
+        # Run Geomark tool if enabled
+        # The geomark is written to the user's output folder, not the local scratch folder of the clipped layers
+        if createGeomark == True:
+            geoMark_URL = check_geomark(processedAOI, output_GDB or output_excel)
+        else:
+            geoMark_URL = ''
+
+        #===================================================================================================================
+
+        # Process layers against AOI, or only count their overlaps in a quick screen
+        if quickScreen:
+            with runTrace.stage('screenData') as record:
+                aoiDict = OrderedDict([(None, {'processedAOI': processedAOI, 'hectares': processedAOI_Hectares, 'suffix': ''})])
+                layerListDict, collectFeatsCountDict = screenData(aoiDict, catalog, layerList, engine, snapshots, stopAtFirstHit)[None]
+                record['features'] = sum(counts[0] or 0 for layers in collectFeatsCountDict.values() for counts in layers.values())
+        else:
+            with runTrace.stage('processData') as record:
+                layerListDict, collectFeatsCountDict = processData(processedAOI, processedAOI_Hectares, catalog, output_folder, scratchGDB, layerList, engine, workers, snapshots=snapshots, bufferFolder=bufferFolder, resultFolder=resultFolder, runManifest=runManifest, checkpoint=checkpoint, schemas=schemas, scratch=scratch)
+                record['features'] = sum(counts[0] for layers in collectFeatsCountDict.values() for counts in layers.values())
 
+        # Create, save and close the report
+        reportPaths = [createReport(output_name, processedAOI, processedAOI_Hectares, iMapBCBaseURL, geoMark_URL, layerListDict, collectFeatsCountDict,
+                                    catalog, appDict, output_folder, scratchGDB, engine, snapshots, summaryOnly=quickScreen, schemas=schemas)]
 
-# Set the database option for mineral titles datasets (BCGW or MTOPROD)
-IOR_Data, IORData_Fields, appDict = getXLSData()
+        featureClasses = reportFeatureClasses([processedAOI], {None: (layerListDict, collectFeatsCountDict)})
 
-# Process layers against AOI
-layerListDict, collectFeatsCountDict = processData(processedAOI, processedAOI_Hectares, IOR_Data, IORData_Fields, output_folder)
+    # The clipped layers were written locally, and are copied to the output folder in one go when one was given
+    if output_GDB and not quickScreen:
+        with runTrace.stage('flushWorkspace', features=len(featureClasses)) as record:
+            outWorkspace = flushWorkspace(engine, featureClasses, output_GDB, scratchGDB)
+            record['bytes'] = workspaceSize(outWorkspace)
+    elif not quickScreen:
+        addMessage("Clipped layers are kept in " + os.path.join(output_folder, scratchGDB))
 
-# #==================================================================================================================
-# '''
-# Commented out geomark until we decide how to best utilize this functionality
-# '''
-# # Run Geomark tool if enabled
-# if createGeomark == True:
-#     geoMark_URL = check_geomark(processedAOI, output_folder)
-# else:
-#     geoMark_URL = ''
-# 
-# #===================================================================================================================
+    scratch.clear(engine)
+    schemas.save()
 
-# Initialize an excel worksheet for the report
-book, excel = initializeSpreadsheet()
+    # The report is written, so there is nothing left to resume
+    checkpoint.remove()
 
-# Create the detailed Interest Report Sheet
-crossReferenceDict = createInterestReportSheet(book, layerListDict, appDict, output_folder)
+    return reportPaths
 
-# Create a summary sheet for the IOR
-createSummarySheet(book, excel, processedAOI, processedAOI_Hectares, collectFeatsCountDict, iMapBCBaseURL, crossReferenceDict, geoMark_URL)
 
-# Create a sheet that contains information about districts the AOI lies within
-createDistrictSheet(book, IOR_Data, IORData_Fields, processedAOI)
+if __name__ == '__main__':
 
-# Create a metadata sheet to record user input information
-createMetadataSheet(book, output_excel, scratchGDB)
+    # Hand the report to the local report service (IOR_Report_Service.py) only when Run On Report Service is
+    # checked and the service is logged in as the user. Its workers keep their connections to MTOPROD and BCGW
+    # open between reports, so the run skips logging in and out. Otherwise the tool logs in and runs the report.
+    if not useReportService or submitReport(reportParameters(), username) is None:
 
-# Activate the Summary Sheet so when the sheet is initially opened, it opens on the Summary sheet
-book.Worksheets("Summary").Activate()
+        runTrace = RunTrace(tracePath())
 
-# Save and close the workbook
-book.SaveAs(output_excel + "\\" + "Interest_report_" + output_name + "_" + time.strftime('%Y%b%d') + ".xlsx")
+        # Log into BCGW and MTOPROD Oracle databases
+        with runTrace.stage('login'):
+            login(username, mtoprodpassword, bcgwpassword)
 
-# Quit the instance of excel from the process list in Task Manager
-excel.Quit()
+        # The toolbox always runs on the DTS desktop with the arcpy geometry engine
+        runReport(getEngine('arcpy'), runTrace)
 
-# Logout and remove connection Files
-logout()
+        # Logout and remove connection Files
+        logout()
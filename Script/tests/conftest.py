@@ -0,0 +1,97 @@
+'''
+Shared fixtures of the IOR tests. The tests run on the shapely engine, so they need shapely, fiona, pyproj,
+numpy and openpyxl but no ArcGIS license. Feature classes are written to GeoPackages in a temporary folder.
+'''
+
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+## The local IOR folders (compiled catalogs, snapshots and caches) of a test session, not the user's
+os.environ['LOCALAPPDATA'] = tempfile.mkdtemp(prefix='ior_tests_')
+
+pyproj = pytest.importorskip('pyproj')
+pytest.importorskip('fiona')
+pytest.importorskip('shapely')
+
+from IOR_Geometry_Engine import getEngine
+
+## BC Albers, the spatial reference of every report
+albersWKT = pyproj.CRS.from_epsg(3005).to_wkt()
+
+
+## Columns of the IOR_Data sheet of the configuration spreadsheet
+layerListFields = ['GUID', 'Category', 'Featureclass_Name', 'Restricted', 'workspace_path', 'dataSource', 'shapeType',
+                   'Definition_Query', 'Query_Layer', 'Join_Table', 'dataSource_Join_Field', 'Join_Table_Field',
+                   'Buffer_Distance', 'Sort_Field'] + \
+                  ['Fields_to_Summarize' + (str(i) if i > 1 else '') for i in range(1, 14)] + \
+                  ['map_label_field', 'DataBC_Metadata_Record', 'layerID', 'pma_Layers', 'nencLayers', 'nwLayers',
+                   'scLayers', 'seLayers', 'swLayers', 'App', 'ParameterField']
+
+
+def catalogRow(guid, name, dataSource, definitionQuery=None, buffer=None, queryLayer=None, category='Test', fields=(), sort=None):
+    '''
+    A function to return a row of the configuration spreadsheet
+    '''
+    row = [None] * len(layerListFields)
+    row[0] = guid
+    row[1] = category
+    row[2] = name
+    row[4] = 'BCGW'
+    row[5] = dataSource
+    row[7] = definitionQuery
+    row[8] = queryLayer
+    row[12] = buffer
+    row[13] = sort
+    row[14:14 + len(fields)] = fields
+    row[29] = 'layer_' + guid
+    return tuple(row)
+
+
+class SnapshotVersions(object):
+    '''
+    The snapshot versions of a SnapshotStore, by dataSource
+    '''
+
+    def __init__(self, versions):
+        self.versions = versions
+
+    def sourceVersion(self, row, engine):
+        return self.versions.get(row[5])
+
+
+def writeLayerList(path, rows):
+    '''
+    A function to write rows to the IOR_Data sheet of a configuration spreadsheet, with an empty Apps sheet
+    '''
+    openpyxl = pytest.importorskip('openpyxl')
+
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.title = 'IOR_Data'
+    sheet.append(layerListFields)
+    for row in rows:
+        sheet.append(list(row))
+    book.create_sheet('Apps').append(['App', 'URL'])
+    book.save(path)
+    return path
+
+
+def writeFeatures(engine, path, geometryType, properties, features):
+    '''
+    A function to write [(properties, shapely geometry)] to the feature class at path
+    '''
+    return engine.write(path, {'geometry': geometryType, 'properties': properties}, albersWKT, features)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return getEngine('shapely', str(tmp_path / 'data'))
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    return str(tmp_path / 'scratch.gpkg')
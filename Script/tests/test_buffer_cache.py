@@ -0,0 +1,71 @@
+'''
+Keys and reuse of the AOI buffer cache
+'''
+
+import os
+import pytest
+from shapely.geometry import box
+from IOR_Buffer_Cache import BufferCache
+from conftest import writeFeatures
+
+
+def silent(message):
+    pass
+
+
+@pytest.fixture
+def aoi(engine, workspace):
+    return writeFeatures(engine, os.path.join(workspace, 'AOI'), 'Polygon', {'NAME': 'str'}, [({'NAME': 'A'}, box(0, 0, 100, 100))])
+
+
+def bounds(engine, features):
+    return engine.aoiGeometry(features).bounds
+
+
+def test_buffer_key_normalises_distance(engine, aoi):
+    cache = BufferCache()
+
+    outBuffer = cache.get(engine, aoi, 500, silent)
+
+    assert cache.get(engine, aoi, '500', silent) == outBuffer
+    assert cache.get(engine, aoi, 500.0, silent) == outBuffer
+    assert len(cache.buffers) == 1
+    assert outBuffer.endswith('_500_0m')
+    assert bounds(engine, outBuffer) == pytest.approx((-500, -500, 600, 600))
+
+
+def test_buffer_reused_between_runs(engine, aoi, tmp_path):
+    folder = str(tmp_path / 'buffers')
+    messages = []
+
+    first = BufferCache(persistFolder=folder)
+    outBuffer = first.get(engine, aoi, 250, messages.append)
+    first.clear(engine)
+
+    second = BufferCache(persistFolder=folder)
+    assert second.get(engine, aoi, 250.0, messages.append) == outBuffer
+    assert engine.exists(outBuffer)
+    assert messages == ["    Buffering AOI by 250 m", "    Reusing 250 m AOI buffer from a previous run"]
+
+
+def test_buffers_cleared(engine, aoi):
+    cache = BufferCache()
+    outBuffer = cache.get(engine, aoi, 100, silent)
+
+    # Buffers that are not kept for later runs are deleted with the cache
+    cache.clear(engine)
+
+    assert not engine.exists(outBuffer)
+    assert cache.buffers == {}
+
+
+def test_buffer_shared_with_workers(engine, aoi):
+    cache = BufferCache()
+    outBuffer = cache.get(engine, aoi, 100, silent)
+
+    shared = cache.shared()
+    shared.get(engine, aoi, 200, silent)
+
+    assert shared.get(engine, aoi, 100, silent) == outBuffer
+    assert len(cache.buffers) == 1
+    assert shared.persistFolder is None
@@ -0,0 +1,142 @@
+'''
+Select, clip and overlap measures of the shapely engine against geometries with known answers
+'''
+
+import os
+import pytest
+from shapely.geometry import box, LineString, Point
+from conftest import writeFeatures
+
+
+@pytest.fixture
+def aoi(engine, workspace):
+    # A one hectare AOI
+    return writeFeatures(engine, os.path.join(workspace, 'AOI'), 'Polygon', {'NAME': 'str'}, [({'NAME': 'A'}, box(0, 0, 100, 100))])
+
+
+def clipRecords(engine, clipFC, fields):
+    return sorted(engine.readTable(clipFC, fields))
+
+
+def test_select_by_intersect(engine, workspace, aoi):
+    features = writeFeatures(engine, os.path.join(workspace, 'PARCELS'), 'Polygon', {'ID': 'int'},
+                             [({'ID': 1}, box(50, 50, 150, 150)),
+                              ({'ID': 2}, box(20, 20, 40, 40)),
+                              ({'ID': 3}, box(300, 300, 400, 400))])
+
+    layer = engine.makeLayer(features, 'lyr')
+
+    assert engine.selectByIntersect(layer, aoi) == 2
+
+    # Only the selected features are exported
+    selectedFC = engine.copyFeatures(layer, os.path.join(workspace, 'PARCELS_selected'))
+    assert sorted(row[0] for row in engine.readTable(selectedFC, ['ID'])) == [1, 2]
+
+
+def test_select_within_distance(engine, workspace, aoi):
+    features = writeFeatures(engine, os.path.join(workspace, 'WELLS'), 'Point', {'ID': 'int'},
+                             [({'ID': 1}, Point(50, 50)),
+                              ({'ID': 2}, Point(140, 50)),
+                              ({'ID': 3}, Point(400, 50))])
+
+    layer = engine.makeLayer(features, 'lyr')
+
+    assert engine.selectWithinDistance(layer, aoi, 50) == 2
+    assert engine.selectWithinDistance(layer, aoi, 500) == 3
+
+
+def test_definition_query(engine, workspace, aoi):
+    features = writeFeatures(engine, os.path.join(workspace, 'PARCELS'), 'Polygon', {'ID': 'int', 'STATUS': 'str'},
+                             [({'ID': 1, 'STATUS': 'GOOD'}, box(10, 10, 20, 20)),
+                              ({'ID': 2, 'STATUS': 'BAD'}, box(30, 30, 40, 40))])
+
+    layer = engine.makeLayer(features, 'lyr', "STATUS = 'GOOD'")
+
+    assert engine.getCount(layer) == 1
+    assert engine.selectByIntersect(layer, aoi) == 1
+
+
+def test_polygon_measures(engine, workspace, aoi):
+    features = writeFeatures(engine, os.path.join(workspace, 'PARCELS'), 'Polygon', {'ID': 'int'},
+                             [({'ID': 1}, box(50, 50, 150, 150)),
+                              ({'ID': 2}, box(0, 0, 50, 100)),
+                              ({'ID': 3}, box(-100, -100, 200, 200))])
+
+    clipFC = engine.clipWithMeasures(features, aoi, os.path.join(workspace, 'PARCELS_clip'), 'Polygon', 1.0)
+
+    fields = ['ID', 'ORIGINAL_HECTARES', 'OVERLAPPING_HECTARES', 'PERCENT_OF_LAYER_BEING_OVERLAPPED_BY_AOI', 'PERCENT_OF_AOI_BEING_OVERLAPPED_BY_LAYER']
+    assert clipRecords(engine, clipFC, fields) == [(1, 1.0, 0.25, 25.0, 25.0),
+                                                   (2, 0.5, 0.5, 100.0, 50.0),
+                                                   (3, 9.0, 1.0, pytest.approx(11.111111), 100.0)]
+    assert engine.area(clipFC) == pytest.approx(10000 * 1.75)
+
+
+def test_clip_inside_covering_and_crossing(engine, workspace, aoi):
+    features = writeFeatures(engine, os.path.join(workspace, 'PARCELS'), 'Polygon', {'ID': 'int'},
+                             [({'ID': 1}, box(10, 10, 20, 20)),
+                              ({'ID': 2}, box(50, 50, 150, 150)),
+                              ({'ID': 3}, box(-100, -100, 200, 200)),
+                              ({'ID': 4}, box(0, 0, 100, 100))])
+
+    clipFC = engine.clipWithMeasures(features, aoi, os.path.join(workspace, 'PARCELS_clip'), 'Polygon', 1.0)
+
+    # A parcel the same as the AOI is both inside and covering it, and is written once
+    fields = ['ID', 'ORIGINAL_HECTARES', 'OVERLAPPING_HECTARES', 'PERCENT_OF_LAYER_BEING_OVERLAPPED_BY_AOI', 'PERCENT_OF_AOI_BEING_OVERLAPPED_BY_LAYER']
+    assert clipRecords(engine, clipFC, fields) == [(1, 0.01, 0.01, 100.0, 1.0),
+                                                   (2, 1.0, 0.25, 25.0, 25.0),
+                                                   (3, 9.0, 1.0, pytest.approx(11.111111), 100.0),
+                                                   (4, 1.0, 1.0, 100.0, 100.0)]
+    assert engine.area(clipFC) == pytest.approx(10000 * 2.26)
+
+
+def test_line_measures(engine, workspace, aoi):
+    features = writeFeatures(engine, os.path.join(workspace, 'ROADS'), 'LineString', {'ID': 'int'},
+                             [({'ID': 1}, LineString([(-50, 50), (150, 50)])),
+                              ({'ID': 2}, LineString([(10, 10), (10, 90)])),
+                              ({'ID': 3}, LineString([(-50, 200), (150, 200)]))])
+
+    clipFC = engine.clipWithMeasures(features, aoi, os.path.join(workspace, 'ROADS_clip'), 'Polyline', 1.0)
+
+    assert clipRecords(engine, clipFC, ['ID', 'ORIGINAL_LENGTH', 'OVERLAPPING_LENGTH']) == [(1, 0.2, 0.1), (2, 0.08, 0.08)]
+
+
+def test_point_measures(engine, workspace, aoi):
+    features = writeFeatures(engine, os.path.join(workspace, 'WELLS'), 'Point', {'ID': 'int'},
+                             [({'ID': 1}, Point(25, 75)),
+                              ({'ID': 2}, Point(250, 75))])
+
+    clipFC = engine.clipWithMeasures(features, aoi, os.path.join(workspace, 'WELLS_clip'), 'Point', 1.0)
+
+    assert clipRecords(engine, clipFC, ['ID', 'EASTING', 'NORTHING']) == [(1, 25.0, 75.0)]
+
+
+def test_clip_sort(engine, workspace, aoi):
+    features = writeFeatures(engine, os.path.join(workspace, 'PARCELS'), 'Polygon', {'ID': 'int'},
+                             [({'ID': i}, box(i * 10, 0, i * 10 + 10, 10)) for i in (3, 1, 2)])
+
+    clipFC = engine.clipWithMeasures(features, aoi, os.path.join(workspace, 'PARCELS_clip'), 'Polygon', 1.0, [['ID', 'DESCENDING']])
+
+    assert [row[0] for row in engine.readTable(clipFC, ['ID'])] == [3, 2, 1]
+
+
+def test_memory_workspace(engine, workspace, aoi):
+    features = writeFeatures(engine, os.path.join(workspace, 'PARCELS'), 'Polygon', {'ID': 'int'}, [({'ID': 1}, box(50, 50, 150, 150))])
+    clipFC = engine.clipWithMeasures(features, aoi, os.path.join(engine.memoryWorkspace, 'PARCELS_clip'), 'Polygon', 1.0)
+
+    assert engine.exists(clipFC)
+    assert engine.getCount(clipFC) == 1
+
+    engine.delete(clipFC)
+    assert not engine.exists(clipFC)
+
+
+def test_max_value(engine, workspace):
+    features = writeFeatures(engine, os.path.join(workspace, 'PARCELS'), 'Polygon', {'ID': 'int', 'STATUS': 'str', 'WHEN_UPDATED': 'datetime'},
+                             [({'ID': 1, 'STATUS': 'GOOD', 'WHEN_UPDATED': '2024-03-05T00:00:00'}, box(10, 10, 20, 20)),
+                              ({'ID': 2, 'STATUS': 'BAD', 'WHEN_UPDATED': '2024-07-01T00:00:00'}, box(30, 30, 40, 40)),
+                              ({'ID': 3, 'STATUS': 'GOOD', 'WHEN_UPDATED': None}, box(50, 50, 60, 60))])
+
+    # Features with no value are left out, and the definition query applies
+    assert str(engine.maxValue(features, 'WHEN_UPDATED')).startswith('2024-07-01')
+    assert str(engine.maxValue(features, 'WHEN_UPDATED', "STATUS = 'GOOD'")).startswith('2024-03-05')
+    assert engine.maxValue(features, 'WHEN_UPDATED', "ID = 3") is None
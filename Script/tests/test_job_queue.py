@@ -0,0 +1,78 @@
+'''
+Submitting, claiming and finishing the report service's jobs
+'''
+
+import threading
+import pytest
+from IOR_Job_Queue import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / 'service' / 'jobs.sqlite'))
+
+
+def test_claim_oldest_first(queue):
+    first = queue.submit({'AOI': 'a.gpkg'})
+    second = queue.submit({'AOI': 'b.gpkg'})
+
+    assert queue.claim(1) == (first, {'AOI': 'a.gpkg'})
+    assert queue.claim(2) == (second, {'AOI': 'b.gpkg'})
+    assert queue.claim(1) is None
+
+    job = queue.job(first)
+    assert job['status'] == 'running'
+    assert job['worker'] == 1
+    assert job['started'] is not None
+
+
+def test_finish_and_fail(queue):
+    done = queue.submit({'AOI': 'a.gpkg'})
+    failed = queue.submit({'AOI': 'b.gpkg'})
+    queue.claim(1)
+    queue.claim(1)
+
+    queue.addMessage(done, "Processing Layers...")
+    queue.addMessage(done, "Creating summary sheet...")
+    queue.finish(done, ['Interest_report_a.xlsx'])
+    queue.fail(failed, "session timed out")
+
+    assert queue.job(done)['artifacts'] == ['Interest_report_a.xlsx']
+    assert [message for seq, message in queue.messages(done)] == ["Processing Layers...", "Creating summary sheet..."]
+    assert queue.messages(done, after=queue.messages(done)[0][0]) == queue.messages(done)[1:]
+    assert queue.job(failed)['error'] == "session timed out"
+    assert queue.counts() == {'queued': 0, 'running': 0, 'done': 1, 'failed': 1}
+    assert queue.job(999) is None
+
+
+def test_requeue(queue):
+    job = queue.submit({'AOI': 'a.gpkg'})
+    queue.claim(1)
+
+    assert queue.requeue() == 1
+    assert queue.job(job)['status'] == 'queued'
+    assert queue.job(job)['worker'] is None
+    assert queue.claim(2)[0] == job
+
+
+def test_claimed_once(queue):
+    jobs = [queue.submit({'report': i}) for i in range(40)]
+    claimed = []
+    lock = threading.Lock()
+
+    def work(worker):
+        while True:
+            job = queue.claim(worker)
+            if job is None:
+                return
+            with lock:
+                claimed.append(job[0])
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == jobs
+    assert queue.counts()['running'] == len(jobs)
@@ -0,0 +1,49 @@
+'''
+Reading and replacing the JSON files of the IOR's manifests and caches
+'''
+
+import os
+import threading
+from IOR_JSON_File import readJSON, writeJSON
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'cache' / 'manifest.json')
+
+    writeJSON(path, {'a': 1}, indent=2)
+    writeJSON(path, {'a': 2})
+
+    assert readJSON(path) == {'a': 2}
+    assert os.listdir(str(tmp_path / 'cache')) == ['manifest.json']
+
+
+def test_missing_or_truncated(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    assert readJSON(path) is None
+
+    with open(path, 'w') as f:
+        f.write('{"a": ')
+    assert readJSON(path) is None
+
+
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / 'manifest.json')
+    errors = []
+
+    # Each writer has a temporary file of its own, so the file is always one writer's whole data
+    def write(writer):
+        try:
+            for i in range(50):
+                writeJSON(path, {'writer': writer, 'values': [i] * 100})
+                assert len(readJSON(path)['values']) == 100
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(writer,)) for writer in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(str(tmp_path)) == ['manifest.json']
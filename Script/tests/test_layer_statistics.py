@@ -0,0 +1,53 @@
+'''
+Round trips and reloads of the layer statistics written by the snapshot refresh job
+'''
+
+import os
+import time
+import pytest
+import IOR_Layer_Catalog
+from IOR_Layer_Catalog import LayerStatistics, loadStatistics
+from conftest import catalogRow
+
+
+@pytest.fixture
+def statistics(tmp_path, monkeypatch):
+    # Statistics are read from the default path, so point it at the test folder
+    path = str(tmp_path / 'layer_statistics.json')
+    monkeypatch.setattr(IOR_Layer_Catalog, 'statisticsPath', path)
+    return LayerStatistics(path)
+
+
+def test_statistics_round_trip(statistics):
+    row = catalogRow('G1', 'Roads', 'ROADS')
+    sameSource = catalogRow('G2', 'Roads (copy)', 'ROADS')
+
+    statistics.record(row, 30, (0, 0, 100, 100), 'Polyline')
+    statistics.save()
+
+    loaded = loadStatistics()
+    assert loaded.get(sameSource)['count'] == 30
+    assert loaded.get(sameSource)['extent'] == [0, 0, 100, 100]
+    assert loaded.get(catalogRow('G1', 'Roads', 'ROADS', "ROAD_CLASS = 'highway'")) is None
+    assert loadStatistics() is loaded
+
+
+def test_statistics_reloaded_when_changed(statistics):
+    row = catalogRow('G1', 'Roads', 'ROADS')
+    statistics.record(row, 30, None, 'Polyline')
+    statistics.save()
+    assert loadStatistics().get(row)['count'] == 30
+
+    statistics.record(row, 31, None, 'Polyline')
+    statistics.save()
+    os.utime(statistics.path, (time.time() + 10, time.time() + 10))
+
+    assert loadStatistics().get(row)['count'] == 31
+
+
+def test_statistics_unreadable(statistics):
+    with open(statistics.path, 'w') as f:
+        f.write('{"a": {"count": ')
+
+    # Statistics cut short by a crash are read as none, so every layer is counted again
+    assert LayerStatistics(statistics.path).entries == {}
@@ -0,0 +1,127 @@
+'''
+processDataBatch and the quick screen on the shapely engine: a batch of AOIs processed sequentially and with a pool of workers
+'''
+
+import os
+import pytest
+from shapely.geometry import box, LineString, Point
+from IOR_Layer_Catalog import loadCatalog
+from conftest import catalogRow, writeFeatures, writeLayerList
+
+ior = pytest.importorskip('Interest_Overlap_Report_v6_0_0')
+
+layerNames = ['Parcels', 'Roads', 'Wells']
+idFields = {'Parcels': 'PARCEL_ID', 'Roads': 'ROAD_ID', 'Wells': 'WELL_ID'}
+
+
+@pytest.fixture
+def layers(engine, tmp_path):
+    data = os.path.join(engine.dataFolder, 'BCGW')
+    os.makedirs(data)
+    writeFeatures(engine, os.path.join(data, 'PARCELS.gpkg'), 'Polygon', {'PARCEL_ID': 'int'},
+                  [({'PARCEL_ID': i * 10 + j}, box(i * 100, j * 100, i * 100 + 100, j * 100 + 100)) for i in range(10) for j in range(10)])
+    writeFeatures(engine, os.path.join(data, 'ROADS.gpkg'), 'LineString', {'ROAD_ID': 'int'},
+                  [({'ROAD_ID': i}, LineString([(0, i * 90 + 5), (1000, i * 90 + 5)])) for i in range(10)])
+    writeFeatures(engine, os.path.join(data, 'WELLS.gpkg'), 'Point', {'WELL_ID': 'int'},
+                  [({'WELL_ID': i}, Point(i * 37 % 1000, i * 53 % 1000)) for i in range(100)])
+
+    return writeLayerList(str(tmp_path / 'layers.xlsx'),
+                          [catalogRow('G1', 'Parcels', 'PARCELS', category='Land', fields=['PARCEL_ID'], sort='PARCEL_ID,ASCENDING'),
+                           catalogRow('G2', 'Roads', 'ROADS', buffer=50, category='Transport', fields=['ROAD_ID']),
+                           catalogRow('G3', 'Wells', 'WELLS', category='Water', fields=['WELL_ID'])])
+
+
+@pytest.fixture
+def batch(engine, tmp_path):
+    aoi = writeFeatures(engine, str(tmp_path / 'aoi.gpkg'), 'Polygon', {'NAME': 'str'},
+                        [({'NAME': 'A'}, box(150, 150, 420, 380)), ({'NAME': 'B'}, box(610, 60, 880, 240))])
+
+    output_folder = str(tmp_path / 'out')
+    scratchGDB = engine.createWorkspace(output_folder, 'scratch.gdb')
+    batchAOI, aoiDict = ior.processAOIBatch(aoi, '', 'NAME', output_folder, scratchGDB, engine)
+    return batchAOI, aoiDict, output_folder, scratchGDB
+
+
+def processLayers(engine, layers, batch, workers, poolType='process'):
+    batchAOI, aoiDict, output_folder, scratchGDB = batch
+    catalog = loadCatalog(layers, engine)
+
+    results = ior.processDataBatch(batchAOI, aoiDict, catalog, output_folder, scratchGDB, layerNames, engine, workers, poolType)
+
+    # The counts and the IDs of the clipped features of each AOI, wherever the workers wrote them
+    clipped = {}
+    for aoiKey, (layerListDict, collectFeatsCountDict) in results.items():
+        clipped[aoiKey] = {}
+        for category in layerListDict.values():
+            for name, info in category.items():
+                if info[0] != "No Overlap Found":
+                    clipped[aoiKey][name] = sorted(row[0] for row in engine.readTable(info[0], [idFields[name]]))
+    return dict((aoiKey, (dict(collectFeatsCountDict), clipped[aoiKey])) for aoiKey, (layerListDict, collectFeatsCountDict) in results.items())
+
+
+def test_batch_counts(engine, layers, batch):
+    results = processLayers(engine, layers, batch, 1)
+
+    counts, clipped = results['A']
+    assert counts == {'Land': {'Parcels': [12, 'layer_G1']}, 'Transport': {'Roads': [3, 'layer_G2']}, 'Water': {'Wells': [7, 'layer_G3']}}
+    assert clipped == {'Parcels': [11, 12, 13, 21, 22, 23, 31, 32, 33, 41, 42, 43], 'Roads': [2, 3, 4], 'Wells': [5, 6, 7, 60, 61, 62, 63]}
+
+    counts, clipped = results['B']
+    assert counts == {'Land': {'Parcels': [9, 'layer_G1']}, 'Transport': {'Roads': [3, 'layer_G2']}, 'Water': {'Wells': [6, 'layer_G3']}}
+    assert clipped == {'Parcels': [60, 61, 62, 70, 71, 72, 80, 81, 82], 'Roads': [1, 2, 3], 'Wells': [20, 21, 22, 23, 77, 98]}
+
+
+@pytest.mark.parametrize('poolType', ['process', 'thread'])
+def test_workers_match_sequential(engine, layers, batch, poolType):
+    sequential = processLayers(engine, layers, batch, 1)
+
+    assert processLayers(engine, layers, batch, 2, poolType) == sequential
+
+
+
+@pytest.mark.parametrize('poolType', ['process', 'thread'])
+def test_worker_error_traceback(engine, layers, batch, tmp_path, poolType):
+    batchAOI, aoiDict, output_folder, scratchGDB = batch
+    catalog = loadCatalog(writeLayerList(str(tmp_path / 'missing.xlsx'), [catalogRow('G1', 'Parcels', 'PARCELS', category='Land'),
+                                                                         catalogRow('G4', 'Missing', 'MISSING', category='Land')]), engine)
+
+    # The error raised by the run carries the traceback of the layer's error in the worker
+    with pytest.raises(RuntimeError) as error:
+        ior.processDataBatch(batchAOI, aoiDict, catalog, output_folder, scratchGDB, ['Parcels', 'Missing'], engine, 2, poolType)
+    assert "Layer 'Missing' failed in a pool worker" in str(error.value)
+    assert "Traceback (most recent call last)" in str(error.value)
+    assert "in processLayer" in str(error.value)
+
+
+def test_arcpy_runs_one_worker(engine, layers, batch, capsys):
+    sequential = processLayers(engine, layers, batch, 1)
+
+    # Pool workers could not open the arcpy engine's database connections
+    engine.name = 'arcpy'
+    assert processLayers(engine, layers, batch, 2) == sequential
+
+    out = capsys.readouterr().out
+    assert "Parallel Workers are not used with the arcpy engine" in out
+    assert "workers" not in out.split("Parallel Workers are not used")[1]
+
+def test_quick_screen(engine, layers, batch):
+    batchAOI, aoiDict, output_folder, scratchGDB = batch
+    catalog = loadCatalog(layers, engine)
+
+    # The screen counts what a full run would clip, without exporting or clipping anything
+    screened = ior.screenData(aoiDict, catalog, layerNames, engine)
+    processed = processLayers(engine, layers, batch, 1)
+    assert dict((aoiKey, dict(counts)) for aoiKey, (layerListDict, counts) in screened.items()) == \
+        dict((aoiKey, counts) for aoiKey, (counts, clipped) in processed.items())
+
+    firstHit = ior.screenData(aoiDict, catalog, layerNames, engine, firstHit=True)
+    assert dict(firstHit['A'][1]) == {'Land': {'Parcels': [None, 'layer_G1']}, 'Transport': {'Roads': [None, 'layer_G2']}, 'Water': {'Wells': [None, 'layer_G3']}}
+
+
+def test_overlaps_any(engine, layers):
+    aoiPath = writeFeatures(engine, os.path.join(engine.dataFolder, 'aoi.gpkg'), 'Polygon', {'NAME': 'str'}, [({'NAME': 'A'}, box(1010, 250, 1100, 350))])
+    wells = engine.makeLayer(engine.sourcePath('BCGW', 'WELLS'), 'wells')
+
+    # The AOI is east of every well, so only a buffered screen finds one
+    assert not engine.overlapsAny(wells, aoiPath)
+    assert engine.overlapsAny(wells, aoiPath, 100)
@@ -0,0 +1,60 @@
+'''
+ID sets and literals of the Oracle query layers, and the SQLite stand-in of the warehouse
+'''
+
+import json
+import sqlite3
+from IOR_SQL_Templates import SQLTemplate
+from IOR_Query_Layer import oracleIdSet, oracleLiteral, oracleLiteralLength, SQLiteQueryLayer
+
+tenureSQL = '''
+SELECT
+  t.TENURE_NUMBER_ID,
+  t.OWNER_NAME
+FROM
+  mta.mta_tenure t -- :commented
+WHERE
+  t.TENURE_NUMBER_ID IN (:ids)
+  AND t.STATUS = :status
+  AND t.NOTE <> 'a :quoted value'
+ORDER BY
+  t.TENURE_NUMBER_ID;
+'''
+
+
+def test_oracle_id_set_pieces():
+    ids = ["ID-%05d" % i for i in range(1000)]
+
+    sql = oracleIdSet(ids)
+
+    pieces = sql[sql.index("(") + 1:sql.index(", '$[*]'")].split(" || ")
+    assert len(pieces) > 1
+    assert all(len(piece) <= oracleLiteralLength for piece in pieces)
+    assert json.loads(''.join(piece[len("TO_CLOB('"):-len("')")] for piece in pieces)) == sorted(ids)
+    assert "VARCHAR2(4000)" in sql
+
+
+def test_oracle_literals():
+    assert oracleLiteral(None) == "NULL"
+    assert oracleLiteral(12) == "12"
+    assert oracleLiteral("O'Brien") == "'O''Brien'"
+
+
+def test_sqlite_query_layer(tmp_path):
+    connection = sqlite3.connect(str(tmp_path / 'MTA.sqlite'))
+    connection.execute("CREATE TABLE mta_tenure (TENURE_NUMBER_ID INTEGER, OWNER_NAME TEXT, STATUS TEXT, NOTE TEXT)")
+    connection.executemany("INSERT INTO mta_tenure VALUES (?, ?, ?, '')", [(1, 'a', 'GOOD'), (2, 'b', 'GOOD'), (3, 'c', 'BAD'), (4, 'd', 'GOOD')])
+    connection.commit()
+    connection.close()
+
+    queryLayer = SQLiteQueryLayer(str(tmp_path))
+    try:
+        template = SQLTemplate('Tenure.sql', tenureSQL)
+        columns, rows = queryLayer.execute(template, {'ids': [1, 3, 4], 'status': 'GOOD'})
+        assert columns == ['TENURE_NUMBER_ID', 'OWNER_NAME']
+        assert rows == [(1, 'a'), (4, 'd')]
+
+        # The ID set of the next query replaces the last one
+        assert queryLayer.execute(template, {'ids': [2], 'status': 'GOOD'})[1] == [(2, 'b')]
+    finally:
+        queryLayer.close()
@@ -0,0 +1,72 @@
+'''
+Handing a toolbox report to the report service, which is only done for a service logged in as the tool's user
+'''
+
+import socket
+import threading
+import time
+import pytest
+import IOR_Report_Service
+from IOR_Report_Service import ReportService, requestService, submitReport
+
+pytest.importorskip('Interest_Overlap_Report_v6_0_0')
+
+
+def freeAddress():
+    listener = socket.socket()
+    listener.bind(('localhost', 0))
+    address = listener.getsockname()
+    listener.close()
+    return ('localhost', address[1])
+
+
+@pytest.fixture
+def service(tmp_path):
+    '''
+    A service with no workers, logged in as ANALYST, so the reports it is handed stay queued
+    '''
+    service = ReportService(0, 'shapely', username='ANALYST', address=freeAddress(), folder=str(tmp_path / 'service'))
+    thread = threading.Thread(target=service.serve)
+    thread.daemon = True
+    thread.start()
+    while not service.running:
+        time.sleep(0.05)
+
+    yield service
+
+    requestService({'action': 'stop'}, service.address, service.folder)
+    thread.join(5)
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    messages = []
+    monkeypatch.setattr(IOR_Report_Service, 'addMessage', messages.append)
+    return messages
+
+
+def test_no_service(tmp_path, messages):
+    assert submitReport({'AOI': 'aoi.shp', 'layerList': ['Roads']}, 'ANALYST', freeAddress(), str(tmp_path / 'service')) is None
+    assert messages == ["No IOR report service is running, so the report is run here..."]
+
+
+def test_service_status(service):
+    status = requestService({'action': 'status'}, service.address, service.folder)
+
+    assert status['username'] == 'ANALYST'
+    assert status['engine'] == 'shapely'
+
+
+def test_other_login_runs_here(service, messages):
+    assert submitReport({'AOI': 'aoi.shp', 'layerList': ['Roads']}, 'SOMEONE', service.address, service.folder) is None
+    assert messages == ["The IOR report service runs reports as ANALYST, not SOMEONE, so the report is run here..."]
+    assert service.queue.counts()['queued'] == 0
+
+
+def test_same_login_handed_over(service, messages):
+    # The service checks the parameters of the report it is handed, so a report with no layers comes back as an error
+    with pytest.raises(Exception) as error:
+        submitReport({'AOI': 'aoi.shp'}, 'analyst', service.address, service.folder)
+
+    assert "The 'layerList' report parameter is required" in str(error.value)
+    assert messages[0].startswith("Handing the report to the IOR report service running as ANALYST on localhost:")
@@ -0,0 +1,129 @@
+'''
+Cell values, formats and workbook layout of the xlsx report writer, read back with openpyxl
+'''
+
+import os
+import zipfile
+import datetime
+import pytest
+from IOR_Report_Writer import cellValue, displayText, imageSize, getReportWriter
+
+pytest.importorskip('xlsxwriter')
+openpyxl = pytest.importorskip('openpyxl')
+
+imageFolder = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'Image')
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    '''
+    A function to save a report writer's workbook and read it back
+    '''
+    def save(writer):
+        path = writer.save(str(tmp_path / 'report.xlsx'))
+        return openpyxl.load_workbook(path)
+    return save
+
+
+def test_cell_values():
+    assert cellValue(12) == (12, 0)
+    assert cellValue(1.5) == (1.5, '0.000')
+    assert cellValue('0042') == (42, 0)
+    assert cellValue('2.5') == (2.5, None)
+    assert cellValue('Tenure') == ('Tenure', None)
+    assert cellValue(datetime.datetime(2024, 3, 5)) == (datetime.datetime(2024, 3, 5), 'yyyy-mmm-dd')
+
+    # Excel cannot store dates before 1900, so they are written as text
+    assert cellValue(datetime.datetime(1875, 6, 1)) == ('1875-Jun-01', None)
+
+
+def test_display_text():
+    assert displayText(None) == ''
+    assert displayText('=HYPERLINK("https://example.com/1","Tenure 1")') == 'Tenure 1'
+    assert displayText('="Short"&CHAR(10)&"A longer line"') == 'A longer line'
+    assert displayText(1234.5) == '1,234.500'
+    assert displayText(datetime.datetime(2024, 3, 5)) == '2024-Mar-05'
+
+
+def test_image_size():
+    assert imageSize(os.path.join(imageFolder, 'BC_EMLC_V_RGB_pos.png')) is not None
+    assert imageSize(os.path.join(imageFolder, 'BC_EMLC_H_RGB_pos.jpg')) is not None
+
+
+def test_cells_and_formats(workbook):
+    writer = getReportWriter('xlsx')
+    sheet = writer.addSheet('Summary')
+
+    # Cells are buffered, so they can be written out of row order
+    sheet.cell(3, 1, 'Tenure - All', size=12, bold=True, fillcolor=15)
+    sheet.cell(1, 1, 'Interest Report', size=16, underline=True, fontcolor=3)
+    sheet.cell(1, 2, '=HYPERLINK("https://example.com","iMapBC")')
+    sheet.cell(2, 2, 12.25)
+    sheet.cell(2, 3, '0042')
+    sheet.formatRange(2, 2, 2, 3, size=8)
+    sheet.borderAround(1, 1, 3, 2)
+
+    book = workbook(writer)
+    ws = book['Summary']
+
+    assert ws['A1'].value == 'Interest Report'
+    assert ws['A1'].font.size == 16
+    assert ws['A1'].font.underline == 'single'
+    assert ws['A1'].font.color.rgb.endswith('FF0000')
+    assert ws['A3'].font.bold
+    assert ws['A3'].fill.fgColor.rgb.endswith('C0C0C0')
+    assert ws['B1'].value == '=HYPERLINK("https://example.com","iMapBC")'
+    assert ws['B2'].value == 12.25
+    assert ws['B2'].number_format == '0.000'
+    assert ws['C2'].value == 42
+    assert ws['C2'].font.size == 8
+
+    # The border goes around the outside of the range only
+    assert (ws['A1'].border.top.style, ws['A1'].border.left.style, ws['A1'].border.bottom.style) == ('thin', 'thin', None)
+    assert (ws['B3'].border.bottom.style, ws['B3'].border.right.style, ws['B3'].border.top.style) == ('thin', 'thin', None)
+    assert ws['B2'].border.right.style == 'thin'
+    assert ws['C2'].border.right.style is None
+
+
+def test_sheets_groups_and_widths(workbook):
+    writer = getReportWriter('xlsx')
+    summary = writer.addSheet('Summary')
+    details = writer.addSheet('Interest_Report')
+
+    details.cell(1, 1, 'Roads')
+    for excelrow in range(2, 6):
+        details.cell(excelrow, 1, 'A much longer feature description')
+    details.groupRows(2, 5)
+    details.autoFitColumns()
+    details.cell(6, 1, '="Line one"&CHAR(10)&"Line two"', wrap=True)
+    summary.cell(1, 1, 'Summary')
+    summary.hideGridlines()
+    summary.activate()
+
+    book = workbook(writer)
+
+    assert book.sheetnames == ['Summary', 'Interest_Report']
+    assert book.active.title == 'Summary'
+    assert not book['Summary'].sheet_view.showGridLines
+
+    ws = book['Interest_Report']
+    assert [ws.row_dimensions[excelrow].outlineLevel for excelrow in range(1, 7)] == [0, 1, 1, 1, 1, 0]
+    assert ws.column_dimensions['A'].width > len('A much longer feature description')
+    assert ws.row_dimensions[6].height == pytest.approx(2 * 10 * 1.3)
+
+
+def test_picture(tmp_path):
+    writer = getReportWriter('xlsx')
+    sheet = writer.addSheet('Summary')
+    sheet.insertPicture(os.path.join(imageFolder, 'BC_EMLC_V_RGB_pos.png'), 1, 1, 60, 80)
+
+    # A missing logo is left out rather than failing the report
+    sheet.insertPicture(os.path.join(imageFolder, 'missing.png'), 5, 1, 60, 80)
+
+    with zipfile.ZipFile(writer.save(str(tmp_path / 'report.xlsx'))) as xlsx:
+        assert [name for name in xlsx.namelist() if name.startswith('xl/media/')] == ['xl/media/image1.png']
+
+
+def test_unknown_writer():
+    with pytest.raises(ValueError):
+        getReportWriter('pdf')
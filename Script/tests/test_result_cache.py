@@ -0,0 +1,86 @@
+'''
+Keys, reuse and eviction of the layer result cache
+'''
+
+import os
+import time
+import pytest
+from shapely.geometry import box
+from IOR_Result_Cache import ResultCache
+from conftest import SnapshotVersions, catalogRow, writeFeatures
+
+
+@pytest.fixture
+def aoi(engine, workspace):
+    return writeFeatures(engine, os.path.join(workspace, 'AOI'), 'Polygon', {'NAME': 'str'}, [({'NAME': 'A'}, box(0, 0, 100, 100))])
+
+
+def test_result_keys(engine, aoi, tmp_path):
+    cache = ResultCache(str(tmp_path / 'results'))
+    aoiDict = {'A': {'processedAOI': aoi}}
+    row = catalogRow('G1', 'Roads', 'ROADS')
+
+    keys = cache.layerKeys(engine, row, aoiDict, SnapshotVersions({'ROADS': 'v1'}))
+
+    assert keys == cache.layerKeys(engine, row, aoiDict, SnapshotVersions({'ROADS': 'v1'}))
+    assert keys != cache.layerKeys(engine, row, aoiDict, SnapshotVersions({'ROADS': 'v2'}))
+    assert keys != cache.layerKeys(engine, catalogRow('G1', 'Roads', 'ROADS', buffer=500), aoiDict, SnapshotVersions({'ROADS': 'v1'}))
+
+    # Live layers and query layers are never cached
+    assert cache.layerKeys(engine, row, aoiDict, None) is None
+    assert cache.layerKeys(engine, row, aoiDict, SnapshotVersions({})) is None
+    assert cache.layerKeys(engine, catalogRow('G2', 'Tenure', 'TENURES', queryLayer='Tenure.sql;ID'), aoiDict, SnapshotVersions({'TENURES': 'v1'})) is None
+
+
+def test_result_store_and_fetch(engine, workspace, tmp_path):
+    folder = str(tmp_path / 'results')
+    clipFC = writeFeatures(engine, os.path.join(workspace, 'G1_clip'), 'Polygon', {'ID': 'int'}, [({'ID': 1}, box(0, 0, 10, 10))])
+
+    cache = ResultCache(folder)
+    cache.store(engine, 'overlap', clipFC, 1)
+    cache.store(engine, 'none', None, 0)
+    cache.save(engine)
+
+    cache = ResultCache(folder)
+    copyFC = os.path.join(workspace, 'G1_clip_copy')
+    assert cache.fetch(engine, 'overlap', copyFC) == (copyFC, 1)
+    assert engine.getCount(copyFC) == 1
+    assert cache.fetch(engine, 'none', copyFC) == (None, 0)
+    assert cache.fetch(engine, 'missing', copyFC) is None
+
+
+def test_result_eviction(engine, tmp_path):
+    folder = str(tmp_path / 'results')
+
+    cache = ResultCache(folder, maxEntries=2)
+    for key in ('oldest', 'older', 'newest'):
+        cache.store(engine, key, None, 0)
+    cache.manifest['oldest']['used'] = time.time() - 300
+    cache.manifest['older']['used'] = time.time() - 200
+    cache.save(engine)
+
+    assert sorted(ResultCache(folder).manifest) == ['newest', 'older']
+
+
+def test_result_eviction_by_size(engine, workspace, tmp_path):
+    folder = str(tmp_path / 'results')
+    clipFC = writeFeatures(engine, os.path.join(workspace, 'G1_clip'), 'Polygon', {'ID': 'int'}, [({'ID': 1}, box(0, 0, 10, 10))])
+
+    cache = ResultCache(folder)
+    cache.store(engine, 'first', clipFC, 1)
+    cache.manifest['first']['used'] = time.time() - 100
+    cache.store(engine, 'second', clipFC, 1)
+    cache.maxSize = cache.manifest['second']['size']
+    cache.save(engine)
+
+    assert list(ResultCache(folder).manifest) == ['second']
+    assert not os.path.exists(os.path.join(folder, 'R_first.gpkg'))
+
+
+def test_result_manifest_unreadable(engine, tmp_path):
+    folder = tmp_path / 'results'
+    folder.mkdir()
+    (folder / 'results.json').write_text('{"overlap": {"count": ')
+
+    # A manifest cut short by a crash only loses the cached results
+    assert ResultCache(str(folder)).manifest == {}
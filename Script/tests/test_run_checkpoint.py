@@ -0,0 +1,79 @@
+'''
+Round trips of the run checkpoint kept next to a report's scratch geodatabase
+'''
+
+import os
+import pytest
+from shapely.geometry import box
+from IOR_Run_Checkpoint import RunCheckpoint, checkpointPath
+from conftest import catalogRow, writeFeatures
+
+parameters = {'AOI': 'aoi.gpkg', 'engine': 'shapely'}
+
+
+@pytest.fixture
+def aoiDict(engine, workspace):
+    return dict((name, {'processedAOI': writeFeatures(engine, os.path.join(workspace, 'AOI_' + name), 'Polygon', {'NAME': 'str'}, [({'NAME': name}, geom)])})
+                for name, geom in (('A', box(0, 0, 100, 100)), ('B', box(500, 500, 600, 600))))
+
+
+@pytest.fixture
+def clips(engine, workspace):
+    return dict((name, writeFeatures(engine, os.path.join(workspace, 'G1_clip_' + name), 'Polygon', {'ID': 'int'}, [({'ID': 1}, box(0, 0, 10, 10))]))
+                for name in ('A', 'B'))
+
+
+def test_checkpoint_round_trip(engine, workspace, aoiDict, clips):
+    row = catalogRow('G1', 'Roads', 'ROADS')
+
+    checkpoint = RunCheckpoint(workspace, parameters)
+    checkpoint.record(engine, row, aoiDict, {'A': (clips['A'], 1), 'B': (None, 0)})
+    checkpoint.fail(catalogRow('G2', 'Wells', 'WELLS'), RuntimeError("session timed out"))
+
+    assert checkpointPath(workspace) == os.path.splitext(workspace)[0] + '_checkpoint.json'
+    assert not os.path.exists(checkpointPath(workspace) + '.tmp')
+
+    resumed = RunCheckpoint(workspace, parameters, resume=True)
+    assert resumed.resumed
+    assert resumed.state['failed']['name'] == 'Wells'
+    assert resumed.fetch(engine, row, 'A', aoiDict['A']) == (clips['A'], 1)
+    assert resumed.fetch(engine, row, 'B', aoiDict['B']) == (None, 0)
+    assert resumed.fetch(engine, catalogRow('G2', 'Wells', 'WELLS'), 'A', aoiDict['A']) is None
+
+
+def test_checkpoint_not_resumed(engine, workspace, aoiDict, clips):
+    row = catalogRow('G1', 'Roads', 'ROADS')
+    RunCheckpoint(workspace, parameters).record(engine, row, aoiDict, {'A': (clips['A'], 1)})
+
+    # A run that is not resumed, or was made with other parameters, starts over
+    assert RunCheckpoint(workspace, parameters).fetch(engine, row, 'A', aoiDict['A']) is None
+    RunCheckpoint(workspace, parameters).record(engine, row, aoiDict, {'A': (clips['A'], 1)})
+    assert not RunCheckpoint(workspace, dict(parameters, AOI='other.gpkg'), resume=True).resumed
+
+
+def test_checkpoint_checks_inputs(engine, workspace, aoiDict, clips):
+    row = catalogRow('G1', 'Roads', 'ROADS')
+    RunCheckpoint(workspace, parameters).record(engine, row, aoiDict, {'A': (clips['A'], 1)})
+
+    resumed = RunCheckpoint(workspace, parameters, resume=True)
+
+    # The layer's row changed, the AOI changed or the clip is gone
+    assert resumed.fetch(engine, catalogRow('G1', 'Roads', 'ROADS', buffer=500), 'A', aoiDict['A']) is None
+    assert resumed.fetch(engine, row, 'A', aoiDict['B']) is None
+    engine.delete(clips['A'])
+    assert resumed.fetch(engine, row, 'A', aoiDict['A']) is None
+
+
+def test_checkpoint_remove(workspace):
+    checkpoint = RunCheckpoint(workspace, parameters)
+    checkpoint.remove()
+
+    assert not os.path.exists(checkpoint.path())
+
+
+def test_checkpoint_unreadable(workspace):
+    with open(checkpointPath(workspace), 'w') as f:
+        f.write('{"parameters": ')
+
+    # A checkpoint cut short by a crash is not resumed
+    assert not RunCheckpoint(workspace, parameters, resume=True).resumed
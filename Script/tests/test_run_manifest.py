@@ -0,0 +1,65 @@
+'''
+Round trips of the run manifest kept next to a report's geodatabase
+'''
+
+import os
+import json
+import pytest
+import IOR_Layer_Catalog
+from shapely.geometry import box
+from IOR_Run_Manifest import RunManifest
+from IOR_Layer_Catalog import LayerStatistics
+from conftest import SnapshotVersions, catalogRow, writeFeatures
+
+
+@pytest.fixture
+def aoiDict(engine, workspace):
+    return dict((name, {'processedAOI': writeFeatures(engine, os.path.join(workspace, 'AOI_' + name), 'Polygon', {'NAME': 'str'}, [({'NAME': name}, geom)])})
+                for name, geom in (('A', box(0, 0, 100, 100)), ('B', box(500, 500, 600, 600))))
+
+
+@pytest.fixture
+def clips(engine, workspace):
+    return dict((name, writeFeatures(engine, os.path.join(workspace, 'G1_clip_' + name), 'Polygon', {'ID': 'int'}, [({'ID': 1}, box(0, 0, 10, 10))]))
+                for name in ('A', 'B'))
+
+
+def test_manifest_round_trip(engine, workspace, aoiDict, clips):
+    row = catalogRow('G1', 'Roads', 'ROADS')
+
+    manifest = RunManifest(workspace)
+    inputs = manifest.layerInputs(engine, row, aoiDict, SnapshotVersions({'ROADS': 'v1'}))
+    manifest.record(row, 'A', inputs['A'], clips['A'], 1)
+    manifest.record(row, 'B', inputs['B'], None, 0)
+    manifest.save()
+
+    with open(manifest.path(), 'r') as f:
+        assert sorted(json.load(f)) == ['G1|A', 'G1|B']
+
+    manifest = RunManifest(workspace)
+    assert manifest.fetch(engine, row, 'A', inputs['A']) == (clips['A'], 1)
+    assert manifest.fetch(engine, row, 'B', inputs['B']) == (None, 0)
+    assert manifest.fetch(engine, row, 'A', inputs['B']) is None
+
+    # A new snapshot of the source is a new version
+    assert manifest.layerInputs(engine, row, aoiDict, SnapshotVersions({'ROADS': 'v2'}))['A'] != inputs['A']
+
+
+def test_manifest_live_layers_not_versioned(engine, workspace, aoiDict, tmp_path, monkeypatch):
+    monkeypatch.setattr(IOR_Layer_Catalog, 'statisticsPath', str(tmp_path / 'layer_statistics.json'))
+    row = catalogRow('G1', 'Roads', 'ROADS')
+
+    statistics = LayerStatistics()
+    statistics.record(row, 30, None, 'Polygon')
+    statistics.save()
+
+    # A live source may have been edited since the refresh job recorded its statistics, so it is always processed again
+    manifest = RunManifest(workspace)
+    assert manifest.layerInputs(engine, row, aoiDict, None) is None
+    assert manifest.layerInputs(engine, row, aoiDict, SnapshotVersions({})) is None
+
+
+def test_manifest_query_layers_not_versioned(engine, workspace, aoiDict):
+    row = catalogRow('G2', 'Tenure', 'TENURES', queryLayer='Tenure.sql;ID')
+
+    assert RunManifest(workspace).layerInputs(engine, row, aoiDict, None) is None
@@ -0,0 +1,75 @@
+'''
+Schemas of the layers kept between runs for as long as their source keeps the same version
+'''
+
+import os
+import pytest
+import IOR_Layer_Catalog
+from IOR_Schema_Cache import SchemaCache
+from IOR_Layer_Catalog import LayerStatistics
+from conftest import SnapshotVersions, catalogRow, writeFeatures
+
+
+@pytest.fixture
+def statistics(tmp_path, monkeypatch):
+    # Statistics are read from the default path, so point it at the test folder
+    path = str(tmp_path / 'layer_statistics.json')
+    monkeypatch.setattr(IOR_Layer_Catalog, 'statisticsPath', path)
+    return LayerStatistics(path)
+
+
+def test_schema_read_once_per_version(engine, workspace, tmp_path):
+    features = writeFeatures(engine, os.path.join(workspace, 'ROADS'), 'LineString', {'ROAD_ID': 'int', 'NAME': 'str'}, [])
+    row = catalogRow('G1', 'Roads', 'ROADS')
+    folder = str(tmp_path / 'schemas')
+
+    schemas = SchemaCache(folder, SnapshotVersions({'ROADS': 'v1'}))
+    assert [field.name for field in schemas.fields(engine, row, features)] == ['ROAD_ID', 'NAME']
+    assert schemas.shapeType(engine, row, features) == 'Polyline'
+    schemas.save()
+
+    def unread():
+        raise AssertionError("schema read again")
+
+    # A later run reads the schema of the same source version from schemas.json
+    schemas = SchemaCache(folder, SnapshotVersions({'ROADS': 'v1'}))
+    assert [field[0] for field in schemas.lookup(engine, row, 'fields', unread)] == ['ROAD_ID', 'NAME']
+
+    # and reads it again once the source has a new version
+    schemas = SchemaCache(folder, SnapshotVersions({'ROADS': 'v2'}))
+    assert schemas.lookup(engine, row, 'shapeType', lambda: 'Polygon') == 'Polygon'
+
+
+def test_schema_versions(engine, statistics):
+    row = catalogRow('G1', 'Roads', 'ROADS')
+    schemas = SchemaCache()
+
+    # A live source may have changed since the refresh job recorded its statistics, so its schema is only kept for the run
+    statistics.record(row, 30, None, 'Polyline')
+    statistics.save()
+    assert schemas.sourceVersion(engine, row) is None
+    assert SchemaCache(snapshots=SnapshotVersions({})).sourceVersion(engine, row) is None
+
+    assert SchemaCache(snapshots=SnapshotVersions({'ROADS': 'v1'})).sourceVersion(engine, row).endswith('_v1')
+    assert schemas.sourceVersion(engine, catalogRow('G2', 'Tenure', 'TENURES', queryLayer='Tenure.sql;ID')) is None
+
+
+def test_schema_merge_from_worker(engine, workspace):
+    features = writeFeatures(engine, os.path.join(workspace, 'ROADS'), 'LineString', {'ROAD_ID': 'int'}, [])
+    row = catalogRow('G1', 'Roads', 'ROADS')
+
+    worker = SchemaCache(snapshots=SnapshotVersions({'ROADS': 'v1'}))
+    worker.fields(engine, row, features)
+
+    run = SchemaCache(snapshots=SnapshotVersions({'ROADS': 'v1'}))
+    run.merge(worker.changes())
+
+    assert [field[0] for field in run.lookup(engine, row, 'fields', lambda: [])] == ['ROAD_ID']
+
+
+def test_schemas_unreadable(tmp_path):
+    folder = tmp_path / 'schemas'
+    folder.mkdir()
+    (folder / 'schemas.json').write_text('{"a": {"fields": ')
+
+    assert SchemaCache(str(folder)).entries == {}
@@ -0,0 +1,28 @@
+'''
+Fingerprints the snapshot refresh job compares a live source by
+'''
+
+import os
+from shapely.geometry import box
+from IOR_Snapshot_Cache import sourceFingerprint
+from conftest import writeFeatures
+
+
+def test_source_fingerprint(engine, workspace):
+    features = writeFeatures(engine, os.path.join(workspace, 'PARCELS'), 'Polygon', {'ID': 'int', 'when_updated': 'datetime'},
+                             [({'ID': 1, 'when_updated': '2024-03-05T00:00:00'}, box(10, 10, 20, 20)),
+                              ({'ID': 2, 'when_updated': '2024-07-01T00:00:00'}, box(30, 30, 40, 40)),
+                              ({'ID': 3, 'when_updated': None}, box(50, 50, 60, 60))])
+
+    fingerprint = sourceFingerprint(engine, features, None)
+    assert fingerprint['count'] == 3
+    assert fingerprint['maxDate'].startswith('2024-07-01')
+
+    assert sourceFingerprint(engine, features, "ID = 1")['maxDate'].startswith('2024-03-05')
+    assert sourceFingerprint(engine, features, "ID = 3") == {'count': 1, 'maxDate': None}
+
+
+def test_fingerprint_without_dates(engine, workspace):
+    features = writeFeatures(engine, os.path.join(workspace, 'WELLS'), 'Polygon', {'ID': 'int'}, [({'ID': 1}, box(10, 10, 20, 20))])
+
+    assert sourceFingerprint(engine, features, None) == {'count': 1, 'maxDate': None}
@@ -0,0 +1,84 @@
+'''
+Parameters, checks and rendering of the query layer SQL templates
+'''
+
+import pytest
+from IOR_SQL_Templates import SQLTemplate, SQLTemplateRegistry, parameterNames
+from IOR_Query_Layer import oracleIdSet, oracleLiteral
+
+tenureSQL = '''
+SELECT
+  t.TENURE_NUMBER_ID,
+  t.OWNER_NAME
+FROM
+  mta.mta_tenure t -- :commented
+WHERE
+  t.TENURE_NUMBER_ID IN (:ids)
+  AND t.STATUS = :status
+  AND t.NOTE <> 'a :quoted value'
+ORDER BY
+  t.TENURE_NUMBER_ID;
+'''
+
+
+def test_parameters():
+    template = SQLTemplate('Tenure.sql', tenureSQL)
+
+    assert template.parameters == ['ids', 'status']
+    assert template.setParameters == ['ids']
+    assert template.validate() == []
+    assert not template.sql.endswith(';')
+
+
+def test_parameters_skip_casts_and_comments():
+    assert parameterNames("SELECT x::text FROM t /* :a */ WHERE y = :b AND z = :b") == ['b']
+
+
+def test_validate():
+    assert SQLTemplate('update.sql', "UPDATE t SET x = :x").validate() == ["is not a SELECT statement"]
+    assert SQLTemplate('legacy.sql', "SELECT * FROM t WHERE update_query").validate() == \
+        ["uses update_query, write the ID filter as <column> IN (:ids)", "has no :name parameters"]
+    assert "has unbalanced parentheses" in SQLTemplate('open.sql', "SELECT * FROM t WHERE x IN ((:ids)").validate()
+    assert "has an unclosed quote" in SQLTemplate('quote.sql', "SELECT * FROM t WHERE x = 'a AND y = :y").validate()
+
+
+def test_check_parameters():
+    template = SQLTemplate('Tenure.sql', tenureSQL)
+
+    with pytest.raises(ValueError) as error:
+        template.render({'ids': [1], 'owner': 'x'}, oracleIdSet, oracleLiteral)
+    assert "missing: status; unknown: owner" in str(error.value)
+
+
+def test_render_oracle():
+    template = SQLTemplate('Tenure.sql', tenureSQL)
+
+    sql = template.render({'ids': [3, 1, 2, 1], 'status': "GOOD'S"}, oracleIdSet, oracleLiteral)
+
+    assert "t.TENURE_NUMBER_ID IN (SELECT ID FROM JSON_TABLE(TO_CLOB('[1,2,3]'), '$[*]' COLUMNS (ID NUMBER PATH '$')))" in sql
+    assert "t.STATUS = 'GOOD''S'" in sql
+    assert "-- :commented" in sql
+    assert "'a :quoted value'" in sql
+
+
+def test_prepared_once_per_dialect():
+    template = SQLTemplate('Tenure.sql', tenureSQL)
+
+    statement = template.prepare(lambda name: "SELECT ID FROM temp.ior_" + name)
+
+    assert "IN (SELECT ID FROM temp.ior_ids)" in statement
+    assert "t.STATUS = :status" in statement
+    assert template.prepare(lambda name: "SELECT ID FROM temp.ior_" + name) is statement
+
+
+def test_registry(tmp_path):
+    (tmp_path / 'Tenure.sql').write_text(tenureSQL)
+    (tmp_path / 'Old.sql').write_text("SELECT * FROM t WHERE update_query")
+
+    registry = SQLTemplateRegistry(str(tmp_path)).load()
+
+    assert registry.template('Tenure.sql').parameters == ['ids', 'status']
+    with pytest.raises(ValueError):
+        registry.template('Old.sql')
+    with pytest.raises(ValueError):
+        registry.template('Missing.sql')
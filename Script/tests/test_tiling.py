@@ -0,0 +1,82 @@
+'''
+Select and clip against a detailed AOI split into tiles, checked against the same AOI untiled
+'''
+
+import os
+import pytest
+from shapely.geometry import box, LineString, Point
+from IOR_Geometry_Engine import getEngine, quadTiles
+from conftest import writeFeatures
+
+shapely = pytest.importorskip('shapely')
+if shapely.__version__.startswith('1.'):
+    pytest.skip("AOI tiles need Shapely 2", allow_module_level=True)
+
+## A circle of about 1000 vertices
+detailedAOI = Point(500, 500).buffer(400, quad_segs=256)
+
+
+@pytest.fixture
+def aoi(engine, workspace):
+    return writeFeatures(engine, os.path.join(workspace, 'AOI'), 'Polygon', {'NAME': 'str'}, [({'NAME': 'A'}, detailedAOI)])
+
+
+@pytest.fixture
+def tiled(tmp_path):
+    tiledEngine = getEngine('shapely', str(tmp_path / 'data'))
+    tiledEngine.tileVertices = 100
+    return tiledEngine
+
+
+def clipRecords(engine, clipFC, fields):
+    return sorted(engine.readTable(clipFC, fields))
+
+
+def test_quad_tiles():
+    tiles = quadTiles(detailedAOI, 100)
+
+    assert len(tiles) > 1
+    assert all(shapely.get_num_coordinates(tile) <= 100 for tile in tiles)
+    assert sum(tile.area for tile in tiles) == pytest.approx(detailedAOI.area)
+
+
+def test_tiled_select(engine, tiled, workspace, aoi):
+    features = writeFeatures(engine, os.path.join(workspace, 'WELLS'), 'Point', {'ID': 'int'},
+                             [({'ID': i * 10 + j}, Point(i * 100 + 50, j * 100 + 50)) for i in range(10) for j in range(10)])
+
+    assert tiled.selectByIntersect(tiled.makeLayer(features, 'tiled'), aoi) == engine.selectByIntersect(engine.makeLayer(features, 'lyr'), aoi)
+    assert tiled.selectWithinDistance(tiled.makeLayer(features, 'tiled'), aoi, 60) == engine.selectWithinDistance(engine.makeLayer(features, 'lyr'), aoi, 60)
+
+
+@pytest.mark.parametrize('shapeType, geometryType, fields, features', [
+    ('Polygon', 'Polygon', ['ID', 'ORIGINAL_HECTARES', 'OVERLAPPING_HECTARES'],
+     [({'ID': i * 10 + j}, box(i * 100, j * 100, i * 100 + 150, j * 100 + 150)) for i in range(10) for j in range(10)]),
+    ('Polyline', 'LineString', ['ID', 'ORIGINAL_LENGTH', 'OVERLAPPING_LENGTH'],
+     [({'ID': i}, LineString([(0, i * 90 + 7), (1000, i * 90 + 13)])) for i in range(12)]),
+    ('Point', 'Point', ['ID', 'EASTING', 'NORTHING'],
+     [({'ID': i}, Point(i * 37 % 1000, i * 53 % 1000)) for i in range(100)])])
+def test_tiled_clip(engine, tiled, workspace, aoi, shapeType, geometryType, fields, features):
+    # Layers are clipped from their export of the selection, as processLayer does
+    source = engine.copyFeatures(writeFeatures(engine, os.path.join(workspace, 'LAYER'), geometryType, {'ID': 'int'}, features),
+                                 os.path.join(workspace, 'LAYER_selected'))
+
+    expected = clipRecords(engine, engine.clipWithMeasures(source, aoi, os.path.join(workspace, 'LAYER_clip'), shapeType, 50.0), fields)
+    clipped = clipRecords(tiled, tiled.clipWithMeasures(source, aoi, os.path.join(workspace, 'LAYER_tiled'), shapeType, 50.0), fields)
+
+    # One row per feature, with the measures of the untiled clip
+    assert [record[0] for record in clipped] == [record[0] for record in expected]
+    assert clipped == [tuple(pytest.approx(value) for value in record) for record in expected]
+
+
+def test_line_on_tile_edge(engine, tiled, workspace, aoi):
+    # The first tiles meet at x = 500 and y = 500, so the tiles on both sides of each line hand back the same piece of it
+    source = engine.copyFeatures(writeFeatures(engine, os.path.join(workspace, 'LAYER'), 'LineString', {'ID': 'int'},
+                                               [({'ID': 1}, LineString([(500, 0), (500, 1000)])),
+                                                ({'ID': 2}, LineString([(0, 500), (1000, 500)]))]),
+                                 os.path.join(workspace, 'LAYER_selected'))
+    fields = ['ID', 'ORIGINAL_LENGTH', 'OVERLAPPING_LENGTH']
+
+    clipped = clipRecords(tiled, tiled.clipWithMeasures(source, aoi, os.path.join(workspace, 'LAYER_tiled'), 'Polyline', 50.0), fields)
+
+    assert [record[0] for record in clipped] == [1, 2]
+    assert [record[2] for record in clipped] == [pytest.approx(800 / 1000.0, rel=1e-3)] * 2
@@ -38,6 +38,6 @@ FROM
   ON t.DISPOSITION_TRANSACTION_SID = tenants.DISPOSITION_TRANSACTION_SID
 WHERE
   tenants.PRIMARY_CONTACT_YRN = 'Y'
-  AND update_query
+  AND t.INTRID_SID IN (:ids)
 ORDER BY
   t.INTRID_SID
\ No newline at end of file
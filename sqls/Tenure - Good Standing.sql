@@ -78,7 +78,7 @@ from
   inner join mta_acquired_tenure_poly atp 
   on t.tenure_number_id = atp.tenure_number_id
 where
-  update_query
+  t.tenure_number_id IN (:ids)
 order by
   t.tenure_number_id
 
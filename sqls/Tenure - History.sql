@@ -25,6 +25,6 @@ FROM
   inner join MTA.MTA_TITLE_TYPE_CODE tc
   on t.MTA_TITLE_TYPE_CODE = tc.MTA_TITLE_TYPE_CODE
 WHERE
-  update_query
+  t.TENURE_NUMBER_ID IN (:ids)
 ORDER BY
   h.TENURE_NUMBER_ID
\ No newline at end of file